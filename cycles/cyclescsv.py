@@ -1,36 +1,22 @@
-import requests
-import json
+import aiohttp
+import asyncio
 import os
-from dotenv import load_dotenv
+import sys
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Fetch the API key from the environment
-API_KEY = os.getenv("API_KEY")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl.cache import default_cache
+from etl.client import MessierClient, messier_url, require_api_key
+from etl.fingerprint import DatasetHash, StageState
+from etl.upload import upload_json_data
 
 # API Endpoint
-API_URL = "https://api.messier.app/api/v1/virgo/cycle"
-
-# JSONBlob API URL
-JSONBLOB_API_URL = "https://jsonblob.com/api/jsonBlob"
+API_URL = messier_url("virgo/cycle")
+# Content hash and blob URL of the last upload
+STATE_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cycles_state.json")
 
-def fetch_api_data():
+async def fetch_api_data(client):
     """Fetches data from the given API."""
-    if not API_KEY:
-        print("Error: API_KEY not found in the environment. Please check your .env file.")
-        return None
-    try:
-        headers = {
-            "accept": "application/json",
-            "X-API-KEY": API_KEY
-        }
-        response = requests.get(API_URL, headers=headers)
-        response.raise_for_status()  # Raise HTTPError for bad responses
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching data from API: {e}")
-        return None
+    return await client.get_json(API_URL)
 
 def transform_data(api_response):
     """Transforms the API response into the desired JSON structure."""
@@ -43,28 +29,43 @@ def transform_data(api_response):
         }
     return {}
 
-def upload_to_jsonblob(data):
-    """Uploads the transformed JSON to JSONBlob."""
-    try:
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(JSONBLOB_API_URL, headers=headers, json=data)
-        response.raise_for_status()  # Raise HTTPError for bad responses
-        print(f"JSONBlob created successfully! URL: {response.headers.get('Location')}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error uploading data to JSONBlob: {e}")
-
-def main():
+async def run(client):
     # Step 1: Fetch API data
-    api_response = fetch_api_data()
+    with client.metrics.timer("extract", pipeline="cycles"):
+        api_response = await fetch_api_data(client)
     if not api_response:
         return
 
     # Step 2: Transform the data
     transformed_data = transform_data(api_response)
+    client.metrics.inc("rows", 1 if transformed_data else 0, pipeline="cycles")
     print("Transformed Data:", transformed_data)
 
-    # Step 3: Upload to JSONBlob
-    upload_to_jsonblob(transformed_data)
+    # Step 3: Upload to JSONBlob, unless the cycle hasn't changed since the last upload;
+    # the same blob is updated so its URL stays stable
+    stages = StageState(STATE_FILENAME)
+    content = DatasetHash()
+    content.update(transformed_data)
+    stages.set_content(content)
+    if stages.pending("upload"):
+        with client.metrics.timer("upload", pipeline="cycles"):
+            url = await upload_json_data(client.session, transformed_data, stages.info("upload").get("url"))
+        if url:
+            stages.done("upload", url=url)
+        else:
+            stages.failed("upload")
+    stages.report()
+
+async def main():
+    try:
+        api_key = require_api_key()
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    async with aiohttp.ClientSession() as session:
+        client = MessierClient(session, api_key, cache=default_cache())
+        await run(client)
+    client.metrics.export()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1 @@
+"""Shared building blocks for the dataset pipelines (fees, cycles, proposals, virgo, txs)."""
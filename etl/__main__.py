@@ -0,0 +1,151 @@
+"""
+Single entry point for the pipelines and tools, one subcommand each:
+
+    python -m etl txs --concurrent
+    python -m etl run fees cycles              # etl.runner
+    python -m etl index query transactions --address 0xabc...
+    python -m etl --profile-startup            # cold-start time of every command
+    python -m etl --profile-startup fees       # ... and what fees spends it on
+
+Only the chosen command's module is imported, and it runs exactly as its
+script would, parsing the rest of the command line itself. Listing the
+commands imports none of them, so `python -m etl` costs no more than the
+interpreter does.
+
+--profile-startup imports each command's module in a fresh interpreter
+under `python -X importtime` and reports the wall time to start it, the
+time spent importing it and the number of modules that loaded; the
+command itself is not run.
+"""
+import os
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Command -> (module, what it does)
+COMMANDS = {
+    "run": ("etl.runner", "run the dataset pipelines concurrently"),
+    "fees": ("fees.fees", "fetch the platform fees"),
+    "cycles": ("cycles.cyclescsv", "fetch the virgo cycles"),
+    "proposals": ("proposals.proposalscsv", "fetch the virgo proposals"),
+    "proposals-json": ("proposals.proposalscsvtojson", "convert the proposals CSV to JSON"),
+    "virgo": ("virgo.virgopaginatedcsv", "fetch the virgo permission users"),
+    "virgo-json": ("virgo.virgocsvtojson", "convert the virgo users CSV to JSON"),
+    "txs": ("txs.txs", "fetch the platform transactions"),
+    "upload": ("upload_to_json_blob", "upload JSON datasets to jsonBlob"),
+    "index": ("etl.index", "build and query the output indexes"),
+    "enrich": ("etl.enrich", "annotate the datasets with the virgo users"),
+    "partitions": ("etl.partitions", "list the shards of partitioned transactions"),
+    "mockapi": ("etl.mockapi", "serve a local stand-in for the API"),
+    "bench": ("etl.bench", "benchmark the pipelines against the mock API"),
+}
+# Fresh interpreters started per command by --profile-startup; the fastest one is reported
+PROFILE_RUNS = 3
+
+
+def usage():
+    width = max(len(name) for name in COMMANDS)
+    lines = ["usage: python -m etl [--profile-startup] COMMAND [ARGS...]", "", "commands:"]
+    lines += [f"  {name:<{width}}  {summary}" for name, (_, summary) in COMMANDS.items()]
+    lines += ["", "Run `python -m etl COMMAND --help` for a command's options."]
+    return "\n".join(lines)
+
+
+def parse_importtime(stderr, module):
+    """
+    (microseconds importing `module`, modules loaded, [(cumulative µs, name)]
+    of its direct imports) from `python -X importtime` output.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # the header line
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, int(cumulative), name.strip()))
+    total = 0
+    children = []
+    # Imports are listed after the ones they trigger, so `module`'s own come just before it
+    for position, (depth, cumulative, name) in enumerate(entries):
+        if depth == 0 and name == module:
+            total = cumulative
+            for child_depth, child_cumulative, child in reversed(entries[:position]):
+                if child_depth == 0:
+                    break
+                if child_depth == 1:
+                    children.append((child_cumulative, child))
+            break
+    return total, len(entries), sorted(children, reverse=True)
+
+
+def profile(module=None):
+    """
+    (best startup seconds, import µs, modules, direct imports) of a cold
+    `import module`, or of the bare interpreter.
+    """
+    import subprocess
+
+    command = [sys.executable, "-X", "importtime", "-c", f"import {module}" if module else "pass"]
+    best = None
+    for _ in range(PROFILE_RUNS):
+        started = time.perf_counter()
+        result = subprocess.run(command, cwd=REPO_DIR, capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0:
+            raise RuntimeError(f"importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+        if best is None or elapsed < best[0]:
+            best = (elapsed,) + parse_importtime(result.stderr, module)
+    return best
+
+
+def profile_startup(names):
+    """Prints the startup report of the named commands (default: all)."""
+    baseline = profile()
+    print(f"{'command':<16} {'startup':>10} {'imports':>10} {'modules':>8}")
+    print(f"{'(interpreter)':<16} {baseline[0] * 1000:>7.1f} ms {'':>10} {baseline[2]:>8}")
+    reports = {}
+    for name in names or COMMANDS:
+        module = COMMANDS[name][0]
+        try:
+            reports[name] = report = profile(module)
+        except RuntimeError as e:
+            print(f"{name:<16} {e}")
+            continue
+        elapsed, total, modules, _ = report
+        print(f"{name:<16} {elapsed * 1000:>7.1f} ms {total / 1000:>7.1f} ms {modules:>8}")
+    if len(reports) == 1:
+        (name, (_, _, _, children)), = reports.items()
+        print(f"\nSlowest imports of {COMMANDS[name][0]}:")
+        for cumulative, child in children[:10]:
+            print(f"  {cumulative / 1000:>7.1f} ms  {child}")
+
+
+def main():
+    args = sys.argv[1:]
+    if args[:1] == ["--profile-startup"]:
+        args = args[1:]
+        unknown = [name for name in args if name not in COMMANDS]
+        if unknown:
+            sys.exit(f"unknown command(s): {', '.join(unknown)}\n\n{usage()}")
+        profile_startup(args)
+        return
+    if not args or args[0] in ("-h", "--help"):
+        print(usage())
+        return
+    name, args = args[0], args[1:]
+    if name not in COMMANDS:
+        sys.exit(f"unknown command: {name}\n\n{usage()}")
+
+    import runpy
+
+    # The scripts import each other (and etl) from the repository root
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    sys.argv = sys.argv[:1] + args
+    runpy.run_module(COMMANDS[name][0], run_name="__main__", alter_sys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+End-to-end benchmark of the pipelines against the local mock API
+(etl.mockapi). Every pipeline runs through etl.runner in its own process,
+in a scratch copy of the scripts, so the real outputs are left alone. It
+reports the wall time, the pages and rows fetched per second, and the
+peak RSS of each run.
+
+    python -m etl.bench                               # every pipeline, default sizes
+    python -m etl.bench txs --transactions 20000 --runs 3 --json bench.json
+    python -m etl.bench --baseline bench.json         # fail on a throughput regression
+    python -m etl.bench --codec --transactions 20000  # JSON decode/encode ms per MB, per backend
+    python -m etl.bench --row-memory                  # bytes per buffered transaction row
+
+The rate limit defaults to far above what the mock needs (the limiter
+never lowers it without a 429), so the numbers measure the pipelines
+rather than the limiter; pass --rate to include it. Results are only
+compared with a baseline taken at the same --rate.
+Peak RSS comes from wait4(), so this needs a POSIX system.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from aiohttp import web
+
+from etl import jsonio, mockapi
+from etl.runner import JOBS
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RATE = 1000.0
+BURST = 100
+TOLERANCE = 0.10  # allowed drop in rows/s against the baseline
+
+
+class MockThread:
+    """Runs a mockapi server on its own event loop in a background thread."""
+
+    def __init__(self, server):
+        self.server = server
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def _serve(self):
+        asyncio.set_event_loop(self.loop)
+        runner = web.AppRunner(self.server.application())
+        self.loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(runner.cleanup())
+
+    def start(self):
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    def reset(self):
+        asyncio.run_coroutine_threadsafe(self.server.reset(None), self.loop).result()
+
+    def stats(self):
+        """(pages, rows, throttled) served since the last reset."""
+        server = self.server
+        throttled = sum(server.throttled.values())
+        return sum(server.requests.values()) - throttled, sum(server.rows.values()), throttled
+
+
+def scratch_copy(names):
+    """Copies etl/ and the jobs' scripts (without their outputs) to a temporary directory."""
+    scratch = tempfile.mkdtemp(prefix="etl-bench-")
+    directories = {"etl"} | {JOBS[name].split(".")[0] for name in names}
+    for directory in directories:
+        os.makedirs(os.path.join(scratch, directory))
+        for filename in os.listdir(os.path.join(REPO_DIR, directory)):
+            if filename.endswith(".py"):
+                shutil.copy(os.path.join(REPO_DIR, directory, filename), os.path.join(scratch, directory))
+    return scratch
+
+
+def run_job(name, mock, args):
+    """Runs one pipeline in a fresh scratch copy; returns its measurements."""
+    scratch = scratch_copy([name])
+    base = f"http://127.0.0.1:{mock.port}"
+    env = {**os.environ, "API_KEY": "bench", "MESSIER_API_URL": f"{base}/api/v1",
+           "JSONBLOB_API_URL": f"{base}/api/jsonBlob"}
+    env.pop("RESPONSE_CACHE_PATH", None)
+    if args.json_backend:
+        env["ETL_JSON_BACKEND"] = args.json_backend
+    command = [sys.executable, "-m", "etl.runner", name, "--rate", str(args.rate),
+               "--burst", str(args.burst), "--max-connections", str(args.max_connections)]
+    if args.txs_concurrent:
+        command.append("--txs-concurrent")
+    if args.txs_transform_workers is not None:
+        command += ["--txs-transform-workers", str(args.txs_transform_workers)]
+
+    mock.reset()
+    log_filename = os.path.join(scratch, "run.log")
+    try:
+        with open(log_filename, "w") as log:
+            started = time.perf_counter()
+            process = subprocess.Popen(command, cwd=scratch, env=env, stdout=log, stderr=subprocess.STDOUT)
+            _, status, usage = os.wait4(process.pid, 0)
+            wall = time.perf_counter() - started
+            process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            with open(log_filename) as log:
+                tail = log.readlines()[-20:]
+            raise RuntimeError(f"{name} exited with {process.returncode}:\n{''.join(tail)}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    pages, rows, throttled = mock.stats()
+    return {
+        "job": name,
+        "wall": wall,
+        "pages": pages,
+        "rows": rows,
+        "throttled": throttled,
+        "pages_per_s": pages / wall,
+        "rows_per_s": rows / wall,
+        "peak_rss_mb": usage.ru_maxrss / 1024,  # ru_maxrss is in KiB on Linux
+        "rate": args.rate,
+    }
+
+
+def codec_bench(data, runs=3):
+    """
+    Decode and encode times (ms per MB of compact JSON) of every available
+    JSON backend, on transaction pages like the API's.
+    """
+    pages = [{"statusCode": 200, "data": {"items": [data.transaction(service, index) for index in range(start, start + 100)],
+                                          "total": data.transactions}}
+             for service in mockapi.SERVICES for start in range(0, data.transactions, 100)]
+    bodies = [json.dumps(page).encode("utf-8") for page in pages]
+    records = [item for page in pages for item in page["data"]["items"]]
+    megabytes = sum(len(body) for body in bodies) / (1 << 20)
+    backends = [backend for backend in jsonio.BACKENDS if backend == "json" or jsonio.orjson is not None]
+
+    def best(operation):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            operation()
+            timings.append(time.perf_counter() - started)
+        return min(timings) * 1000 / megabytes
+
+    results = []
+    for backend in backends:
+        results.append({
+            "backend": backend,
+            "megabytes": megabytes,
+            "decode_ms_per_mb": best(lambda: [jsonio.loads(body, backend) for body in bodies]),
+            "encode_ms_per_mb": best(lambda: [jsonio.dumps(record, backend=backend) for record in records]),
+            "pretty_ms_per_mb": best(lambda: [jsonio.dumps(record, 4, backend) for record in records]),
+        })
+    return results
+
+
+def codec_report(results):
+    print(f"{'backend':<8} {'MB':>7} {'decode ms/MB':>13} {'encode ms/MB':>13} {'pretty ms/MB':>13}")
+    for result in results:
+        print(f"{result['backend']:<8} {result['megabytes']:7.1f} {result['decode_ms_per_mb']:13.1f} "
+              f"{result['encode_ms_per_mb']:13.1f} {result['pretty_ms_per_mb']:13.1f}")
+    baseline = results[-1]  # the standard library
+    for result in results[:-1]:
+        print(f"{result['backend']} vs json: decode {baseline['decode_ms_per_mb'] / result['decode_ms_per_mb']:.1f}x, "
+              f"encode {baseline['encode_ms_per_mb'] / result['encode_ms_per_mb']:.1f}x faster")
+
+
+def row_memory_bench(data, runs=3):
+    """
+    Memory per transaction row held between the transform and write stages,
+    as a transform worker hands it back (pickled), for each representation
+    the txs pipeline has used: a dict per row, the pre-encoded tuples of
+    sinks.encode_rows(), and the compact RowBlocks of etl.rowstore. Also
+    times building them and getting the rows back out for the writers.
+    """
+    import pickle
+
+    from etl.rowstore import RowBlock
+    from etl.sinks import encode_rows
+    from txs.txs import CSV_COLUMNS, DEDUPE_FIELDS, ROW_SCHEMA, flatten_items
+
+    pages = [(service, jsonio.loads(jsonio.dumps([data.transaction(service, index)
+                                                  for index in range(start, start + 100)])))
+             for service in mockapi.SERVICES for start in range(0, data.transactions, 100)]
+    representations = {
+        "dicts": (lambda rows: [dict(zip(CSV_COLUMNS, values)) for values in rows],
+                  lambda held: [tuple(row.values()) for row in held]),
+        "encoded": (lambda rows: encode_rows(CSV_COLUMNS, rows),
+                    lambda held: [values for values, _, _, _ in held]),
+        "rowblock": (lambda rows: RowBlock.from_rows(ROW_SCHEMA, rows, DEDUPE_FIELDS),
+                     lambda held: held.rows()),
+    }
+    results = []
+    for name, (build, read) in representations.items():
+        build_seconds = read_seconds = float("inf")
+        for _ in range(runs):
+            started = time.perf_counter()
+            held = [pickle.loads(pickle.dumps(build(flatten_items(service, items)))) for service, items in pages]
+            build_seconds = min(build_seconds, time.perf_counter() - started)
+            started = time.perf_counter()
+            rows = sum(len(read(batch)) for batch in held)
+            read_seconds = min(read_seconds, time.perf_counter() - started)
+            del held
+        tracemalloc.start()
+        held = [pickle.loads(pickle.dumps(build(flatten_items(service, items)))) for service, items in pages]
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del held
+        results.append({
+            "representation": name,
+            "rows": rows,
+            "bytes_per_row": used / rows,
+            "build_us_per_row": build_seconds * 1e6 / rows,
+            "read_us_per_row": read_seconds * 1e6 / rows,
+        })
+    return results
+
+
+def row_memory_report(results):
+    print(f"{'rows held as':<12} {'rows':>8} {'bytes/row':>10} {'build us/row':>13} {'read us/row':>12}")
+    for result in results:
+        print(f"{result['representation']:<12} {result['rows']:8d} {result['bytes_per_row']:10.1f} "
+              f"{result['build_us_per_row']:13.2f} {result['read_us_per_row']:12.2f}")
+    compact = results[-1]
+    for result in results[:-1]:
+        print(f"{compact['representation']} vs {result['representation']}: "
+              f"{result['bytes_per_row'] / compact['bytes_per_row']:.1f}x less memory per row")
+
+
+def median_run(runs):
+    """The run with the median wall time."""
+    return sorted(runs, key=lambda run: run["wall"])[(len(runs) - 1) // 2]
+
+
+def report(results):
+    print(f"{'job':<10} {'wall s':>8} {'pages':>7} {'pages/s':>9} {'rows':>8} {'rows/s':>10} "
+          f"{'peak RSS':>9} {'429s':>5}")
+    for result in results:
+        print(f"{result['job']:<10} {result['wall']:8.2f} {result['pages']:7d} {result['pages_per_s']:9.1f} "
+              f"{result['rows']:8d} {result['rows_per_s']:10.1f} {result['peak_rss_mb']:7.1f}MB "
+              f"{result['throttled']:5d}")
+
+
+def regressions(results, baseline, tolerance=TOLERANCE):
+    """
+    Jobs whose rows/s dropped by more than `tolerance` against the baseline
+    results. Baseline runs at another rate limit (or from before the rate
+    was recorded) aren't comparable and are skipped; take a new baseline.
+    """
+    previous = {result["job"]: result for result in baseline}
+    failed = []
+    for result in results:
+        before = previous.get(result["job"])
+        if before and before.get("rate") != result["rate"]:
+            print(f"Skipping the {result['job']} baseline: taken at rate {before.get('rate')}, "
+                  f"not {result['rate']:g}; save a new one with --json")
+            continue
+        if before and result["rows_per_s"] < before["rows_per_s"] * (1 - tolerance):
+            failed.append(f"{result['job']}: {result['rows_per_s']:.1f} rows/s, "
+                          f"was {before['rows_per_s']:.1f}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipelines against the local mock API.")
+    parser.add_argument("jobs", nargs="*", metavar="JOB", help=f"jobs to run: {', '.join(JOBS)} (default: all)")
+    parser.add_argument("--runs", type=int, default=1, help="runs per job; the median is reported")
+    parser.add_argument("--rate", type=float, default=RATE, help=f"initial requests per second (default {RATE:g})")
+    parser.add_argument("--burst", type=int, default=BURST, help=f"rate limiter burst size (default {BURST})")
+    parser.add_argument("--max-connections", type=int, default=10, help="requests in flight at once (default 10)")
+    parser.add_argument("--txs-concurrent", action="store_true", help="run txs with --concurrent")
+    parser.add_argument("--txs-transform-workers", type=int, metavar="N",
+                        help="transform worker processes for txs (default: the runner's)")
+    parser.add_argument("--json-backend", choices=jsonio.BACKENDS,
+                        help="run the pipelines with this JSON backend (default: orjson when installed)")
+    parser.add_argument("--codec", action="store_true",
+                        help="only time JSON decoding and encoding with each backend, without the pipelines")
+    parser.add_argument("--row-memory", action="store_true",
+                        help="only measure the memory per buffered transaction row, without the pipelines")
+    parser.add_argument("--json", metavar="PATH", help="write the results to this JSON file")
+    parser.add_argument("--baseline", metavar="PATH",
+                        help="results of an earlier --json run; exit 1 if rows/s dropped")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help=f"allowed rows/s drop against the baseline (default {TOLERANCE:g})")
+    mockapi.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.codec or args.row_memory:
+        data = mockapi.MockData(args.transactions, seed=args.seed)
+        if args.codec:
+            results = codec_bench(data, max(args.runs, 3))
+            codec_report(results)
+        else:
+            results = row_memory_bench(data, max(args.runs, 3))
+            row_memory_report(results)
+        if args.json:
+            with open(args.json, "w") as results_file:
+                json.dump(results, results_file, indent=4)
+        return
+
+    names = args.jobs or list(JOBS)
+    unknown = [name for name in names if name not in JOBS]
+    if unknown:
+        parser.error(f"unknown job(s): {', '.join(unknown)}")
+
+    mock = MockThread(mockapi.server_from_args(args)).start()
+    try:
+        results = []
+        for name in names:
+            runs = [run_job(name, mock, args) for _ in range(args.runs)]
+            result = median_run(runs)
+            result["wall_stdev"] = statistics.stdev(run["wall"] for run in runs) if len(runs) > 1 else 0.0
+            results.append(result)
+    finally:
+        mock.stop()
+
+    report(results)
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(results, results_file, indent=4)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            failed = regressions(results, json.load(baseline_file), args.tolerance)
+        for line in failed:
+            print(f"Regression: {line}")
+        if failed:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+On-disk HTTP response cache shared by the API clients. Entries are keyed by
+endpoint and query string, stay fresh for a per-endpoint TTL, are
+revalidated with If-None-Match / If-Modified-Since once stale, and are
+evicted least-recently-used once the cache grows past its size budget.
+"""
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+
+# Seconds a response stays fresh, by endpoint path suffix
+DEFAULT_TTLS = {
+    "platform/fee": 24 * 3600,
+    "virgo/cycle": 3600,
+    "virgo/permissions": 3600,
+    "virgo/proposal-list": 600,
+    # Pages are numbered from the newest transaction, so their content
+    # shifts as new transactions arrive; only reuse them within a session.
+    "platform/transaction": 300,
+}
+DEFAULT_TTL = 0
+MAX_BYTES = 256 * 1024 * 1024
+
+
+class CacheEntry:
+    def __init__(self, body, etag, last_modified, fresh):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh = fresh
+
+    def conditional_headers(self):
+        """Headers that let the server answer 304 Not Modified."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """SQLite-backed response cache; safe to share between threads."""
+
+    def __init__(self, path, ttls=None, max_bytes=MAX_BYTES):
+        self.path = path
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body BLOB, "
+            "stored_at REAL, accessed_at REAL, size INTEGER)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (accessed_at)")
+
+    @staticmethod
+    def key(url, params=None):
+        return f"{url}?{urlencode(sorted((params or {}).items()))}"
+
+    def ttl(self, url):
+        for suffix, ttl in self.ttls.items():
+            if url.rstrip("/").endswith(suffix):
+                return ttl
+        return DEFAULT_TTL
+
+    def lookup(self, url, params=None):
+        """Returns the CacheEntry for the request (fresh or stale), or None."""
+        key = self.key(url, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, stored_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        body, etag, last_modified, stored_at = row
+        fresh = now - stored_at < self.ttl(url)
+        if fresh:
+            self.hits += 1
+        return CacheEntry(body, etag, last_modified, fresh)
+
+    def store(self, url, params, body, headers):
+        """Stores a 200 response body; `headers` supplies ETag/Last-Modified."""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.key(url, params), headers.get("ETag"), headers.get("Last-Modified"),
+                 body, now, now, len(body)),
+            )
+            self._evict()
+
+    def refresh(self, url, params=None):
+        """Marks a stale entry fresh again after a 304 Not Modified."""
+        self.revalidated += 1
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE responses SET stored_at = ? WHERE key = ?",
+                               (time.time(), self.key(url, params)))
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        for key, size in self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            excess -= size
+            if excess <= 0:
+                break
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def default_cache():
+    """
+    Opens the cache configured by RESPONSE_CACHE_PATH (and optionally
+    RESPONSE_CACHE_MAX_MB), or returns None when caching is not enabled.
+    """
+    path = os.getenv("RESPONSE_CACHE_PATH")
+    if not path:
+        return None
+    max_mb = os.getenv("RESPONSE_CACHE_MAX_MB")
+    return ResponseCache(path, max_bytes=int(max_mb) * 1024 * 1024 if max_mb else MAX_BYTES)
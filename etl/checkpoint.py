@@ -0,0 +1,85 @@
+"""
+Checkpoints for resumable crawls. A checkpoint holds the last completed
+page of every service, the services already finished and the output
+sink's offsets. It is saved in the crawl's DedupeStore, in the same
+transaction as the dedupe keys seen so far, so the keys, the pages and
+the partial outputs always agree. After a crash or a kill, a --resume run
+cuts the partial outputs back to the checkpoint and carries on from the
+next page.
+"""
+import time
+
+from etl.dedupe import DedupeStore
+
+CHECKPOINT_PAGES = 10  # save after this many completed pages...
+CHECKPOINT_SECONDS = 30.0  # ...or this long after the last save, whichever comes first
+
+
+def open_store(dedupe_filename, settings, resume=False, usable=None):
+    """
+    Opens a crawl's DedupeStore, which then only writes keys at checkpoints.
+    With `resume`, also returns the saved checkpoint if it was taken with
+    the same `settings` and `usable(state)` accepts it; otherwise the store
+    starts empty. Returns (store, state or None).
+    """
+    if resume:
+        store = DedupeStore(dedupe_filename, batch_size=None)
+        state = store.load_checkpoint()
+        if state is not None and state.get("settings") == settings and (usable is None or usable(state)):
+            pages = sum(state["pages"].values())
+            print(f"Resuming from checkpoint: {pages} pages and {state['sink']['rows']} rows already saved.")
+            return store, state
+        store.close(flush=False)
+        print("No usable checkpoint found, starting from the beginning.")
+    return DedupeStore(dedupe_filename, reset=True, batch_size=None), None
+
+
+class Checkpoint:
+    """
+    Progress of a crawl that writes `sink` and dedupes with `store`. Call
+    page_done() after every page has been written; it saves every
+    `every_pages` pages or `every_seconds` seconds.
+    """
+
+    def __init__(self, store, sink, settings, state=None, every_pages=CHECKPOINT_PAGES,
+                 every_seconds=CHECKPOINT_SECONDS):
+        self.store = store
+        self.sink = sink
+        self.settings = settings
+        self.pages = dict(state["pages"]) if state else {}
+        self.done = set(state["done"]) if state else set()
+        self.every_pages = every_pages
+        self.every_seconds = every_seconds
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def next_page(self, service):
+        """First page of `service` that has not been written yet."""
+        return self.pages.get(service, 0) + 1
+
+    def is_done(self, service):
+        return service in self.done
+
+    def page_done(self, service, page):
+        self.pages[service] = page
+        self._unsaved += 1
+        if self._unsaved >= self.every_pages or time.monotonic() - self._saved_at >= self.every_seconds:
+            self.save()
+
+    def service_done(self, service):
+        self.done.add(service)
+        self.save()
+
+    def save(self):
+        self.store.save_checkpoint({
+            "settings": self.settings,
+            "pages": self.pages,
+            "done": sorted(self.done),
+            "sink": self.sink.checkpoint(),
+        })
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def finish(self):
+        """The crawl completed: drop the checkpoint so --resume starts afresh."""
+        self.store.clear_checkpoint()
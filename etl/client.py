@@ -0,0 +1,175 @@
+import aiohttp
+import asyncio
+import email.utils
+import os
+import re
+import time
+
+from etl import jsonio
+from etl.metrics import Metrics
+from etl.ratelimit import AdaptiveRateLimiter
+
+# Base URL of the messier API; set MESSIER_API_URL to use another server (e.g. etl.mockapi)
+MESSIER_API_URL = "https://api.messier.app/api/v1"
+# Statuses the API uses to signal rate limiting
+THROTTLE_STATUSES = (429, 400)
+MAX_RETRIES = 5
+# Delay before retrying other errors (in seconds)
+ERROR_DELAY = 5
+# Used when a throttled response carries no hint
+DEFAULT_RETRY_AFTER = 60
+
+_RETRY_AFTER_MESSAGE = re.compile(r"Retry after:\s*(\d+(?:\.\d+)?)\s*seconds", re.IGNORECASE)
+# Sentinel returned by _handle when the request should be retried
+_RETRY = object()
+
+
+def parse_retry_after(headers, body):
+    """
+    Returns the server's retry hint in seconds, read from the Retry-After
+    header (delta-seconds or HTTP date) or from a "Retry after: N seconds"
+    message in the JSON body, or None if there is no hint.
+    """
+    value = headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    try:
+        message = jsonio.loads(body).get("message", "")
+    except (ValueError, AttributeError):
+        return None
+    match = _RETRY_AFTER_MESSAGE.search(str(message))
+    return float(match.group(1)) if match else None
+
+
+def messier_url(path):
+    """URL of an API endpoint, e.g. messier_url("virgo/cycle")."""
+    return os.getenv("MESSIER_API_URL", MESSIER_API_URL).rstrip("/") + "/" + path
+
+
+def endpoint_of(url):
+    """Metrics label of a URL: its last two path segments, e.g. "platform/transaction"."""
+    return "/".join(url.split("?")[0].rstrip("/").split("/")[-2:])
+
+
+def require_api_key():
+    """Loads .env and returns API_KEY, raising ValueError if it is not set."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    api_key = os.getenv("API_KEY")
+    if not api_key:
+        raise ValueError("API_KEY not found. Please set it in the .env file.")
+    return api_key
+
+
+def default_headers(api_key):
+    return {
+        "accept": "application/json",
+        "X-API-KEY": api_key
+    }
+
+
+class MessierClient:
+    """
+    Async client for the messier API. Every request takes a token from the
+    shared limiter; throttled responses feed their retry hint back into it so
+    all tasks using the same limiter back off together. With a
+    ResponseCache, fresh responses are served without a request and stale
+    ones are revalidated. Requests, latency, bytes, retries and sleeps are
+    recorded in `metrics`, per endpoint and service.
+    """
+
+    def __init__(self, session, api_key, limiter=None, max_retries=MAX_RETRIES, cache=None,
+                 metrics=None):
+        self.session = session
+        self.headers = default_headers(api_key)
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.max_retries = max_retries
+        self.cache = cache
+        self.metrics = metrics or Metrics()
+
+    def _lookup(self, url, params):
+        """Returns (entry, headers): the cached entry, if any, and the headers to send."""
+        entry = self.cache.lookup(url, params) if self.cache is not None else None
+        if entry is None:
+            return None, self.headers
+        return entry, {**self.headers, **entry.conditional_headers()}
+
+    def _handle(self, url, params, status, headers, body, entry):
+        """Shared response handling; returns the decoded body or _RETRY."""
+        if status == 304 and entry is not None:
+            self.limiter.on_success()
+            self.cache.refresh(url, params)
+            return jsonio.loads(entry.body)
+        if status in THROTTLE_STATUSES:
+            retry_after = parse_retry_after(headers, body)
+            if retry_after is None:
+                retry_after = DEFAULT_RETRY_AFTER
+            self.limiter.on_throttle(retry_after)
+            print(f"Rate limit exceeded. Retrying after {retry_after:g} seconds "
+                  f"(rate now {self.limiter.rate:.2f} req/s).")
+            return _RETRY
+        if status != 200:
+            print(f"Error fetching data from API. Status code: {status}")
+            print(f"Response content: {body.decode('utf-8', 'replace')}")
+            return _RETRY
+        try:
+            decoded = jsonio.loads(body)
+        except ValueError:
+            print("Failed to parse JSON response")
+            print(f"Response content: {body.decode('utf-8', 'replace')}")
+            return _RETRY
+        self.limiter.on_success()
+        if self.cache is not None:
+            self.cache.store(url, params, body, headers)
+        return decoded
+
+    async def get_json(self, url, params=None):
+        """Returns the decoded JSON body, or None once retries are exhausted."""
+        metrics = self.metrics
+        labels = {"endpoint": endpoint_of(url), "service": (params or {}).get("service")}
+        entry, request_headers = self._lookup(url, params)
+        if entry is not None and entry.fresh:
+            metrics.inc("cache_hits", **labels)
+            return jsonio.loads(entry.body)
+        retries = 0
+        while retries <= self.max_retries:
+            started = time.perf_counter()
+            await self.limiter.acquire()
+            requested = time.perf_counter()
+            metrics.inc("sleep_seconds", requested - started, reason="ratelimit", **labels)
+            try:
+                async with self.session.get(url, params=params, headers=request_headers) as response:
+                    # Decoded straight from the raw bytes, skipping a str copy
+                    body = await response.read()
+                    status, headers = response.status, response.headers
+                    metrics.inc("downloaded_bytes", len(body), **labels)
+            except aiohttp.ClientError as e:
+                print(f"Error fetching data from API: {e}")
+                metrics.inc("retries", reason="error", **labels)
+                retries += 1
+                await asyncio.sleep(ERROR_DELAY)
+                metrics.inc("sleep_seconds", ERROR_DELAY, reason="retry", **labels)
+                continue
+            metrics.observe("request_seconds", time.perf_counter() - requested, **labels)
+            metrics.inc("requests", status=status, **labels)
+            result = self._handle(url, params, status, headers, body, entry)
+            if result is not _RETRY:
+                return result
+            retries += 1
+            if status in THROTTLE_STATUSES:
+                metrics.inc("throttled", **labels)
+                metrics.inc("retries", reason="throttle", **labels)
+            else:
+                metrics.inc("retries", reason="error", **labels)
+                await asyncio.sleep(ERROR_DELAY)
+                metrics.inc("sleep_seconds", ERROR_DELAY, reason="retry", **labels)
+        print(f"Failed to fetch {url} {params or ''} after {retries} retries.")
+        return None
@@ -0,0 +1,18 @@
+"""
+Lenient coercion of API values, which may arrive as numbers, numeric
+strings, empty strings or None.
+"""
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
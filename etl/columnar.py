@@ -0,0 +1,133 @@
+"""
+Typed columnar (Parquet) output for the transactions dataset. Needs the
+optional pyarrow package, which is only imported when a sink is opened.
+"""
+import os
+import time
+
+from etl.coerce import to_float, to_int
+
+ROW_GROUP_SIZE = 50_000
+
+# Byte widths of the hex columns
+HASH_BYTES = 32
+ADDRESS_BYTES = 20
+
+
+def transaction_schema():
+    import pyarrow as pa
+
+    category = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("transaction_type", category),
+        ("timestamp", pa.timestamp("ms", tz="UTC")),
+        ("blockchain", category),
+        ("service", category),
+        ("hash", pa.binary(HASH_BYTES)),
+        ("user", pa.binary(ADDRESS_BYTES)),
+        ("token_symbol", category),
+        ("token_address", pa.binary(ADDRESS_BYTES)),
+        ("value", pa.float64()),
+    ])
+
+
+def hex_to_bytes(value, width):
+    """Decodes a 0x-prefixed hex string of `width` bytes; returns None if it is empty or malformed."""
+    if not value or not isinstance(value, str):
+        return None
+    digits = value[2:] if value[:2] in ("0x", "0X") else value
+    if len(digits) != 2 * width:
+        return None
+    try:
+        return bytes.fromhex(digits)
+    except ValueError:
+        return None
+
+
+class ParquetSink:
+    """
+    Writes transaction rows as Parquet row groups of `row_group_size` rows
+    as they arrive: int64 millisecond timestamps, float64 values,
+    dictionary-encoded categoricals, and hashes/addresses as fixed-width
+    binary (addresses lose their checksum casing).
+
+    Each sink writes one part file in `directory`. A fresh sink replaces all
+    existing parts on close(); with append=True it adds a new part next to
+    them, so the directory reads back as one dataset.
+    """
+
+    def __init__(self, directory, append=False, row_group_size=ROW_GROUP_SIZE):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("pyarrow is required for Parquet output (pip install pyarrow)") from None
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.append = append
+        self.row_group_size = row_group_size
+        self.rows = 0
+        self.invalid_hex = 0
+        self.schema = transaction_schema()
+        self.filename = os.path.join(directory, f"part-{time.time_ns()}.parquet")
+        self._tmp_filename = self.filename + ".tmp"
+        self._writer = pq.ParquetWriter(self._tmp_filename, self.schema, compression="zstd")
+        self._columns = {name: [] for name in self.schema.names}
+        self._closed = False
+
+    def _hex(self, value, width):
+        decoded = hex_to_bytes(value, width)
+        if decoded is None and value:
+            self.invalid_hex += 1
+        return decoded
+
+    def write(self, row):
+        columns = self._columns
+        columns["transaction_type"].append(row.get("transaction_type"))
+        columns["timestamp"].append(to_int(row.get("timestamp")))
+        columns["blockchain"].append(row.get("blockchain"))
+        columns["service"].append(row.get("service"))
+        columns["hash"].append(self._hex(row.get("hash"), HASH_BYTES))
+        columns["user"].append(self._hex(row.get("user"), ADDRESS_BYTES))
+        columns["token_symbol"].append(row.get("token_symbol"))
+        columns["token_address"].append(self._hex(row.get("token_address"), ADDRESS_BYTES))
+        columns["value"].append(to_float(row.get("value")))
+        self.rows += 1
+        if len(columns["value"]) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+
+        if not self._columns["value"]:
+            return
+        arrays = []
+        for field in self.schema:
+            values = self._columns[field.name]
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(values, type=field.type.value_type).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, type=field.type))
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self._columns = {name: [] for name in self.schema.names}
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._flush()
+        self._writer.close()
+        if not self.append:
+            for name in os.listdir(self.directory):
+                if name.endswith(".parquet"):
+                    os.remove(os.path.join(self.directory, name))
+        os.replace(self._tmp_filename, self.filename)
+        if self.invalid_hex:
+            print(f"Parquet: {self.invalid_hex} malformed hashes/addresses stored as null.")
+
+    def discard(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._writer.close()
+        os.remove(self._tmp_filename)
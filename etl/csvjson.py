@@ -0,0 +1,146 @@
+"""
+Single-pass CSV to JSON converter. Rows are streamed from the CSV file to
+the output in chunks, so memory use does not depend on the file size.
+
+    python -m etl.csvjson virgo/virgo_users_data.csv virgo/virgo_users_data.json --coerce
+"""
+import argparse
+import csv
+import os
+import re
+from itertools import islice
+
+from etl.fingerprint import StageState, stages_path
+from etl.sinks import JsonWriter
+
+# Output format -> (JsonWriter format, indent)
+FORMATS = {
+    "compact": ("array", None),
+    "ndjson": ("ndjson", None),
+    "pretty": ("array", 4),
+}
+CHUNK_SIZE = 1000
+
+_INT = re.compile(r"-?(0|[1-9][0-9]*)")
+_FLOAT = re.compile(r"-?([0-9]+\.[0-9]*|\.[0-9]+|[0-9]+)([eE][-+]?[0-9]+)?")
+
+
+def to_bool(value):
+    if value in ("True", "true"):
+        return True
+    if value in ("False", "false"):
+        return False
+    raise ValueError(f"Not a boolean: {value!r}")
+
+
+def coerce_value(value):
+    """Guesses the type of a CSV cell: bool, int, float or str; empty cells become None."""
+    if value == "":
+        return None
+    if value in ("True", "true", "False", "false"):
+        return to_bool(value)
+    if _INT.fullmatch(value):
+        return int(value)
+    if _FLOAT.fullmatch(value):
+        return float(value)
+    return value
+
+
+TYPES = {"bool": to_bool, "int": int, "float": float, "str": str}
+
+
+def coerce_row(row, types=None):
+    """
+    Coerces every cell of a row. Columns listed in `types` (column -> one of
+    TYPES) are converted explicitly; the rest are guessed with coerce_value.
+    """
+    coerced = {}
+    for column, value in row.items():
+        if types and column in types:
+            coerced[column] = None if value == "" else TYPES[types[column]](value)
+        else:
+            coerced[column] = coerce_value(value)
+    return coerced
+
+
+def convert(csv_filename, json_filename, output_format="compact", coerce=False, types=None,
+            chunk_size=CHUNK_SIZE):
+    """
+    Converts `csv_filename` to `json_filename` in one pass and returns the
+    number of rows. Without `coerce` every value stays a string, as
+    csv.DictReader produces it.
+    """
+    json_format, indent = FORMATS[output_format]
+    tmp_filename = json_filename + ".tmp"
+    rows = 0
+    with open(csv_filename, mode="r", newline="", encoding="utf-8") as csv_file, \
+            open(tmp_filename, mode="wb") as json_file:
+        reader = csv.DictReader(csv_file)
+        writer = JsonWriter(json_file, json_format, indent)
+        while True:
+            chunk = list(islice(reader, chunk_size))
+            if not chunk:
+                break
+            if coerce or types:
+                chunk = [coerce_row(row, types) for row in chunk]
+            writer.write_many(chunk)
+            rows += len(chunk)
+        writer.close()
+    os.replace(tmp_filename, json_filename)
+    return rows
+
+
+def add_arguments(parser):
+    """Adds the output options shared by the converter entry points."""
+    parser.add_argument("--format", dest="output_format", choices=sorted(FORMATS), default="compact",
+                        help="compact JSON array (default), NDJSON, or 4-space indented JSON")
+    parser.add_argument("--coerce", action="store_true",
+                        help="convert bool/int/float cells instead of keeping every value a string")
+    parser.add_argument("--type", dest="types", action="append", default=[], metavar="COLUMN=TYPE",
+                        help=f"force a column's type ({', '.join(TYPES)}); may be repeated")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help=f"rows encoded per write (default {CHUNK_SIZE})")
+
+
+def parse_types(specs):
+    types = {}
+    for spec in specs:
+        column, _, type_name = spec.partition("=")
+        if type_name not in TYPES:
+            raise ValueError(f"Unknown type in {spec!r}; expected one of {', '.join(TYPES)}")
+        types[column] = type_name
+    return types
+
+
+def convert_stage(csv_filename, json_filename, args):
+    """
+    The convert stage of a pipeline dataset: converts with the add_arguments()
+    options in `args`, unless neither the CSV content (as hashed by its
+    write stage) nor the options changed since the last conversion.
+    Returns the number of rows converted, or None if it was skipped.
+    """
+    stages = StageState(stages_path(json_filename))
+    options = [args.output_format, args.coerce, sorted(args.types)]
+    if stages.info("convert").get("options") == options and not stages.pending("convert", json_filename):
+        stages.report()
+        return None
+    rows = convert(csv_filename, json_filename, args.output_format, args.coerce,
+                   parse_types(args.types), args.chunk_size)
+    stages.done("convert", options=options)
+    stages.report()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a CSV file to JSON in a single pass.")
+    parser.add_argument("csv_filename")
+    parser.add_argument("json_filename")
+    add_arguments(parser)
+    args = parser.parse_args()
+    rows = convert(args.csv_filename, args.json_filename, args.output_format, args.coerce,
+                   parse_types(args.types), args.chunk_size)
+    print(f"Converted {rows} rows from {args.csv_filename} to {args.json_filename}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+
+# Bytes per stored key
+DIGEST_SIZE = 16
+# Keys the Bloom filter is sized for at least (about 4.8 MB), its false-positive
+# rate, and how much larger each added filter (and a rebuilt one, than the stored keys) is
+BLOOM_CAPACITY = 1 << 22
+BLOOM_ERROR = 0.01
+BLOOM_GROWTH = 2
+# Stores with fewer keys rebuild their filter faster than they would save it
+BLOOM_SAVE_KEYS = 100_000
+
+
+def key_digest(key):
+    """Hashes a dedupe key (a tuple of fields or a single value) to a fixed-width digest."""
+    if not isinstance(key, tuple):
+        key = (key,)
+    text = "\x1f".join("\x00" if part is None else str(part) for part in key)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=DIGEST_SIZE).digest()
+
+
+class BloomFilter:
+    """
+    Bloom filter over key digests, sized for `capacity` keys at a
+    false-positive rate of `error`; memory stays at `bits / 8` bytes.
+    """
+
+    def __init__(self, capacity, error=BLOOM_ERROR, data=None, count=0):
+        self.capacity = capacity
+        self.error = error
+        self.bits = max(64, math.ceil(-capacity * math.log(error) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.count = count
+        self._array = bytearray(data) if data is not None else bytearray((self.bits + 7) // 8)
+
+    def _positions(self, digest):
+        # Double hashing: the two halves of the digest generate all k positions
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, digest):
+        """Sets the digest's bits; returns True if they all were already set (it may have been added)."""
+        array = self._array
+        present = True
+        for position in self._positions(digest):
+            mask = 1 << (position & 7)
+            if not array[position >> 3] & mask:
+                array[position >> 3] |= mask
+                present = False
+        if not present:
+            self.count += 1
+        return present
+
+    def __contains__(self, digest):
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+
+class ScalableBloomFilter:
+    """
+    Bloom filters that grow with the keys: once the newest filter holds its
+    capacity, a new one of GROWTH times that capacity and half its error
+    rate is started, so the overall false-positive rate stays below twice
+    `error` however many keys are added, without re-reading any of them.
+    """
+
+    def __init__(self, capacity, error=BLOOM_ERROR, filters=None):
+        self.filters = filters or [BloomFilter(capacity, error)]
+
+    def add(self, digest):
+        """Adds the digest; returns True if it may have been added before."""
+        filters = self.filters
+        if filters[-1].count >= filters[-1].capacity:
+            filters.append(BloomFilter(filters[-1].capacity * BLOOM_GROWTH, filters[-1].error / 2))
+        for bloom in filters[:-1]:
+            if digest in bloom:
+                return True
+        return filters[-1].add(digest)
+
+    def __contains__(self, digest):
+        for bloom in self.filters:
+            if digest in bloom:
+                return True
+        return False
+
+
+class DedupeStore:
+    """
+    Persistent set of dedupe keys. Keys are stored as fixed-width blake2b
+    digests in a SQLite table, so memory stays flat however many keys there
+    are, and the set survives between runs. An optional Bloom filter in
+    front answers most "never seen" lookups without touching the database;
+    new keys are buffered and inserted in batches.
+
+    The filter is sized from the number of stored keys (at least
+    `bloom_capacity`) and grows as keys are added. close() saves it next to
+    the keys of a large store; the next store reuses it if no keys were
+    stored since, and otherwise rebuilds it from the keys on its first
+    lookup.
+
+    With batch_size=None keys are only written by flush() or
+    save_checkpoint(), which stores a crawl's progress in the same
+    transaction. After a crash the stored keys then match the checkpoint
+    exactly, and close(flush=False) drops the keys added since.
+    """
+
+    def __init__(self, path, reset=False, bloom_capacity=BLOOM_CAPACITY, batch_size=1000):
+        if reset:
+            for filename in (path, path + "-wal", path + "-shm"):
+                if os.path.exists(filename):
+                    os.remove(filename)
+        self.path = path
+        self.batch_size = batch_size
+        self.bloom_capacity = bloom_capacity
+        self.hits = 0
+        self.misses = 0
+        self._pending = set()
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS seen (key BLOB PRIMARY KEY) WITHOUT ROWID")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS bloom (position INTEGER PRIMARY KEY, "
+                           "capacity INTEGER, error REAL, count INTEGER, bits BLOB)")
+        # Keys in `seen`, kept up to date with every insert so opening the store needn't count them
+        self.stored = self._meta("keys")
+        if self.stored is None:
+            self.stored = self._conn.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+            with self._conn:
+                self._set_meta("keys", self.stored)
+        self._bloom = None
+        self._bloom_loaded = not bloom_capacity
+
+    def _meta(self, name):
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_meta(self, name, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, json.dumps(value)))
+
+    def _filter(self):
+        """The Bloom filter, loaded or rebuilt on first use; None without one."""
+        if not self._bloom_loaded:
+            self._bloom_loaded = True
+            if self._meta("bloom_keys") == self.stored:
+                filters = [BloomFilter(capacity, error, bits, count) for capacity, error, count, bits in
+                           self._conn.execute("SELECT capacity, error, count, bits FROM bloom ORDER BY position")]
+                if filters:
+                    self._bloom = ScalableBloomFilter(self.bloom_capacity, filters=filters)
+                    return self._bloom
+            # Keys were stored since the filter was saved (or it never was): rebuild it, with headroom
+            self._bloom = ScalableBloomFilter(max(self.bloom_capacity, BLOOM_GROWTH * self.stored))
+            for (digest,) in self._conn.execute("SELECT key FROM seen"):
+                self._bloom.add(digest)
+        return self._bloom
+
+    def _stored(self, digest):
+        return self._conn.execute("SELECT 1 FROM seen WHERE key = ?", (digest,)).fetchone() is not None
+
+    def __contains__(self, key):
+        digest = key_digest(key)
+        bloom = self._filter()
+        if bloom is not None and digest not in bloom:
+            return False
+        return digest in self._pending or self._stored(digest)
+
+    def add(self, key):
+        """Adds the key; returns True if it was not seen before."""
+        return self.add_digest(key_digest(key))
+
+    def add_digest(self, digest):
+        """Adds a key by its key_digest(), e.g. one computed in a worker process."""
+        bloom = self._bloom if self._bloom_loaded else self._filter()
+        # Adding to the filter right away is harmless: a key it may have seen changes no bits
+        maybe_seen = bloom is None or bloom.add(digest)
+        if maybe_seen and (digest in self._pending or self._stored(digest)):
+            self.hits += 1
+            return False
+        self.misses += 1
+        self._pending.add(digest)
+        if self.batch_size is not None and len(self._pending) >= self.batch_size:
+            self.flush()
+        return True
+
+    def __len__(self):
+        self.flush()
+        return self.stored
+
+    def flush(self):
+        if self._pending:
+            with self._conn:
+                self._insert_pending()
+
+    def _insert_pending(self):
+        cursor = self._conn.executemany("INSERT OR IGNORE INTO seen (key) VALUES (?)",
+                                        ((digest,) for digest in self._pending))
+        self._pending.clear()
+        self.stored += cursor.rowcount
+        self._set_meta("keys", self.stored)
+
+    def save_checkpoint(self, state):
+        """Writes the pending keys and a JSON-serialisable checkpoint atomically."""
+        with self._conn:
+            self._insert_pending()
+            self._set_meta("checkpoint", state)
+
+    def load_checkpoint(self):
+        """The last saved checkpoint, or None."""
+        return self._meta("checkpoint")
+
+    def clear_checkpoint(self):
+        with self._conn:
+            self._conn.execute("DELETE FROM meta WHERE name = 'checkpoint'")
+
+    def _save_filter(self):
+        # The filter holds every stored key (and maybe dropped pending ones, which only costs lookups)
+        with self._conn:
+            self._conn.execute("DELETE FROM bloom")
+            self._conn.executemany(
+                "INSERT INTO bloom (position, capacity, error, count, bits) VALUES (?, ?, ?, ?, ?)",
+                ((position, bloom.capacity, bloom.error, bloom.count, bytes(bloom._array))
+                 for position, bloom in enumerate(self._bloom.filters)))
+            self._set_meta("bloom_keys", self.stored)
+
+    def close(self, flush=True):
+        if flush:
+            self.flush()
+        if self._bloom is not None and self.stored >= BLOOM_SAVE_KEYS and self._meta("bloom_keys") != self.stored:
+            self._save_filter()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,180 @@
+"""
+Enrichment join: annotates the transactions and proposals CSVs with the
+virgo users' attributes (username, type, darklist flag, stake). An address
+index is built once from the virgo users CSV, keyed by the case-folded
+address, so checksummed and lowercase forms of an address join alike. Each
+dataset is then streamed through it row by row into a *_enriched.csv next
+to it: linear time, and memory bounded by the number of users.
+
+    python -m etl.enrich                          # every dataset whose inputs changed
+    python -m etl.enrich transactions --force
+    python -m etl.runner --enrich                 # after the pipelines
+
+Single address columns get one column per attribute (e.g. user_isDarklist);
+the repr'd signer and approver lists of the proposals get the number of
+darklisted users in them and their total stake.
+"""
+import argparse
+import ast
+import csv
+import os
+import time
+
+from etl.coerce import to_float
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERS_CSV = os.path.join(REPO_DIR, "virgo", "virgo_users_data.csv")
+# Columns of the users CSV added to the joined rows
+USER_ATTRIBUTES = ["username", "type", "isDarklist", "stakeAmount"]
+# Dataset -> (CSV path relative to the repo, {address column: prefix of its attribute columns},
+# [columns holding repr'd lists of {'address', 'username'} dicts])
+TARGETS = {
+    "transactions": ("txs/transactions_data.csv", {"user": "user_"}, []),
+    "proposals": ("proposals/proposals_data.csv", {"creator_address": "creator_"}, ["signers", "approves"]),
+    "proposal_signers": ("proposals/proposal_signers.csv", {"address": ""}, []),
+    "proposal_approves": ("proposals/proposal_approves.csv", {"address": ""}, []),
+}
+
+
+def enriched_path(csv_filename):
+    return os.path.splitext(csv_filename)[0] + "_enriched.csv"
+
+
+class AddressIndex:
+    """Case-folded address -> USER_ATTRIBUTES values of the virgo users."""
+
+    def __init__(self, users=None):
+        self.users = users or {}
+        self.empty = ("",) * len(USER_ATTRIBUTES)
+
+    @classmethod
+    def from_csv(cls, csv_filename=USERS_CSV):
+        users = {}
+        with open(csv_filename, newline="", encoding="utf-8") as csv_file:
+            reader = csv.reader(csv_file)
+            header = next(reader)
+            address = header.index("address")
+            positions = [header.index(attribute) for attribute in USER_ATTRIBUTES]
+            for record in reader:
+                if record and record[address]:
+                    # The first row of an address wins, as in the crawl's dedupe
+                    users.setdefault(record[address].casefold(), tuple(record[position] for position in positions))
+        return cls(users)
+
+    def __len__(self):
+        return len(self.users)
+
+    def lookup(self, address):
+        """The user's attributes, or empty strings for an unknown address."""
+        return self.users.get(address.casefold(), self.empty) if address else self.empty
+
+    def summarize(self, users):
+        """(darklisted users, total stake) of a repr'd list of {'address', ...} dicts."""
+        try:
+            entries = ast.literal_eval(users) if users else []
+        except (ValueError, SyntaxError):
+            return "", ""
+        darklisted = 0
+        stake = 0.0
+        for entry in entries:
+            _, _, is_darklist, stake_amount = self.lookup(entry.get("address") if isinstance(entry, dict) else None)
+            darklisted += is_darklist == "True"
+            stake += to_float(stake_amount) or 0.0
+        return darklisted, int(stake) if stake.is_integer() else stake
+
+
+def join(index, csv_filename, output_filename, address_columns, list_columns=()):
+    """
+    Streams `csv_filename` into `output_filename`, appending the attributes
+    of the user at each address column and a summary of each list column.
+    Returns the number of rows written.
+    """
+    tmp_filename = output_filename + ".tmp"
+    rows = 0
+    with open(csv_filename, newline="", encoding="utf-8") as csv_file, \
+            open(tmp_filename, "w", newline="", encoding="utf-8") as output_file:
+        reader = csv.reader(csv_file)
+        writer = csv.writer(output_file)
+        header = next(reader)
+        # Attributes the row already has (e.g. creator_username) aren't added twice
+        lookups = []
+        added = []
+        for column, prefix in address_columns.items():
+            kept = [position for position, attribute in enumerate(USER_ATTRIBUTES)
+                    if prefix + attribute not in header]
+            lookups.append((header.index(column), kept))
+            added += [prefix + USER_ATTRIBUTES[position] for position in kept]
+        summaries = [header.index(column) for column in list_columns]
+        for column in list_columns:
+            added += [f"{column}_darklisted", f"{column}_stake"]
+        writer.writerow(header + added)
+
+        for record in reader:
+            if not record:
+                continue
+            extra = []
+            for position, kept in lookups:
+                user = index.lookup(record[position] if position < len(record) else "")
+                extra += [user[attribute] for attribute in kept]
+            for position in summaries:
+                extra += index.summarize(record[position] if position < len(record) else "")
+            writer.writerow(record + extra)
+            rows += 1
+    os.replace(tmp_filename, output_filename)
+    return rows
+
+
+def is_up_to_date(output_filename, *inputs):
+    """True if the output is newer than every input, make-style."""
+    if not os.path.exists(output_filename):
+        return False
+    built = os.path.getmtime(output_filename)
+    return all(os.path.getmtime(filename) <= built for filename in inputs)
+
+
+def enrich(names=None, force=False, users_csv=USERS_CSV):
+    """
+    Joins the named targets (default: all whose CSV exists) against the
+    users CSV, skipping those whose output is newer than both inputs.
+    Returns the enriched files.
+    """
+    if not os.path.exists(users_csv):
+        print(f"No virgo users at {users_csv}; run the virgo pipeline first.")
+        return []
+    index = None
+    written = []
+    for name in names or TARGETS:
+        relative, address_columns, list_columns = TARGETS[name]
+        csv_filename = os.path.join(REPO_DIR, relative)
+        if not os.path.exists(csv_filename):
+            if names:
+                print(f"No {name} CSV at {csv_filename}; skipping.")
+            continue
+        output_filename = enriched_path(csv_filename)
+        if not force and is_up_to_date(output_filename, csv_filename, users_csv):
+            print(f"{os.path.basename(output_filename)} is up to date")
+            continue
+        if index is None:
+            index = AddressIndex.from_csv(users_csv)
+        started = time.perf_counter()
+        rows = join(index, csv_filename, output_filename, address_columns, list_columns)
+        print(f"Enriched {rows} {name} rows with {len(index)} users in {time.perf_counter() - started:.2f}s: "
+              f"{output_filename}")
+        written.append(output_filename)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotate the datasets with the virgo users' attributes.")
+    parser.add_argument("targets", nargs="*", metavar="DATASET",
+                        help=f"datasets to enrich: {', '.join(TARGETS)} (default: all that exist)")
+    parser.add_argument("--force", action="store_true", help="rebuild outputs even if they are up to date")
+    args = parser.parse_args()
+    unknown = [name for name in args.targets if name not in TARGETS]
+    if unknown:
+        parser.error(f"unknown dataset(s): {', '.join(unknown)}")
+    enrich(args.targets, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Content hashes for change detection.
+
+A dataset's hash is computed from its normalized records and doesn't
+depend on their order, so a crawl that fetches pages in a different order
+hashes the same. Each pipeline keeps, in a small state file next to its
+outputs, the hash every stage (write, convert, upload) last completed
+with, and skips a stage when the content hasn't changed since.
+"""
+import hashlib
+import json
+import os
+
+MODULUS = 1 << 256
+# Pipeline stages in order; redoing one redoes the ones after it
+STAGES = ("write", "convert", "upload")
+
+
+def stages_path(json_filename):
+    """State file that goes with a dataset's JSON output."""
+    return json_filename + ".stages.json"
+
+
+def record_digest(record):
+    """sha256 of a record's canonical JSON, as an int."""
+    encoded = json.dumps(record, sort_keys=True, separators=(",", ":"), default=str)
+    return int.from_bytes(hashlib.sha256(encoded.encode("utf-8")).digest(), "big")
+
+
+class DatasetHash:
+    """
+    Order-insensitive hash of a set of records: the sum of the sha256 of
+    each record's canonical JSON, modulo 2**256. Being a sum, it can be
+    extended with appended records without re-reading the old ones.
+    """
+
+    def __init__(self, hexdigest=None, records=0):
+        self.value = int(hexdigest, 16) if hexdigest else 0
+        self.records = records
+
+    def update(self, record):
+        self.add(record_digest(record))
+
+    def add(self, digest):
+        """Adds a record by its record_digest(), e.g. one computed in a worker process."""
+        self.value = (self.value + digest) % MODULUS
+        self.records += 1
+
+    def update_many(self, records):
+        for record in records:
+            self.update(record)
+
+    def hexdigest(self):
+        return f"{self.value:064x}"
+
+
+class HashingWriter:
+    """Wraps a csv writer, hashing every row it writes into `content`."""
+
+    def __init__(self, writer, content):
+        self.writer = writer
+        self.content = content
+
+    def writerow(self, row):
+        self.content.update(row)
+        self.writer.writerow(row)
+
+
+class StageState:
+    """
+    The dataset's current content hash and the hash each stage last
+    completed with. Every stage decision is recorded for report().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.content = None
+        self.records = 0
+        self.stages = {}
+        self.decisions = []
+        if os.path.exists(path):
+            with open(path, "r") as state_file:
+                state = json.load(state_file)
+            self.content = state.get("content")
+            self.records = state.get("records", 0)
+            self.stages = state.get("stages", {})
+
+    def set_content(self, content):
+        """Records the hash (a DatasetHash) of the records the pipeline just produced."""
+        self.content = content.hexdigest()
+        self.records = content.records
+
+    def pending(self, stage, *outputs):
+        """
+        True if `stage` has to run: the content is unknown or changed since
+        the stage last completed, or one of its `outputs` is missing.
+        Records a skip otherwise.
+        """
+        done = self.stages.get(stage, {}).get("sha256")
+        if self.content is None or done != self.content or not all(map(os.path.exists, outputs)):
+            return True
+        self.decisions.append((stage, "skipped (unchanged)"))
+        return False
+
+    def info(self, stage):
+        """Whatever the stage stored with its last completion (e.g. a blob URL)."""
+        return self.stages.get(stage, {})
+
+    def done(self, stage, **info):
+        """
+        Marks `stage` as completed with the current content. The stages after
+        it are invalidated, since their input may have been rewritten.
+        """
+        self.decisions.append((stage, "ran"))
+        for later in STAGES[STAGES.index(stage) + 1:]:
+            self.stages.pop(later, None)
+        if self.content is None:
+            return
+        self.stages[stage] = {"sha256": self.content, **info}
+        self._save()
+
+    def failed(self, stage):
+        """Marks `stage` as failed, so the next run redoes it whatever the content."""
+        self.decisions.append((stage, "failed"))
+        if self.stages.pop(stage, None) is not None:
+            self._save()
+
+    def _save(self):
+        state = {"content": self.content, "records": self.records, "stages": self.stages}
+        tmp_filename = self.path + ".tmp"
+        with open(tmp_filename, "w") as state_file:
+            json.dump(state, state_file, indent=4)
+        os.replace(tmp_filename, self.path)
+
+    def report(self):
+        if self.decisions:
+            summary = ", ".join(f"{stage} {decision}" for stage, decision in self.decisions)
+            name = os.path.basename(self.path).removesuffix(".stages.json")
+            print(f"Stages for {name}: {summary}")
@@ -0,0 +1,334 @@
+"""
+On-disk query indexes over the CSV outputs. Each dataset's CSV gets an
+SQLite index next to it (<csv>.index.sqlite) mapping addresses, names,
+hashes, service/network partitions and timestamps to the byte offsets of
+the rows, so a lookup reads only the matching rows instead of the whole
+file. The pipelines refresh the index of every CSV they write.
+
+    python -m etl.index build                                     # (re)index stale datasets
+    python -m etl.index query transactions --address 0xabc... --since 2023-11-01
+    python -m etl.index query fees --service horizon
+    python -m etl.index query proposals --address 0xdef...        # by creator
+    python -m etl.index query users --name alice --format csv
+
+Addresses, names and hashes match case-insensitively. An index is stale
+once its CSV's size or modification time changes; queries rebuild stale
+indexes first.
+"""
+import argparse
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+
+from etl import jsonio
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Indexed fields; a dataset maps the ones it has to its CSV columns
+FIELDS = ("address", "name", "hash", "service", "network", "timestamp")
+# Case-insensitive fields, stored as 64-bit keys to keep the index small;
+# the rows read back are checked against the value itself
+KEYED = ("address", "name", "hash")
+# Dataset -> (CSV path relative to the repo, {field: column})
+DATASETS = {
+    "transactions": ("txs/transactions_data.csv", {
+        "address": "user", "hash": "hash", "service": "service", "network": "blockchain", "timestamp": "timestamp",
+    }),
+    "fees": ("fees/fees_data.csv", {"address": "contract_address", "service": "app", "network": "network"}),
+    "proposals": ("proposals/proposals_data.csv", {"address": "creator_address", "name": "creator_username"}),
+    "users": ("virgo/virgo_users_data.csv", {"address": "address", "name": "username"}),
+}
+# SQL index per field: the service/network partition index also serves
+# service-only lookups; network-only ones scan the (narrow) rows table
+SQL_INDEXES = {
+    "address": "address, timestamp",
+    "name": "name",
+    "hash": "hash",
+    "service": "service, network, timestamp",
+    "timestamp": "timestamp",
+}
+
+
+def dataset_path(dataset):
+    return os.path.join(REPO_DIR, DATASETS[dataset][0])
+
+
+def index_path(csv_filename):
+    return csv_filename + ".index.sqlite"
+
+
+def iter_csv_records(csv_file, offset=0):
+    """
+    Yields (offset, length, values) for every CSV record of a binary file
+    from `offset`; a record can span lines when a quoted field has newlines.
+    """
+    csv_file.seek(offset)
+    consumed = offset
+
+    def lines():
+        nonlocal consumed
+        # csv.reader pulls one line at a time, so `consumed` ends where its last record does
+        for line in csv_file:
+            consumed += len(line)
+            yield line.decode("utf-8")
+
+    start = offset
+    for values in csv.reader(lines()):
+        yield start, consumed - start, values
+        start = consumed
+
+
+def parse_record(record):
+    return next(csv.reader(io.StringIO(record.decode("utf-8"))), [])
+
+
+def _normalize(field, value):
+    """The value stored in (and looked up from) the index for a CSV field."""
+    if not value:
+        return None
+    if field == "timestamp":
+        try:
+            return int(float(value))
+        except ValueError:
+            return None
+    if field in KEYED:
+        digest = hashlib.blake2b(value.lower().encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big", signed=True)
+    return value
+
+
+def parse_time(value):
+    """A millisecond timestamp from milliseconds or an ISO date/datetime (UTC unless given)."""
+    if value.lstrip("-").isdigit():
+        return int(value)
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+class DatasetIndex:
+    """The index of one CSV file; `columns` maps the indexed fields to its columns."""
+
+    def __init__(self, csv_filename, columns):
+        self.csv_filename = csv_filename
+        self.columns = columns
+        self.path = index_path(csv_filename)
+
+    def _state(self):
+        stat = os.stat(self.csv_filename)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "columns": self.columns}
+
+    def _meta(self):
+        """The state the index was built from, or None if there is no usable index."""
+        if not os.path.exists(self.path):
+            return None
+        connection = sqlite3.connect(self.path)
+        try:
+            row = connection.execute("SELECT value FROM meta WHERE key = 'state'").fetchone()
+        except sqlite3.DatabaseError:
+            return None
+        finally:
+            connection.close()
+        return json.loads(row[0]) if row else None
+
+    def _is_current(self, meta, state):
+        return meta is not None and all(meta.get(key) == value for key, value in state.items())
+
+    def is_fresh(self):
+        return self._is_current(self._meta(), self._state())
+
+    def refresh(self, append=False):
+        """
+        Rebuilds the index if the CSV changed since it was built; returns
+        True if it did. With `append`, the CSV is known to only have grown,
+        so just the rows past the indexed size are added.
+        """
+        meta = self._meta()
+        state = self._state()
+        if self._is_current(meta, state):
+            return False
+        if append and meta is not None and meta["columns"] == self.columns and meta["size"] <= state["size"]:
+            self._index(state, meta["size"], meta["header"])
+        else:
+            self._build(state)
+        return True
+
+    def _rows(self, csv_file, offset, header):
+        # (slot in the row, position in the CSV record, field) of every indexed column
+        slots = [(2 + FIELDS.index(field), header.index(column), field) for field, column in self.columns.items()]
+        template = [None] * (len(FIELDS) + 2)
+        for start, length, values in iter_csv_records(csv_file, offset):
+            if not values:
+                continue
+            row = template.copy()
+            row[0] = start
+            row[1] = length
+            for slot, position, field in slots:
+                if position < len(values) and values[position]:
+                    row[slot] = _normalize(field, values[position])
+            yield row
+
+    def _build(self, state):
+        """Indexes the whole CSV into a fresh database that then replaces the old one."""
+        tmp_path = self.path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("PRAGMA cache_size = -65536")  # KiB; keeps the index sorts in memory
+        connection.execute("PRAGMA temp_store = MEMORY")
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute(
+            "CREATE TABLE rows (offset INTEGER PRIMARY KEY, length INTEGER, "
+            + ", ".join(f"{field} {'TEXT' if field in ('service', 'network') else 'INTEGER'}" for field in FIELDS)
+            + ")"
+        )
+        with open(self.csv_filename, "rb") as csv_file:
+            header = parse_record(csv_file.readline())
+            self._insert(connection, csv_file, csv_file.tell(), header, state)
+        # Indexes are cheaper to build once the rows are in
+        for field in self.columns.keys() & SQL_INDEXES.keys():
+            connection.execute(f"CREATE INDEX rows_{field} ON rows ({SQL_INDEXES[field]})")
+        connection.commit()
+        connection.close()
+        os.replace(tmp_path, self.path)
+
+    def _index(self, state, offset, header):
+        """Adds the rows from `offset` on to the existing index."""
+        connection = sqlite3.connect(self.path)
+        with open(self.csv_filename, "rb") as csv_file:
+            self._insert(connection, csv_file, offset, header, state)
+        connection.commit()
+        connection.close()
+
+    def _insert(self, connection, csv_file, offset, header, state):
+        connection.executemany(f"INSERT INTO rows VALUES ({', '.join('?' * (len(FIELDS) + 2))})",
+                               self._rows(csv_file, offset, header))
+        connection.execute("INSERT OR REPLACE INTO meta VALUES ('state', ?)",
+                           (json.dumps({**state, "header": header}),))
+
+    def query(self, limit=None, since=None, until=None, **filters):
+        """
+        Yields the rows (dicts) matching every given field filter and the
+        [since, until] millisecond time range, in file order.
+        """
+        unknown = [field for field in filters if field not in self.columns]
+        if unknown or ((since is not None or until is not None) and "timestamp" not in self.columns):
+            missing = unknown or ["timestamp"]
+            raise ValueError(f"{os.path.basename(self.csv_filename)} is not indexed by {', '.join(missing)}")
+        clauses = []
+        params = []
+        for field, value in filters.items():
+            if value is not None:
+                clauses.append(f"{field} = ?")
+                params.append(_normalize(field, value))
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("timestamp <= ?")
+            params.append(until)
+        sql = "SELECT offset, length FROM rows"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY offset"
+        # Keys can collide, so rows matched by one are checked against the value
+        checks = [(self.columns[field], value.lower()) for field, value in filters.items()
+                  if field in KEYED and value is not None]
+
+        connection = sqlite3.connect(self.path)
+        try:
+            header = json.loads(connection.execute("SELECT value FROM meta WHERE key = 'state'").fetchone()[0])["header"]
+            found = 0
+            with open(self.csv_filename, "rb") as csv_file:
+                for offset, length in connection.execute(sql, params):
+                    if limit is not None and found >= limit:
+                        break
+                    csv_file.seek(offset)
+                    row = dict(zip(header, parse_record(csv_file.read(length))))
+                    if all(row.get(column, "").lower() == value for column, value in checks):
+                        found += 1
+                        yield row
+        finally:
+            connection.close()
+
+
+def open_index(dataset, csv_filename=None):
+    """The DatasetIndex of a dataset's CSV (by default, where its pipeline writes it)."""
+    _, columns = DATASETS[dataset]
+    return DatasetIndex(csv_filename or dataset_path(dataset), columns)
+
+
+def refresh_index(dataset, csv_filename=None, append=False):
+    """Brings a dataset's index up to date with its CSV, if there is one."""
+    index = open_index(dataset, csv_filename)
+    if not os.path.exists(index.csv_filename):
+        return None
+    started = time.perf_counter()
+    if index.refresh(append):
+        print(f"Indexed {os.path.basename(index.csv_filename)} in {time.perf_counter() - started:.2f}s")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the CSV outputs and look rows up without scanning them.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="(re)build the indexes of datasets whose CSV changed")
+    build.add_argument("datasets", nargs="*", metavar="DATASET",
+                       help=f"datasets to index: {', '.join(DATASETS)} (default: all)")
+    query = commands.add_parser("query", help="print the rows matching every given filter")
+    query.add_argument("dataset", choices=DATASETS)
+    query.add_argument("--address", help="user, contract or creator address")
+    query.add_argument("--name", help="username or creator username")
+    query.add_argument("--hash", help="transaction hash")
+    query.add_argument("--service")
+    query.add_argument("--network")
+    query.add_argument("--since", type=parse_time, help="earliest timestamp: ms or an ISO date/datetime (UTC)")
+    query.add_argument("--until", type=parse_time, help="latest timestamp: ms or an ISO date/datetime (UTC)")
+    query.add_argument("--limit", type=int)
+    query.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        unknown = [name for name in args.datasets if name not in DATASETS]
+        if unknown:
+            parser.error(f"unknown dataset(s): {', '.join(unknown)}")
+        for dataset in args.datasets or DATASETS:
+            if refresh_index(dataset) is None:
+                print(f"No {dataset} CSV to index at {dataset_path(dataset)}")
+        return
+
+    with contextlib.redirect_stdout(sys.stderr):  # keep stdout to the rows
+        index = refresh_index(args.dataset)
+    if index is None:
+        parser.error(f"no {args.dataset} CSV at {dataset_path(args.dataset)}; run its pipeline first")
+    filters = {field: getattr(args, field) for field in ("address", "name", "hash", "service", "network")
+               if getattr(args, field) is not None}
+    started = time.perf_counter()
+    try:
+        rows = list(index.query(args.limit, args.since, args.until, **filters))
+    except ValueError as e:
+        parser.error(str(e))
+    elapsed = time.perf_counter() - started
+    if args.format == "csv":
+        writer = csv.writer(sys.stdout)
+        if rows:
+            writer.writerow(rows[0])
+        for row in rows:
+            writer.writerow(row.values())
+    else:
+        for row in rows:
+            print(jsonio.dumps(row).decode("utf-8"))
+    print(f"{len(rows)} rows in {elapsed * 1000:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
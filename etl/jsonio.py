@@ -0,0 +1,62 @@
+"""
+JSON encoding and decoding for the pipelines. Uses orjson when it is
+installed and the standard library otherwise; set ETL_JSON_BACKEND=json to
+force the standard library (e.g. to compare the two with etl.bench).
+
+Output is compact UTF-8 by default, or the repo's indented layout
+("key":value, one field per line) when an indent is given.
+"""
+import json
+import os
+import re
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+BACKENDS = ("orjson", "json")
+# orjson turns integers beyond 64 bits into floats, so payloads with a
+# number of 19+ digits go to json. Spotting one with translate() and find()
+# costs a fraction of a regex search: digits become "0", the characters that
+# can precede a number become ":" and whitespace and signs are dropped.
+_DIGITS = bytes(ord("0") if chr(byte).isdigit() and byte < 128
+                else ord(":") if chr(byte) in ":[," else ord(".") for byte in range(256))
+_BIG_INT = b":" + b"0" * 19
+_BIG_INT_TEXT = re.compile(r"[:\[,]\s*-?\d{19,}")
+
+
+def _has_big_int(data):
+    if isinstance(data, str):
+        return _BIG_INT_TEXT.search(data) is not None
+    return bytes(data).translate(_DIGITS, b" \t\r\n-").find(_BIG_INT) != -1
+
+
+def _backend():
+    wanted = os.getenv("ETL_JSON_BACKEND", "orjson")
+    if wanted not in BACKENDS:
+        raise ValueError(f"Unknown ETL_JSON_BACKEND {wanted!r}; expected one of {', '.join(BACKENDS)}")
+    return "orjson" if wanted == "orjson" and orjson is not None else "json"
+
+
+BACKEND = _backend()
+
+
+def loads(data, backend=None):
+    """Decodes a JSON document from bytes or str."""
+    if (backend or BACKEND) == "orjson":
+        if not _has_big_int(data):
+            return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, indent=None, backend=None):
+    """Encodes `obj` as UTF-8 bytes: compact, or indented by `indent` spaces."""
+    if indent is not None:
+        return json.dumps(obj, indent=indent, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if (backend or BACKEND) == "orjson":
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass  # e.g. an integer beyond 64 bits; json handles it
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
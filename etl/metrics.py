@@ -0,0 +1,183 @@
+"""
+Instrumentation shared by the pipelines: counters and histograms labelled
+by pipeline, endpoint, service and stage. The client records requests,
+latency, bytes, retries and the time spent sleeping on the rate limiter or
+before a retry. The pipelines record rows emitted, dedupe hits and the
+time spent in each of their stages.
+
+A run's metrics can be exported as JSON lines (appended, one line per
+series) and/or as a Prometheus text file (replaced, for the node
+exporter's textfile collector). By default the paths come from the
+METRICS_JSONL and METRICS_PROM environment variables.
+"""
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIX = "etl_"
+
+
+def sizeof_fmt(num, suffix='B'):
+    for unit in ['', 'K', 'M', 'G', 'T', 'P', 'E', 'Z']:
+        if abs(num) < 1024.0:
+            return f"{num:3.1f} {unit}{suffix}"
+        num /= 1024.0
+    return f"{num:.1f} Y{suffix}"
+
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items() if value is not None))
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """[(upper bound, observations <= it)], Prometheus style."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """Counters and histograms of one run, keyed by metric name and labels."""
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        self.counters[_key(name, labels)] += value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """Adds the time spent in the block to stage_seconds{stage=...}."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc("stage_seconds", time.perf_counter() - started, stage=stage, **labels)
+
+    def total(self, name, **labels):
+        """Sum of a counter over every series matching `labels`."""
+        wanted = set(_key(name, labels)[1])
+        return sum(value for (series, series_labels), value in self.counters.items()
+                   if series == name and wanted <= set(series_labels))
+
+    def record_dedupe(self, store, **labels):
+        """Copies a DedupeStore's hit/miss counts."""
+        self.inc("dedupe_hits", store.hits, **labels)
+        self.inc("dedupe_misses", store.misses, **labels)
+
+    def records(self):
+        """One dict per series, as written to the JSON lines export."""
+        for (name, labels), value in sorted(self.counters.items()):
+            yield {"metric": PREFIX + name + "_total", "labels": dict(labels), "value": value}
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            yield {
+                "metric": PREFIX + name,
+                "labels": dict(labels),
+                "count": histogram.count,
+                "sum": histogram.sum,
+                "buckets": {_format_bound(bound): count for bound, count in histogram.cumulative()},
+            }
+
+    def write_jsonl(self, filename):
+        now = time.time()
+        with open(filename, "a", encoding="utf-8") as jsonl_file:
+            for record in self.records():
+                record = {"time": now, "run_started": self.started, **record}
+                jsonl_file.write(json.dumps(record) + "\n")
+
+    def write_prometheus(self, filename):
+        lines = []
+        seen = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            metric = PREFIX + name + "_total"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            metric = PREFIX + name
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            for bound, count in histogram.cumulative():
+                bucket_labels = labels + (("le", _format_bound(bound)),)
+                lines.append(f"{metric}_bucket{_format_labels(bucket_labels)} {count}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum:g}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as prom_file:
+            prom_file.write("\n".join(lines) + "\n")
+        os.replace(tmp_filename, filename)
+
+    def export(self, jsonl=None, prometheus=None):
+        """Writes the enabled exports; the paths default to METRICS_JSONL and METRICS_PROM."""
+        jsonl = jsonl or os.getenv("METRICS_JSONL")
+        prometheus = prometheus or os.getenv("METRICS_PROM")
+        if jsonl:
+            self.write_jsonl(jsonl)
+        if prometheus:
+            self.write_prometheus(prometheus)
+
+    def summary(self):
+        """Prints where the time went: per pipeline stage, waiting on requests and sleeping."""
+        stages = defaultdict(float)
+        for (name, labels), value in self.counters.items():
+            if name == "stage_seconds":
+                labels = dict(labels)
+                stages[(labels.get("pipeline", ""), labels["stage"])] += value
+        for (pipeline, stage), seconds in sorted(stages.items()):
+            print(f"{pipeline:<10} {stage:<10} {seconds:8.2f}s")
+        requests = sum(histogram.count for (name, _), histogram in self.histograms.items()
+                       if name == "request_seconds")
+        latency = sum(histogram.sum for (name, _), histogram in self.histograms.items()
+                      if name == "request_seconds")
+        print(f"requests: {requests} ({latency:.2f}s waiting on responses, "
+              f"{sizeof_fmt(self.total('downloaded_bytes'))} downloaded), "
+              f"429s: {self.total('throttled'):g}, retries: {self.total('retries'):g}")
+        print(f"sleeping: {self.total('sleep_seconds', reason='ratelimit'):.2f}s on the rate limiter, "
+              f"{self.total('sleep_seconds', reason='retry'):.2f}s before retries")
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else f"{bound:g}"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        label + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for label, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
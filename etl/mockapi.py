@@ -0,0 +1,294 @@
+"""
+Local stand-in for the messier API and jsonBlob, for running the pipelines
+offline. It serves platform/transaction, platform/fee, virgo/permissions,
+virgo/proposal-list and virgo/cycle with deterministic generated data, and
+can add latency and throttle requests the way the real API does. The
+jsonBlob endpoints keep blobs in memory.
+
+    python -m etl.mockapi --transactions 5000 --latency 0.05 --throttle-every 20
+    MESSIER_API_URL=http://127.0.0.1:8080/api/v1 \\
+    JSONBLOB_API_URL=http://127.0.0.1:8080/api/jsonBlob python -m etl.runner
+
+GET /_stats returns the requests, rows and throttled responses served per
+endpoint and the jsonBlob uploads (and how many were gzip-encoded); POST
+/_reset clears them.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+from collections import Counter
+
+from aiohttp import web
+
+SERVICES = ["horizon", "adastra", "openhatch", "p2p", "virgo"]
+NETWORKS = ["eth", "bsc", "polygon", "arbitrum"]
+TOKENS = [
+    ("ETH", ""),
+    ("USDT", "0xdAC17F958D2ee523a2206206994597C13D831ec7"),
+    ("USDC", "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"),
+    ("LINK", "0x514910771af9ca656af840dff83e8264ecf986ca"),
+]
+LATEST_TIMESTAMP = 1_700_000_000_000  # ms; transactions go back one minute each
+
+
+class MockData:
+    """Generates the API's records from their index, so any size costs no memory."""
+
+    def __init__(self, transactions=1000, users=500, proposals=200, fees=5, seed=0):
+        self.transactions = transactions
+        self.users = users
+        self.proposals = proposals
+        self.fees = fees
+        self.seed = seed
+
+    def _hex(self, *parts, size=20):
+        key = ":".join(str(part) for part in (self.seed,) + parts).encode()
+        return "0x" + hashlib.blake2b(key, digest_size=size).hexdigest()
+
+    def address(self, index):
+        return self._hex("address", index)
+
+    def transaction(self, service, index):
+        rnd = random.Random(f"{self.seed}:{service}:{index}")
+        return {
+            "type": rnd.choice(["deposit", "withdraw", "swap"]),
+            "timestamp": LATEST_TIMESTAMP - index * 60_000,
+            "network": rnd.choice(NETWORKS),
+            "hash": self._hex(service, index, size=32),
+            "address": self.address(rnd.randrange(max(self.users, 1))),
+            "trxData": [
+                {"symbol": symbol, "contract": contract, "value": round(rnd.uniform(0, 1000), 6)}
+                for symbol, contract in rnd.sample(TOKENS, rnd.randint(1, 2))
+            ],
+        }
+
+    def user(self, index):
+        rnd = random.Random(f"{self.seed}:user:{index}")
+        return {
+            "user": {"address": self.address(index), "username": f"user{index}", "active": rnd.random() < 0.9},
+            "type": rnd.choice(["powehi", "sirius", "vega"]),
+            "active": rnd.random() < 0.9,
+            "darkList": rnd.random() < 0.05,
+            "activeDarkList": False,
+            "stakeAmount": rnd.randrange(0, 100_000),
+        }
+
+    def _user_ref(self, index):
+        index %= max(self.users, 1)
+        return {"address": self.address(index), "username": f"user{index}"}
+
+    def proposal(self, index):
+        rnd = random.Random(f"{self.seed}:proposal:{index}")
+        symbol, contract = rnd.choice(TOKENS)
+        return {
+            "id": index + 1,
+            "status": rnd.choice(["succeeded", "failed", "active"]),
+            "state": rnd.choice(["executed", "pending", "expired"]),
+            "title": f"Proposal {index + 1}",
+            "type": rnd.choice(["classic", "grant"]),
+            "voteType": rnd.choice(["single", "multi"]),
+            "creator": self._user_ref(rnd.randrange(1 << 30)),
+            "currency": {"symbol": symbol, "contractAddress": contract},
+            "singers": [self._user_ref(rnd.randrange(1 << 30)) for _ in range(rnd.randint(0, 3))],
+            "neededSign": rnd.randint(1, 3),
+            "cycle": index // 10,
+            "approves": [self._user_ref(rnd.randrange(1 << 30)) for _ in range(rnd.randint(0, 5))],
+        }
+
+    def fee(self, service, index):
+        symbol, contract = TOKENS[index % len(TOKENS)]
+        return {"network": NETWORKS[index % len(NETWORKS)], "contract": contract or None,
+                "symbol": symbol, "value": round(0.001 * (index + 1), 6)}
+
+
+def _page(request):
+    try:
+        page = max(1, int(request.query.get("page", 1)))
+        limit = max(1, int(request.query.get("limit", 100)))
+    except ValueError:
+        raise web.HTTPBadRequest(text=json.dumps({"message": "page and limit must be integers"}))
+    return page, limit
+
+
+class MockServer:
+    """
+    The aiohttp application. Every `throttle_every`-th API request (0: none)
+    is answered with a 429 carrying `retry_after` as a Retry-After header,
+    as a "Retry after: N seconds" message in the body, or both.
+    """
+
+    def __init__(self, data, latency=0.0, jitter=0.0, throttle_every=0, retry_after=1.0,
+                 throttle_style="message"):
+        self.data = data
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.throttle_style = throttle_style
+        self.api_requests = 0
+        self.requests = Counter()
+        self.rows = Counter()
+        self.throttled = Counter()
+        self.blobs = {}
+        self.blob_count = 0  # blob ids are never reused
+        self.blob_uploads = Counter()  # POST/PUT requests, and how many were gzip-encoded
+
+    def application(self):
+        app = web.Application(client_max_size=1 << 30, middlewares=[self._api_middleware])
+        app.router.add_get("/api/v1/platform/transaction", self.transactions)
+        app.router.add_get("/api/v1/platform/fee", self.fees)
+        app.router.add_get("/api/v1/virgo/permissions", self.permissions)
+        app.router.add_get("/api/v1/virgo/proposal-list", self.proposals)
+        app.router.add_get("/api/v1/virgo/cycle", self.cycle)
+        app.router.add_post("/api/jsonBlob", self.create_blob)
+        app.router.add_put("/api/jsonBlob/{blob_id}", self.update_blob)
+        app.router.add_get("/api/jsonBlob/{blob_id}", self.get_blob)
+        app.router.add_get("/_stats", self.stats)
+        app.router.add_post("/_reset", self.reset)
+        return app
+
+    @web.middleware
+    async def _api_middleware(self, request, handler):
+        if not request.path.startswith("/api/v1/"):
+            return await handler(request)
+        endpoint = request.path[len("/api/v1/"):]
+        self.requests[endpoint] += 1
+        self.api_requests += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if self.throttle_every and self.api_requests % self.throttle_every == 0:
+            self.throttled[endpoint] += 1
+            headers = {}
+            body = {"statusCode": 429, "message": "Too Many Requests"}
+            if self.throttle_style in ("header", "both"):
+                headers["Retry-After"] = f"{self.retry_after:g}"
+            if self.throttle_style in ("message", "both"):
+                body["message"] = f"ThrottlerException: Too Many Requests. Retry after: {self.retry_after:g} seconds"
+            return web.json_response(body, status=429, headers=headers)
+        return await handler(request)
+
+    def _respond(self, request, data, rows):
+        self.rows[request.path[len("/api/v1/"):]] += rows
+        return web.json_response({"statusCode": 200, "data": data})
+
+    async def transactions(self, request):
+        service = request.query.get("service")
+        if service not in SERVICES:
+            raise web.HTTPBadRequest(text=json.dumps({"message": f"Unknown service {service}"}))
+        page, limit = _page(request)
+        indexes = range((page - 1) * limit, min(page * limit, self.data.transactions))
+        items = [self.data.transaction(service, index) for index in indexes]
+        return self._respond(request, {"items": items, "total": self.data.transactions}, len(items))
+
+    async def fees(self, request):
+        service = request.query.get("service")
+        if service not in SERVICES:
+            raise web.HTTPBadRequest(text=json.dumps({"message": f"Unknown service {service}"}))
+        items = [self.data.fee(service, index) for index in range(self.data.fees)]
+        return self._respond(request, {"items": items}, len(items))
+
+    async def permissions(self, request):
+        page, limit = _page(request)
+        users = [self.data.user(index)
+                 for index in range((page - 1) * limit, min(page * limit, self.data.users))]
+        return self._respond(request, {"users": users}, len(users))
+
+    async def proposals(self, request):
+        page, limit = _page(request)
+        proposals = [self.data.proposal(index)
+                     for index in range((page - 1) * limit, min(page * limit, self.data.proposals))]
+        return self._respond(request, {"proposals": proposals, "total": self.data.proposals}, len(proposals))
+
+    async def cycle(self, request):
+        cycle = {"currentProposalCycle": self.data.proposals % 10, "currentFullCycle": self.data.proposals // 10,
+                 "fullCycleProposalRemainToEnd": 10 - self.data.proposals % 10}
+        return self._respond(request, cycle, 1)
+
+    def _blob_upload(self, request):
+        self.blob_uploads[request.method] += 1
+        if request.headers.get("Content-Encoding") == "gzip":
+            self.blob_uploads["gzip"] += 1
+
+    async def create_blob(self, request):
+        self._blob_upload(request)
+        body = await request.read()  # aiohttp undoes the Content-Encoding
+        json.loads(body)
+        self.blob_count += 1
+        blob_id = str(self.blob_count)
+        self.blobs[blob_id] = body
+        location = str(request.url.with_path(f"/api/jsonBlob/{blob_id}").with_query(None))
+        return web.Response(status=201, headers={"Location": location})
+
+    async def update_blob(self, request):
+        blob_id = request.match_info["blob_id"]
+        if blob_id not in self.blobs:
+            raise web.HTTPNotFound()
+        self._blob_upload(request)
+        body = await request.read()
+        json.loads(body)
+        self.blobs[blob_id] = body
+        return web.Response(status=200, body=body, content_type="application/json")
+
+    async def get_blob(self, request):
+        blob_id = request.match_info["blob_id"]
+        if blob_id not in self.blobs:
+            raise web.HTTPNotFound()
+        return web.Response(body=self.blobs[blob_id], content_type="application/json")
+
+    async def stats(self, request):
+        return web.json_response({
+            "requests": dict(self.requests),
+            "rows": dict(self.rows),
+            "throttled": dict(self.throttled),
+            "blobs": len(self.blobs),
+            "blob_uploads": dict(self.blob_uploads),
+        })
+
+    async def reset(self, request):
+        self.api_requests = 0
+        self.requests.clear()
+        self.rows.clear()
+        self.throttled.clear()
+        self.blob_uploads.clear()
+        return web.json_response({})
+
+
+def add_arguments(parser):
+    """Adds the dataset and behaviour options (shared with etl.bench)."""
+    parser.add_argument("--transactions", type=int, default=1000,
+                        help="transactions per service (default 1000)")
+    parser.add_argument("--users", type=int, default=500, help="virgo permission users (default 500)")
+    parser.add_argument("--proposals", type=int, default=200, help="virgo proposals (default 200)")
+    parser.add_argument("--fees", type=int, default=5, help="fee entries per service (default 5)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated data")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra random seconds")
+    parser.add_argument("--throttle-every", type=int, default=0, metavar="N",
+                        help="answer every Nth API request with a 429 (default: never)")
+    parser.add_argument("--retry-after", type=float, default=1.0,
+                        help="retry hint in seconds sent with a 429 (default 1)")
+    parser.add_argument("--throttle-style", choices=["message", "header", "both"], default="message",
+                        help="send the hint as a 'Retry after: N seconds' message, a Retry-After header, or both")
+
+
+def server_from_args(args):
+    data = MockData(args.transactions, args.users, args.proposals, args.fees, args.seed)
+    return MockServer(data, args.latency, args.jitter, args.throttle_every, args.retry_after,
+                      args.throttle_style)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the messier API and jsonBlob.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = server_from_args(args)
+    print(f"Mock API on http://{args.host}:{args.port}/api/v1, jsonBlob on http://{args.host}:{args.port}/api/jsonBlob")
+    web.run_app(server.application(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
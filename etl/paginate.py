@@ -0,0 +1,39 @@
+import asyncio
+
+
+async def prefetch_pages(fetch, end_of, window, start=1):
+    """
+    Async generator over a paginated endpoint that keeps up to `window`
+    pages in flight and yields (page, result) strictly in page order.
+
+    `fetch(page)` is a coroutine returning the page's result. `end_of(page,
+    result)` returns the last page number if that result reveals it (an
+    empty page, a short page, or a 'total' in the response), else None.
+    Pages are launched speculatively ahead of the known end; once the end is
+    known, requests for pages past it are cancelled and never yielded.
+    Results that finish early wait in their tasks until their turn, which
+    acts as the reorder buffer.
+    """
+    pending = {}
+    next_page = start
+    expected = start
+    last_page = None
+    try:
+        while last_page is None or expected <= last_page:
+            while len(pending) < window and (last_page is None or next_page <= last_page):
+                pending[next_page] = asyncio.create_task(fetch(next_page))
+                next_page += 1
+            result = await pending.pop(expected)
+
+            end = end_of(expected, result)
+            if end is not None and (last_page is None or end < last_page):
+                last_page = end
+                for page in [page for page in pending if page > last_page]:
+                    pending.pop(page).cancel()
+
+            if last_page is None or expected <= last_page:
+                yield expected, result
+            expected += 1
+    finally:
+        for task in pending.values():
+            task.cancel()
@@ -0,0 +1,450 @@
+"""
+Partitioned output layout: rows are split by a dimension (the service) and
+by the UTC month or day of their timestamp into Hive-style directories,
+
+    transactions_partitions/manifest.json
+    transactions_partitions/service=horizon/month=2023-11/part-00000.csv
+    transactions_partitions/service=horizon/month=2023-11/part-00000.json
+
+each holding shards of at most about `shard_bytes` of CSV. The manifest
+lists every partition with its row count, content hash and shards, so a
+consumer can open only the partitions it needs:
+
+    python -m etl.partitions txs/transactions_partitions service=horizon --since 2023-11
+
+Rows arrive already encoded (see sinks.encode_rows), so writing them is
+plain I/O. Every partition belongs to one of `workers` writer threads,
+which keeps its rows in arrival order while partitions are written in
+parallel.
+
+A full run writes each partition to temporary shards and, on close(),
+keeps the existing shards of the partitions whose content hash matches the
+manifest: only the partitions that changed are replaced. An appending run
+only opens the partitions that receive rows.
+"""
+import argparse
+import collections
+import csv
+import io
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from urllib.parse import quote
+
+from etl import jsonio
+from etl.coerce import to_int
+from etl.fingerprint import MODULUS, DatasetHash
+from etl.rollup import DAY_MS, EPOCH_ORDINAL
+from etl.sinks import JsonWriter, encode_rows, iter_json_records
+
+MANIFEST_FILENAME = "manifest.json"
+GRAINS = ("month", "day")
+# CSV bytes after which a partition's shard is closed and the next one started
+SHARD_BYTES = 64 << 20
+WRITER_WORKERS = 4
+# Batches queued per writer before write_encoded() waits for the writers
+MAX_PENDING = 8
+# Directory name of an empty dimension value or of a row without a timestamp
+NULL_VALUE = "__null__"
+
+
+def load_manifest(directory):
+    """The manifest of a partitioned dataset, or None if there is none."""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILENAME), "rb") as manifest_file:
+            return jsonio.loads(manifest_file.read())
+    except (OSError, ValueError):
+        return None
+
+
+def can_append(directory, fieldnames, json_format="array", indent=None, dimension="service", grain="month",
+               content=None):
+    """
+    True if the partitions in `directory` were written with this layout
+    (and hold records with the `content` hash, if given), so they can be
+    appended to.
+    """
+    manifest = load_manifest(directory)
+    return manifest is not None and manifest.get("layout") == _layout(
+        fieldnames, json_format, indent, dimension, grain) and content in (None, manifest["content"])
+
+
+def _layout(fieldnames, json_format, indent, dimension, grain):
+    return {"fieldnames": list(fieldnames), "partition_by": [dimension, grain],
+            "json_format": json_format, "indent": indent}
+
+
+def _directory_value(value):
+    return quote(str(value), safe="") if value not in (None, "") else NULL_VALUE
+
+
+class _Partition:
+    """
+    The shards of the partition at `path` (with dimension and period
+    `values`), written by the `writer` thread only, so it needs no locking.
+    With `entry` (its manifest entry) rows are added to the existing shards;
+    with tmp=True they go to temporary shards that replace them on close.
+    """
+
+    def __init__(self, root, path, values, writer, header, json_format, indent, shard_bytes,
+                 entry=None, tmp=False):
+        self.path = path
+        self.values = values
+        self.writer = writer
+        self.directory = os.path.join(root, *path.split("/"))
+        os.makedirs(self.directory, exist_ok=True)
+        self.header = header
+        self.json_format = json_format
+        self.indent = indent
+        self.shard_bytes = shard_bytes
+        self.json_extension = ".json" if json_format == "array" else ".ndjson"
+        self.suffix = ".tmp" if tmp else ""
+        self.shards = [dict(shard) for shard in entry["shards"]] if entry is not None else []
+        self.content = DatasetHash(entry["content"], entry["rows"]) if entry is not None else DatasetHash()
+        self._shard = None
+        self._csv_file = None
+        self._json_file = None
+        self._json = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + self.suffix)
+
+    def _open_shard(self):
+        last = self.shards[-1] if self.shards else None
+        if self.suffix == "" and last is not None and last["csv_bytes"] < self.shard_bytes:
+            # Carry on filling the last shard of an appended partition
+            self._shard = last
+            self._csv_file = open(self._path(last["csv"]), "ab")
+            # An array is closed in place; NDJSON rows just go on the end
+            self._json_file = open(self._path(last["json"]), "rb+" if self.json_format == "array" else "ab")
+            self._json = JsonWriter(self._json_file, self.json_format, self.indent, append=True)
+            return
+        number = len(self.shards)
+        self._shard = {"csv": f"part-{number:05d}.csv", "json": f"part-{number:05d}{self.json_extension}",
+                       "rows": 0, "csv_bytes": len(self.header), "json_bytes": 0}
+        self.shards.append(self._shard)
+        self._csv_file = open(self._path(self._shard["csv"]), "wb")
+        self._csv_file.write(self.header)
+        self._json_file = open(self._path(self._shard["json"]), "wb")
+        self._json = JsonWriter(self._json_file, self.json_format, self.indent)
+
+    def _close_shard(self):
+        self._csv_file.close()
+        self._json.close()
+        self._shard["json_bytes"] = self._json_file.tell()
+        self._json_file.close()
+        self._shard = self._csv_file = self._json_file = self._json = None
+
+    def write(self, encoded_rows):
+        lines = []
+        json_rows = []
+        for _, csv_line, json_row, digest in encoded_rows:
+            if self._shard is None:
+                self._open_shard()
+            line = csv_line.encode("utf-8")
+            lines.append(line)
+            json_rows.append(json_row)
+            self._shard["rows"] += 1
+            self._shard["csv_bytes"] += len(line)
+            self.content.add(digest)
+            if self._shard["csv_bytes"] >= self.shard_bytes:
+                self._flush(lines, json_rows)
+                lines, json_rows = [], []
+                self._close_shard()
+        if lines:
+            self._flush(lines, json_rows)
+
+    def _flush(self, lines, json_rows):
+        self._csv_file.write(b"".join(lines))
+        self._json.write_encoded(json_rows)
+
+    def close(self):
+        if self._shard is not None:
+            self._close_shard()
+
+    def files(self, shards=None, suffix=None):
+        suffix = self.suffix if suffix is None else suffix
+        for shard in self.shards if shards is None else shards:
+            yield os.path.join(self.directory, shard["csv"] + suffix)
+            yield os.path.join(self.directory, shard["json"] + suffix)
+
+
+class PartitionedSink:
+    """
+    Writes encoded rows (see sinks.encode_rows) into partitions of
+    `directory` by `dimension` and by the `grain` (month or day) of
+    `time_field`, in `workers` writer threads.
+
+    A fresh sink replaces the partitions whose content changed on close()
+    and removes those that got no rows; discard() drops what it wrote. With
+    append=True rows are added to the partitions in place (see can_append()).
+    After close(), `written`, `unchanged` and `removed` count the partitions.
+    """
+
+    def __init__(self, directory, fieldnames, json_format="array", indent=None, append=False,
+                 dimension="service", time_field="timestamp", grain="month",
+                 shard_bytes=SHARD_BYTES, workers=WRITER_WORKERS):
+        if grain not in GRAINS:
+            raise ValueError(f"Unknown partition grain: {grain}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.json_format = json_format
+        self.indent = indent
+        self.append = append
+        self.dimension = dimension
+        self.grain = grain
+        self.shard_bytes = shard_bytes
+        self.layout = _layout(fieldnames, json_format, indent, dimension, grain)
+        manifest = load_manifest(directory)
+        if append and (manifest is None or manifest.get("layout") != self.layout):
+            raise ValueError(f"{directory} has no partitions with this layout to append to")
+        # Partitions of the previous run, by path; a different layout doesn't carry over
+        self.entries = {}
+        if manifest is not None and manifest.get("layout") == self.layout:
+            self.entries = {entry["path"]: entry for entry in manifest["partitions"]}
+        self.previous = manifest["partitions"] if manifest is not None else []
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(fieldnames)
+        self._header = buffer.getvalue().encode("utf-8")
+        self._dimension = list(fieldnames).index(dimension)
+        self._time = list(fieldnames).index(time_field)
+        self._periods = {}
+        self._partitions = {}
+        self._writers = [ThreadPoolExecutor(1, thread_name_prefix="partition-writer") for _ in range(workers)]
+        self._pending = collections.deque()
+        self.rows = 0
+        self.written = self.unchanged = self.removed = 0
+        self._closed = False
+
+    def _period(self, timestamp):
+        timestamp = to_int(timestamp)
+        if timestamp is None:
+            return NULL_VALUE
+        number = timestamp // DAY_MS
+        period = self._periods.get(number)
+        if period is None:
+            period = date.fromordinal(EPOCH_ORDINAL + number).isoformat()
+            period = self._periods[number] = period[:7] if self.grain == "month" else period
+        return period
+
+    def _partition(self, key):
+        value, period = key
+        path = f"{self.dimension}={_directory_value(value)}/{self.grain}={period}"
+        values = {self.dimension: "" if value is None else str(value), self.grain: period}
+        writer = self._writers[zlib.crc32(path.encode("utf-8")) % len(self._writers)]
+        partition = _Partition(self.directory, path, values, writer, self._header, self.json_format,
+                               self.indent, self.shard_bytes, self.entries.get(path) if self.append else None,
+                               tmp=not self.append)
+        self._partitions[key] = partition
+        return partition
+
+    def _submit(self, writer, func, *args):
+        self._pending.append(writer.submit(func, *args))
+        # Back-pressure: don't let batches pile up faster than the writers get through them
+        while len(self._pending) > MAX_PENDING * len(self._writers):
+            self._pending.popleft().result()
+
+    def _drain(self):
+        while self._pending:
+            self._pending.popleft().result()
+
+    def write_encoded(self, encoded_rows):
+        """Routes rows encoded by encode_rows() to their partitions' writers."""
+        batches = {}
+        for row in encoded_rows:
+            values = row[0]
+            key = (values[self._dimension], self._period(values[self._time]))
+            batch = batches.get(key)
+            if batch is None:
+                batch = batches[key] = []
+            batch.append(row)
+        for key, batch in batches.items():
+            partition = self._partitions.get(key) or self._partition(key)
+            self._submit(partition.writer, partition.write, batch)
+            self.rows += len(batch)
+
+    def write_json(self, json_filename, batch_size=1000):
+        """Writes every record of a JSON array or NDJSON output, e.g. to rebuild the partitions."""
+        fieldnames = self.layout["fieldnames"]
+        batch = []
+        for record in iter_json_records(json_filename):
+            batch.append(tuple(record.get(field) for field in fieldnames))
+            if len(batch) >= batch_size:
+                self.write_encoded(encode_rows(fieldnames, batch, self.json_format, self.indent))
+                batch = []
+        if batch:
+            self.write_encoded(encode_rows(fieldnames, batch, self.json_format, self.indent))
+
+    def _close_partitions(self):
+        try:
+            self._drain()
+        finally:
+            for partition in self._partitions.values():
+                self._pending.append(partition.writer.submit(partition.close))
+            self._drain()
+            for writer in self._writers:
+                writer.shutdown()
+
+    def _entry(self, partition):
+        return {"path": partition.path, **partition.values, "rows": partition.content.records,
+                "content": partition.content.hexdigest(), "shards": partition.shards}
+
+    def _remove(self, entry, keep=()):
+        """Deletes the shards of a manifest entry, but for the file names in `keep`."""
+        directory = os.path.join(self.directory, *entry["path"].split("/"))
+        for shard in entry["shards"]:
+            for name in (shard["csv"], shard["json"]):
+                if name in keep:
+                    continue
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+        # Drop the partition directory and its dimension directory once empty
+        for _ in range(2):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+    def close(self):
+        """Waits for the writers, moves the changed partitions into place and saves the manifest."""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._close_partitions()
+        except BaseException:
+            if not self.append:
+                self._remove_tmp()
+            raise
+        entries = dict(self.entries) if self.append else {}
+        for partition in self._partitions.values():
+            entry = self._entry(partition)
+            if self.append:
+                entries[partition.path] = entry
+                self.written += 1
+                continue
+            old = self.entries.get(partition.path)
+            if old is not None and old["content"] == entry["content"] and old["rows"] == entry["rows"] \
+                    and all(os.path.exists(filename) for filename in partition.files(old["shards"], "")):
+                # Same records as the last run: keep the partition's shards as they are
+                for filename in partition.files():
+                    os.remove(filename)
+                entries[partition.path] = old
+                self.unchanged += 1
+                continue
+            if old is not None:
+                self._remove(old, {name for shard in entry["shards"] for name in (shard["csv"], shard["json"])})
+            for filename in partition.files():
+                os.replace(filename, filename[:-len(partition.suffix)])
+            entries[partition.path] = entry
+            self.written += 1
+        if not self.append:
+            for entry in self.previous:
+                current = entries.get(entry["path"])
+                if current is None:
+                    # A partition no longer in the data
+                    self._remove(entry)
+                    self.removed += 1
+                elif entry["path"] not in self.entries:
+                    # Written with another layout: drop the files the new shards didn't overwrite
+                    self._remove(entry, {name for shard in current["shards"] for name in (shard["csv"], shard["json"])})
+        self._save(sorted(entries.values(), key=lambda entry: entry["path"]))
+
+    def _save(self, entries):
+        content = sum(int(entry["content"], 16) for entry in entries) % MODULUS
+        manifest = {"layout": self.layout, "shard_bytes": self.shard_bytes,
+                    "rows": sum(entry["rows"] for entry in entries), "content": f"{content:064x}",
+                    "partitions": entries}
+        filename = os.path.join(self.directory, MANIFEST_FILENAME)
+        with open(filename + ".tmp", "wb") as manifest_file:
+            manifest_file.write(jsonio.dumps(manifest, indent=4))
+        os.replace(filename + ".tmp", filename)
+
+    def _remove_tmp(self):
+        for partition in self._partitions.values():
+            for filename in partition.files():
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+
+    def discard(self):
+        """Closes the sink without replacing any partition (appended rows stay)."""
+        if self.append:
+            self.close()
+            return
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._close_partitions()
+        finally:
+            self._remove_tmp()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def select(directory, since=None, until=None, extension=".csv", **values):
+    """
+    Paths of the shards of the partitions matching `values` (e.g.
+    service="horizon") whose period overlaps since..until (inclusive ISO
+    dates or months, e.g. "2023-11" or "2023-11-05"), in manifest order.
+    """
+    manifest = load_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No {MANIFEST_FILENAME} in {directory}")
+    dimension, grain = manifest["layout"]["partition_by"]
+    unknown = set(values) - {dimension}
+    if unknown:
+        raise ValueError(f"Partitions can only be selected by {dimension}, not {', '.join(sorted(unknown))}")
+    for entry in manifest["partitions"]:
+        if dimension in values and entry[dimension] != values[dimension]:
+            continue
+        period = entry[grain]
+        if period == NULL_VALUE and (since or until):
+            continue
+        # A month overlaps a date range when it is between the months of its bounds
+        if since and period < since[:len(period)]:
+            continue
+        if until and period > until[:len(period)]:
+            continue
+        partition_dir = os.path.join(directory, *entry["path"].split("/"))
+        for shard in entry["shards"]:
+            name = shard["csv"] if extension == ".csv" else shard["json"]
+            yield os.path.join(partition_dir, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the shards of the partitions matching a filter.")
+    parser.add_argument("directory", help="partitioned dataset, e.g. txs/transactions_partitions")
+    parser.add_argument("filters", nargs="*", metavar="FIELD=VALUE", help="e.g. service=horizon")
+    parser.add_argument("--since", help="first month or day (YYYY-MM or YYYY-MM-DD)")
+    parser.add_argument("--until", help="last month or day, inclusive")
+    parser.add_argument("--json", action="store_true", help="list the JSON shards instead of the CSV ones")
+    args = parser.parse_args()
+    values = {}
+    for text in args.filters:
+        field, sep, value = text.partition("=")
+        if not sep:
+            parser.error(f"filters are FIELD=VALUE, got {text!r}")
+        values[field] = value
+    try:
+        for path in select(args.directory, args.since, args.until, ".json" if args.json else ".csv", **values):
+            print(path)
+    except (FileNotFoundError, ValueError) as error:
+        parser.error(str(error))
+
+
+if __name__ == "__main__":
+    main()
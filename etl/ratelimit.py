@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket shared by async tasks and threads: refills `rate` tokens per
+    second and holds at most `capacity` tokens, so bursts are capped at
+    `capacity` back-to-back requests. Nothing refills during a Retry-After
+    block; from its end, waiting callers get one token every `1 / rate`
+    seconds instead of all firing at once.
+    """
+
+    def __init__(self, rate, capacity=1):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # During a block _updated is its end, in the future: nothing refills until then
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def _block_until(self, until):
+        """Holds every caller until the monotonic time `until`; call with the lock held."""
+        if until > self._blocked_until:
+            self._blocked_until = until
+            self._updated = until
+            self._tokens = 1
+
+    def reserve(self):
+        """
+        Takes a token, going into debt if none is available, and returns how
+        many seconds the caller has to wait before using it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(0.0, self._updated - now) + delay
+
+    async def acquire(self):
+        """Waits until a token is available and takes it."""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self):
+        """Blocking variant of acquire() for threaded callers."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    """
+    Token bucket whose rate is tuned from the API's responses (AIMD):
+    every successful request adds `increase / rate` to the rate, i.e. about
+    `increase` requests/second per second of traffic, and every throttled
+    request multiplies it by `decrease`. A Retry-After hint additionally
+    blocks all callers until it has passed.
+
+    The rate at the last throttle is remembered as `ceiling`; once the
+    rate is back near it, growth slows down tenfold so the limiter hovers
+    just under the quota instead of oscillating into it.
+
+    The rate grows up to `max_rate`, or up to the initial `rate` if that is
+    higher, so a fast initial rate is only ever lowered by throttling.
+    """
+
+    def __init__(self, rate=1.0, capacity=1, min_rate=0.05, max_rate=20.0,
+                 increase=0.1, decrease=0.5):
+        super().__init__(rate, capacity)
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.ceiling = None
+        self.throttled = 0
+        self._last_decrease = float("-inf")
+
+    def on_success(self):
+        with self._lock:
+            step = self.increase / self.rate
+            if self.ceiling is not None and self.rate >= 0.9 * self.ceiling:
+                step /= 10
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + step)
+
+    def on_throttle(self, retry_after=None):
+        """Records a 429; `retry_after` is the server's hint in seconds, if any."""
+        with self._lock:
+            now = time.monotonic()
+            self.throttled += 1
+            self._refill(now)
+            if retry_after:
+                self._block_until(now + retry_after)
+            if self._updated <= now:
+                # Not blocked: drop the tokens saved up, so the next request waits a full interval
+                self._tokens = min(self._tokens, 0)
+            # Requests that were already in flight get throttled too; only
+            # the first of them should cut the rate.
+            if now - self._last_decrease < max(1.0, 1 / self.rate):
+                return
+            self._last_decrease = now
+            self.ceiling = self.rate
+            self.rate = max(self.min_rate, self.rate * self.decrease)
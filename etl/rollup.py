@@ -0,0 +1,103 @@
+"""
+Materialized rollups of a row stream: the row count and value sum per
+group of dimension values and UTC day. A pipeline folds its new rows in as
+it writes them, so keeping the rollup current costs one dict update per
+row instead of a pass over the whole history. The rollup is saved as a
+small CSV and JSON next to the raw outputs; an incremental run loads the
+CSV back and keeps adding to it.
+"""
+import csv
+import os
+from datetime import date
+
+from etl import jsonio
+from etl.coerce import to_float, to_int
+
+DAY_MS = 86_400_000
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class Rollup:
+    """
+    Count and sum of `value_field` of rows grouped by the UTC day of their
+    `time_field` (milliseconds) and by `dimensions`. Rows are tuples in
+    `fieldnames` order.
+    """
+
+    def __init__(self, fieldnames, dimensions, time_field="timestamp", value_field="value"):
+        self.fieldnames = list(fieldnames)
+        self.dimensions = list(dimensions)
+        self.columns = ["day"] + self.dimensions + ["count", "value"]
+        self._time = self.fieldnames.index(time_field)
+        self._value = self.fieldnames.index(value_field)
+        self._dimensions = [self.fieldnames.index(dimension) for dimension in self.dimensions]
+        self._days = {}
+        # (day, *dimension values) -> [count, value sum]
+        self.groups = {}
+
+    def _day(self, timestamp):
+        timestamp = to_int(timestamp)
+        if timestamp is None:
+            return ""
+        number = timestamp // DAY_MS
+        day = self._days.get(number)
+        if day is None:
+            day = self._days[number] = date.fromordinal(EPOCH_ORDINAL + number).isoformat()
+        return day
+
+    def add_many(self, rows):
+        """Folds rows (tuples in fieldnames order) into their groups."""
+        groups = self.groups
+        positions = self._dimensions
+        for values in rows:
+            key = (self._day(values[self._time]),) + tuple(
+                "" if values[position] is None else str(values[position]) for position in positions)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [0, 0.0]
+            group[0] += 1
+            group[1] += to_float(values[self._value]) or 0.0
+
+    def add_csv(self, csv_filename):
+        """Folds every row of a CSV written with these fieldnames."""
+        with open(csv_filename, newline="", encoding="utf-8") as csv_file:
+            reader = csv.reader(csv_file)
+            header = next(reader, None)
+            if header is None:
+                return
+            order = [header.index(field) for field in self.fieldnames]
+            self.add_many(tuple(record[position] for position in order) for record in reader if record)
+
+    def load(self, csv_filename):
+        """Replaces the groups with a rollup saved by save(); returns False if there is none."""
+        if not os.path.exists(csv_filename):
+            return False
+        groups = {}
+        with open(csv_filename, newline="", encoding="utf-8") as csv_file:
+            reader = csv.reader(csv_file)
+            if next(reader, None) != self.columns:
+                return False
+            for record in reader:
+                groups[tuple(record[:-2])] = [int(record[-2]), float(record[-1])]
+        self.groups = groups
+        return True
+
+    def records(self):
+        """The groups as dicts, in key order."""
+        for key, (count, value) in sorted(self.groups.items()):
+            yield dict(zip(self.columns, key + (count, value)))
+
+    def save(self, csv_filename, json_filename=None):
+        """Writes the rollup as CSV (and as a compact JSON array), replacing the files atomically."""
+        tmp_filename = csv_filename + ".tmp"
+        with open(tmp_filename, "w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(self.columns)
+            for key, (count, value) in sorted(self.groups.items()):
+                writer.writerow(key + (count, repr(value)))
+        os.replace(tmp_filename, csv_filename)
+        if json_filename is not None:
+            tmp_filename = json_filename + ".tmp"
+            with open(tmp_filename, "wb") as json_file:
+                json_file.write(jsonio.dumps(list(self.records())))
+            os.replace(tmp_filename, json_filename)
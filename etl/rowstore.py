@@ -0,0 +1,241 @@
+"""
+Compact in-memory rows for large crawls. A RowBlock holds a batch of rows
+column by column instead of as tuples of separate objects: categorical
+fields as two-byte codes into the block's table of distinct values,
+integers and floats in machine arrays, and hex hashes and addresses as raw
+bytes plus a bitmask of their upper-case digits, so checksummed addresses
+come back exactly. A value that doesn't fit its column's type (None, a
+malformed address, a number sent as a string) is kept as-is on the side,
+so a block always decodes back to the rows that went in.
+
+Every row's content digest (fingerprint.record_digest) and dedupe key
+(dedupe.key_digest of the key fields) are computed as it is added, so a
+block can be deduped and hashed without decoding it. Blocks pickle
+compactly, so transform workers can build them and hand them back.
+"""
+from array import array
+
+from etl.dedupe import DIGEST_SIZE, key_digest
+from etl.fingerprint import record_digest
+from etl.sinks import encode_rows
+
+# Column kinds of a block's schema
+KINDS = ("category", "int", "float", "hex20", "hex32")
+RECORD_DIGEST_SIZE = 32
+
+
+class CategoryColumn:
+    """Strings (or None) as codes into `values`, the column's distinct values in order of appearance."""
+
+    __slots__ = ("codes", "values", "other", "_lookup")
+    OTHER = 0xFFFF
+
+    def __init__(self):
+        self.codes = array("H")
+        self.values = []
+        self.other = {}
+        self._lookup = {}
+
+    def append(self, value):
+        if value is None or type(value) is str:
+            code = self._lookup.get(value)
+            if code is None and len(self.values) < self.OTHER:
+                code = self._lookup[value] = len(self.values)
+                self.values.append(value)
+            if code is not None:
+                self.codes.append(code)
+                return
+        self.other[len(self.codes)] = value
+        self.codes.append(self.OTHER)
+
+    def get(self, index):
+        code = self.codes[index]
+        return self.other[index] if code == self.OTHER else self.values[code]
+
+    def take(self, indexes):
+        values = self.values
+        codes = self.codes
+        if not self.other:
+            return [values[codes[index]] for index in indexes]
+        # Codes of the values kept on the side are OTHER; _restore() fills them in
+        other = self.OTHER
+        taken = [values[code] if (code := codes[index]) != other else None for index in indexes]
+        return _restore(taken, indexes, self.other)
+
+    def nbytes(self):
+        return self.codes.itemsize * len(self.codes)
+
+
+class NumberColumn:
+    """Ints (int64) or floats (double) of exactly that type in an array."""
+
+    __slots__ = ("data", "type", "other")
+
+    def __init__(self, typecode):
+        self.data = array(typecode)
+        self.type = int if typecode == "q" else float
+        self.other = {}
+
+    def append(self, value):
+        if type(value) is self.type:
+            try:
+                self.data.append(value)
+                return
+            except OverflowError:
+                pass
+        self.other[len(self.data)] = value
+        self.data.append(0)
+
+    def get(self, index):
+        return self.other[index] if index in self.other else self.data[index]
+
+    def take(self, indexes):
+        data = self.data
+        taken = [data[index] for index in indexes]
+        return _restore(taken, indexes, self.other) if self.other else taken
+
+    def nbytes(self):
+        return self.data.itemsize * len(self.data)
+
+
+class HexColumn:
+    """
+    "0x"-prefixed hex strings of `width` bytes as raw bytes, with a
+    little-endian bitmask of the digits that were upper case.
+    """
+
+    __slots__ = ("width", "data", "masks", "other", "_mask_size")
+
+    def __init__(self, width):
+        self.width = width
+        self.data = bytearray()
+        self.masks = bytearray()
+        self.other = {}
+        self._mask_size = width // 4
+
+    def append(self, value):
+        if type(value) is str and len(value) == 2 + 2 * self.width and value.startswith("0x"):
+            digits = value[2:]
+            try:
+                raw = bytes.fromhex(digits)
+            except ValueError:
+                raw = b""
+            # fromhex skips whitespace, so the length also rules out anything but hex digits
+            if len(raw) == self.width:
+                lower = digits.lower()
+                mask = 0
+                if digits != lower:
+                    for position, (digit, lower_digit) in enumerate(zip(digits, lower)):
+                        if digit != lower_digit:
+                            mask |= 1 << position
+                self.data += raw
+                self.masks += mask.to_bytes(self._mask_size, "little")
+                return
+        self.other[len(self.data) // self.width] = value
+        self.data += bytes(self.width)
+        self.masks += bytes(self._mask_size)
+
+    def get(self, index):
+        if index in self.other:
+            return self.other[index]
+        digits = self.data[index * self.width:(index + 1) * self.width].hex()
+        mask = int.from_bytes(self.masks[index * self._mask_size:(index + 1) * self._mask_size], "little")
+        if mask:
+            digits = "".join(digit.upper() if mask >> position & 1 else digit
+                             for position, digit in enumerate(digits))
+        return "0x" + digits
+
+    def take(self, indexes):
+        # One hex() call for the whole column; only mixed-case values need get()
+        digits = self.data.hex()
+        step = 2 * self.width
+        taken = ["0x" + digits[index * step:(index + 1) * step] for index in indexes]
+        if any(self.masks):
+            size = self._mask_size
+            masks = self.masks
+            for position, index in enumerate(indexes):
+                if any(masks[index * size:(index + 1) * size]):
+                    taken[position] = self.get(index)
+        return _restore(taken, indexes, self.other) if self.other else taken
+
+    def nbytes(self):
+        return len(self.data) + len(self.masks)
+
+
+def _restore(taken, indexes, other):
+    """Puts the values kept on the side back into a column's taken values."""
+    for position, index in enumerate(indexes):
+        if index in other:
+            taken[position] = other[index]
+    return taken
+
+
+def new_column(kind):
+    if kind == "category":
+        return CategoryColumn()
+    if kind in ("int", "float"):
+        return NumberColumn("q" if kind == "int" else "d")
+    if kind in ("hex20", "hex32"):
+        return HexColumn(int(kind[3:]))
+    raise ValueError(f"Unknown column kind: {kind}")
+
+
+class RowBlock:
+    """
+    Rows of `schema` (field -> kind, in row order) stored by column. Rows
+    are added as tuples of values in field order and read back the same.
+    With `key_fields`, each row's dedupe key is the key_digest() of those
+    fields' values, in that order.
+    """
+
+    __slots__ = ("fieldnames", "columns", "digests", "keys", "_key_positions")
+
+    def __init__(self, schema, key_fields=()):
+        self.fieldnames = list(schema)
+        self.columns = [new_column(kind) for kind in schema.values()]
+        self.digests = bytearray()
+        self.keys = bytearray()
+        self._key_positions = [self.fieldnames.index(field) for field in key_fields]
+
+    @classmethod
+    def from_rows(cls, schema, rows, key_fields=()):
+        block = cls(schema, key_fields)
+        for values in rows:
+            block.append(values)
+        return block
+
+    def append(self, values):
+        for column, value in zip(self.columns, values):
+            column.append(value)
+        self.digests += record_digest(dict(zip(self.fieldnames, values))).to_bytes(RECORD_DIGEST_SIZE, "big")
+        if self._key_positions:
+            self.keys += key_digest(tuple(values[position] for position in self._key_positions))
+
+    def __len__(self):
+        return len(self.digests) // RECORD_DIGEST_SIZE
+
+    def row(self, index):
+        return tuple(column.get(index) for column in self.columns)
+
+    def rows(self, indexes=None):
+        """The rows at `indexes` (default: all) as tuples, decoded a column at a time."""
+        indexes = range(len(self)) if indexes is None else indexes
+        return list(zip(*(column.take(indexes) for column in self.columns)))
+
+    def digest(self, index):
+        """The row's record_digest(), as DatasetHash.add() takes it."""
+        return int.from_bytes(self.digests[index * RECORD_DIGEST_SIZE:(index + 1) * RECORD_DIGEST_SIZE], "big")
+
+    def key(self, index):
+        """The row's dedupe key digest, as DedupeStore.add_digest() takes it."""
+        return bytes(self.keys[index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE])
+
+    def encode(self, indexes=None, json_format="array", indent=None):
+        """The rows at `indexes` (default: all) encoded as sinks.encode_rows() does, for write_encoded()."""
+        indexes = range(len(self)) if indexes is None else indexes
+        return encode_rows(self.fieldnames, self.rows(indexes), json_format, indent,
+                           digests=[self.digest(index) for index in indexes])
+
+    def nbytes(self):
+        """Bytes held by the columns, digests and keys (not counting the values kept on the side)."""
+        return sum(column.nbytes() for column in self.columns) + len(self.digests) + len(self.keys)
@@ -0,0 +1,134 @@
+"""
+Runs the dataset pipelines as concurrent tasks in one event loop. All jobs
+share one pooled keep-alive connection pool, one adaptive rate limiter and
+one response cache, so a full refresh takes about as long as the slowest
+job instead of the sum of all of them.
+
+    python -m etl.runner                 # every job
+    python -m etl.runner fees cycles     # just these
+    python -m etl.runner --enrich        # then join the users into transactions and proposals
+"""
+import argparse
+import asyncio
+import importlib
+import time
+
+import aiohttp
+
+from etl.cache import default_cache
+from etl.client import MessierClient, require_api_key
+from etl.metrics import Metrics
+from etl.ratelimit import AdaptiveRateLimiter
+
+# Job name -> module with an `async def run(client)` entry point
+JOBS = {
+    "fees": "fees.fees",
+    "cycles": "cycles.cyclescsv",
+    "proposals": "proposals.proposalscsv",
+    "virgo": "virgo.virgopaginatedcsv",
+    "txs": "txs.txs",
+}
+RATE_LIMIT = 2.0  # initial requests per second, shared by all jobs
+RATE_BURST = 5
+MAX_CONNECTIONS = 10  # requests in flight at once, across all jobs
+
+
+async def _timed(name, coro):
+    started = time.perf_counter()
+    try:
+        await coro
+        return name, time.perf_counter() - started, None
+    except Exception as e:
+        return name, time.perf_counter() - started, e
+
+
+async def run_jobs(names, rate=RATE_LIMIT, burst=RATE_BURST, max_connections=MAX_CONNECTIONS,
+                   job_options=None, metrics=None):
+    """
+    Runs the named jobs concurrently. `job_options` maps a job name to extra
+    keyword arguments for its run(); all jobs record into `metrics`.
+    Returns [(name, seconds, error)].
+    """
+    api_key = require_api_key()
+    job_options = job_options or {}
+    modules = {name: importlib.import_module(JOBS[name]) for name in names}
+    limiter = AdaptiveRateLimiter(rate, burst)
+    connector = aiohttp.TCPConnector(limit=max_connections, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        client = MessierClient(session, api_key, limiter, cache=default_cache(), metrics=metrics)
+        return await asyncio.gather(*(
+            _timed(name, modules[name].run(client, **job_options.get(name, {}))) for name in names
+        ))
+
+
+def report(results, total):
+    for name, seconds, error in results:
+        status = f"failed: {error!r}" if error else "ok"
+        print(f"{name:<10} {seconds:8.1f}s  {status}")
+    print(f"{'total':<10} {total:8.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the dataset pipelines concurrently.")
+    parser.add_argument("jobs", nargs="*", metavar="JOB",
+                        help=f"jobs to run: {', '.join(JOBS)} (default: all)")
+    parser.add_argument("--rate", type=float, default=RATE_LIMIT,
+                        help=f"initial requests per second shared by all jobs (default {RATE_LIMIT})")
+    parser.add_argument("--burst", type=int, default=RATE_BURST,
+                        help=f"rate limiter burst size (default {RATE_BURST})")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help=f"requests in flight at once across all jobs (default {MAX_CONNECTIONS})")
+    txs_mode = parser.add_mutually_exclusive_group()
+    txs_mode.add_argument("--txs-concurrent", action="store_true",
+                          help="fetch transaction pages concurrently (txs --concurrent)")
+    txs_mode.add_argument("--txs-incremental", action="store_true",
+                          help="only sync new transactions (txs --incremental)")
+    parser.add_argument("--txs-transform-workers", type=int, metavar="N",
+                        help="transform transaction pages in N worker processes, 0 for inline "
+                             "(default: one per core with --txs-concurrent)")
+    parser.add_argument("--txs-partitioned", action="store_true",
+                        help="also write transactions partitioned by service and month (txs --partitioned)")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue interrupted txs and virgo crawls from their last checkpoint")
+    parser.add_argument("--enrich", action="store_true",
+                        help="afterwards, annotate transactions and proposals with the virgo users (etl.enrich)")
+    parser.add_argument("--metrics-jsonl", metavar="PATH",
+                        help="append the run's metrics as JSON lines (default: $METRICS_JSONL)")
+    parser.add_argument("--metrics-prom", metavar="PATH",
+                        help="write the run's metrics as a Prometheus text file (default: $METRICS_PROM)")
+    args = parser.parse_args()
+
+    names = args.jobs or list(JOBS)
+    unknown = [name for name in names if name not in JOBS]
+    if unknown:
+        parser.error(f"unknown job(s): {', '.join(unknown)}")
+    if args.resume and args.txs_incremental:
+        parser.error("--resume can't be combined with --txs-incremental")
+    job_options = {
+        "txs": {
+            "concurrent": args.txs_concurrent,
+            "incremental": args.txs_incremental,
+            "max_in_flight": args.max_connections,
+            "resume": args.resume,
+            "transform_workers": args.txs_transform_workers,
+            "partitioned": args.txs_partitioned,
+        },
+        "virgo": {"resume": args.resume},
+    }
+    metrics = Metrics()
+    started = time.perf_counter()
+    results = asyncio.run(run_jobs(names, args.rate, args.burst, args.max_connections, job_options, metrics))
+    report(results, time.perf_counter() - started)
+    if args.enrich:
+        from etl.enrich import enrich
+
+        with metrics.timer("enrich"):
+            enrich()
+    metrics.summary()
+    metrics.export(args.metrics_jsonl, args.metrics_prom)
+    if any(error for _, _, error in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
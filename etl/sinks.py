@@ -0,0 +1,357 @@
+import csv
+import io
+import json
+import os
+
+from etl import jsonio
+from etl.fingerprint import DatasetHash, record_digest
+
+JSON_FORMATS = ("array", "ndjson")
+
+
+class JsonWriter:
+    """
+    Writes rows to an open binary file as a JSON array or as NDJSON. Array
+    rows are written one compact row per line, or indented by `indent`
+    spaces. With append=True an existing array file is extended.
+    To continue an array the file is already positioned in, pass `first`:
+    whether no row has been written to it yet.
+    """
+
+    def __init__(self, file, json_format="array", indent=None, append=False, first=None):
+        if json_format not in JSON_FORMATS:
+            raise ValueError(f"Unknown JSON format: {json_format}")
+        self.file = file
+        self.json_format = json_format
+        self.indent = indent
+        self._first = False
+        if json_format == "array":
+            if first is not None:
+                self._first = first
+            elif append:
+                self._first = _reopen_json_array(file, getattr(file, "name", "JSON file"))
+            else:
+                file.write(b"[")
+                self._first = True
+
+    def _frame(self, encoded):
+        if self.json_format == "ndjson":
+            return encoded + b"\n"
+        prefix = b"\n" if self._first else b",\n"
+        self._first = False
+        return prefix + encoded
+
+    def write(self, row):
+        self.file.write(self._frame(encode_json_row(row, self.json_format, self.indent)))
+
+    def write_many(self, rows):
+        """Encodes a batch of rows and writes it in one call."""
+        self.file.write(b"".join(self._frame(encode_json_row(row, self.json_format, self.indent))
+                                 for row in rows))
+
+    def write_encoded(self, encoded_rows):
+        """Writes rows already encoded by encode_json_row() with this writer's format and indent."""
+        self.file.write(b"".join(self._frame(encoded) for encoded in encoded_rows))
+
+    @property
+    def first(self):
+        """True while no row has been written to the array."""
+        return self._first
+
+    def close(self):
+        """Terminates the array; the file itself is left open."""
+        if self.json_format == "array":
+            self.file.write(b"]" if self._first else b"\n]")
+
+
+def encode_json_row(row, json_format="array", indent=None):
+    """A row as JsonWriter writes it, without the separator before it."""
+    if json_format == "ndjson" or indent is None:
+        return jsonio.dumps(row)
+    margin = b" " * indent
+    return b"\n".join(margin + line for line in jsonio.dumps(row, indent).splitlines())
+
+
+def encode_rows(fieldnames, rows, json_format="array", indent=None, with_json=True, digests=None):
+    """
+    Encodes tuples of `fieldnames` values for StreamingSink.write_encoded(),
+    so the work can be done ahead of time, e.g. in a worker process. Returns
+    one (values, CSV line, JSON bytes or None, record_digest) tuple per row.
+    Pass the rows' `digests` if they are already known.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    encoded = []
+    for position, values in enumerate(rows):
+        row = dict(zip(fieldnames, values))
+        writer.writerow(values)
+        csv_line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        json_row = encode_json_row(row, json_format, indent) if with_json else None
+        encoded.append((values, csv_line, json_row, record_digest(row) if digests is None else digests[position]))
+    return encoded
+
+
+class StreamingSink:
+    """
+    Writes rows to a CSV file and to a JSON array (or NDJSON) as they arrive,
+    so memory stays bounded by a single row. Keeps the record count and the
+    output sizes, so nothing has to be re-read afterwards. With
+    json_filename=None only the CSV is written.
+
+    A fresh sink writes to temporary files that replace the outputs on
+    close(); discard() drops them instead. With append=True rows are added
+    to the existing outputs in place.
+
+    The rows' content hash is kept as they are written. Given a StageState,
+    close() leaves the outputs untouched when the content matches the last
+    completed write (and sets `skipped`); an appending sink extends the
+    stored hash with the new rows.
+
+    checkpoint() returns the output offsets reached so far. After a crash
+    (or suspend()), a sink created with resume=<that state> cuts the
+    partial outputs back to those offsets and carries on writing.
+    """
+
+    def __init__(self, csv_filename, json_filename, fieldnames, json_format="array",
+                 indent=None, append=False, stages=None, resume=None):
+        if json_format not in JSON_FORMATS:
+            raise ValueError(f"Unknown JSON format: {json_format}")
+        self.csv_filename = csv_filename
+        self.json_filename = json_filename
+        self.fieldnames = fieldnames
+        self.json_format = json_format
+        self.indent = indent
+        self.append = append
+        self.stages = stages
+        self.skipped = False
+        if resume is not None:
+            self.content = DatasetHash(resume["content"], resume["records"])
+        elif append and stages is not None:
+            self.content = DatasetHash(stages.content, stages.records)
+        else:
+            self.content = DatasetHash()
+        self.rows = resume["rows"] if resume is not None else 0
+        self.csv_bytes = 0
+        self.json_bytes = 0
+        self._closed = False
+
+        self._csv_target = csv_filename if append else csv_filename + ".tmp"
+        if resume is not None:
+            os.truncate(self._csv_target, resume["csv_bytes"])
+            self._csv_file = open(self._csv_target, "a", newline="", encoding="utf-8")
+        else:
+            self._csv_file = open(self._csv_target, "a" if append else "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._csv_file, fieldnames=fieldnames, extrasaction="ignore")
+        if not append and resume is None:
+            self._writer.writeheader()
+
+        self._json_target = None
+        self._json_file = None
+        self._json = None
+        if json_filename is None:
+            return
+        self._json_target = json_filename if append else json_filename + ".tmp"
+        if resume is not None:
+            os.truncate(self._json_target, resume["json_bytes"])
+            self._json_file = open(self._json_target, "ab")
+            self._json = JsonWriter(self._json_file, json_format, indent, first=resume["json_first"])
+            return
+        if json_format == "array" and append:
+            self._json_file = open(self._json_target, "rb+")
+        else:
+            self._json_file = open(self._json_target, "ab" if append else "wb")
+        self._json = JsonWriter(self._json_file, json_format, indent, append)
+
+    @property
+    def csv_path(self):
+        """The CSV being written: the temporary file until close(), unless appending."""
+        return self._csv_target
+
+    @staticmethod
+    def can_resume(csv_filename, json_filename, state, append=False):
+        """True if the partial outputs a checkpoint `state` refers to are still there."""
+        targets = [(csv_filename, state.get("csv_bytes"))]
+        if json_filename is not None:
+            targets.append((json_filename, state.get("json_bytes")))
+        for filename, offset in targets:
+            target = filename if append else filename + ".tmp"
+            if offset is None or not os.path.exists(target) or os.path.getsize(target) < offset:
+                return False
+        return True
+
+    def write(self, row):
+        self._writer.writerow(row)
+        if self._json is not None:
+            self._json.write(row)
+        self.content.update(row)
+        self.rows += 1
+
+    def write_many(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def write_encoded(self, encoded_rows):
+        """Writes rows prepared by encode_rows() with this sink's fieldnames and JSON layout."""
+        if not encoded_rows:
+            return
+        self._csv_file.write("".join(csv_line for _, csv_line, _, _ in encoded_rows))
+        if self._json is not None:
+            self._json.write_encoded([json_row for _, _, json_row, _ in encoded_rows])
+        for _, _, _, digest in encoded_rows:
+            self.content.add(digest)
+        self.rows += len(encoded_rows)
+
+    def write_values(self, rows, digests):
+        """
+        Writes tuples of fieldnames values whose record_digest()s are already
+        known, e.g. the rows of a RowBlock, without encoding each one ahead.
+        """
+        if not rows:
+            return
+        self._writer.writer.writerows(rows)
+        if self._json is not None:
+            fieldnames = self.fieldnames
+            self._json.write_many([dict(zip(fieldnames, values)) for values in rows])
+        for digest in digests:
+            self.content.add(digest)
+        self.rows += len(rows)
+
+    def checkpoint(self):
+        """Flushes the outputs and returns the state resume= needs to continue after them."""
+        self._csv_file.flush()
+        state = {
+            "rows": self.rows,
+            "content": self.content.hexdigest(),
+            "records": self.content.records,
+            "csv_bytes": os.fstat(self._csv_file.fileno()).st_size,
+        }
+        if self._json is not None:
+            self._json_file.flush()
+            state["json_bytes"] = self._json_file.tell()
+            state["json_first"] = self._json.first
+        return state
+
+    def _outputs(self):
+        targets = [(self._csv_target, self.csv_filename)]
+        if self._json is not None:
+            targets.append((self._json_target, self.json_filename))
+        return targets
+
+    def close(self):
+        """Finishes the files and moves them into place."""
+        if self._closed:
+            return
+        self._closed = True
+        self._csv_file.flush()
+        self.csv_bytes = os.fstat(self._csv_file.fileno()).st_size
+        self._csv_file.close()
+        if self._json is not None:
+            self._json.close()
+            self.json_bytes = self._json_file.tell()
+            self._json_file.close()
+        if self.stages is not None:
+            self.stages.set_content(self.content)
+        # The JSON layout is part of what the write stage produced
+        layout = [self.json_format, self.indent] if self._json is not None else None
+        if not self.append:
+            outputs = [filename for _, filename in self._outputs()]
+            if self.stages is not None and self.stages.info("write").get("layout") == layout \
+                    and not self.stages.pending("write", *outputs):
+                # Same records as the current outputs: keep them as they are
+                self.skipped = True
+                for target, _ in self._outputs():
+                    os.remove(target)
+                return
+            for target, filename in self._outputs():
+                os.replace(target, filename)
+        if self.stages is not None:
+            self.stages.done("write", layout=layout)
+
+    def suspend(self):
+        """Closes the files as they are, so a later sink can resume from a checkpoint."""
+        if self._closed:
+            return
+        self._closed = True
+        self._csv_file.close()
+        if self._json_file is not None:
+            self._json_file.close()
+
+    def discard(self):
+        """Closes the sink without replacing the outputs (appended rows stay)."""
+        if self.append:
+            self.close()
+            return
+        if self._closed:
+            return
+        self.suspend()
+        for target, _ in self._outputs():
+            os.remove(target)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def _reopen_json_array(json_file, json_filename):
+    """
+    Positions an existing JSON array file for appending: truncates it just
+    after its last element. Returns True if the array is empty.
+    """
+    position = json_file.seek(0, os.SEEK_END)
+    closing = None
+    char = b""
+    while position > 0:
+        position -= 1
+        json_file.seek(position)
+        char = json_file.read(1)
+        if char.isspace():
+            continue
+        if closing is None and char == b"]":
+            closing = position
+            continue
+        break
+    if closing is None:
+        raise ValueError(f"{json_filename} does not contain a JSON array")
+    json_file.seek(position + 1)
+    json_file.truncate()
+    return char == b"["
+
+
+def iter_json_records(json_filename, block_size=1 << 16):
+    """
+    Yields the records (objects) of a JSON array or NDJSON file one at a
+    time, reading it in blocks instead of loading the whole file.
+    """
+    decoder = json.JSONDecoder()
+    with open(json_filename, "r", encoding="utf-8") as json_file:
+        buffer = ""
+        position = 0
+        eof = False
+        while True:
+            # Skip the separators between records, refilling as needed
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,[]":
+                    position += 1
+                if position < len(buffer) or eof:
+                    break
+                block = json_file.read(block_size)
+                buffer, position, eof = buffer[position:] + block, 0, not block
+            if position >= len(buffer):
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                block = json_file.read(block_size)
+                buffer, position, eof = buffer[position:] + block, 0, not block
+                continue
+            yield record
+            position = end
@@ -0,0 +1,55 @@
+"""
+Transform stage in worker processes. A pipeline hands the payloads it
+fetched to a TransformPool and awaits the transformed batches, so the
+CPU-bound flattening and hashing runs on other cores while the event loop
+keeps fetching. The pipeline still writes (and dedupes) the batches itself,
+in page order, so the outputs don't depend on which worker finished first.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def default_workers():
+    """One worker per core but one, left to the event loop; 0 (inline) on a single core."""
+    return max((os.cpu_count() or 1) - 1, 0)
+
+
+class TransformPool:
+    """
+    Runs transforms in `workers` processes; with workers=0 they run inline
+    in the calling thread. At most `max_pending` payloads are queued or
+    being transformed at once: run() waits for a free slot, so payloads
+    don't pile up in the pool faster than the workers get through them.
+
+    Transform functions must be module-level so they can be pickled. The
+    workers are spawned rather than forked, as the parent has an event loop
+    and the connection pool's threads running.
+    """
+
+    def __init__(self, workers=0, max_pending=None):
+        self.workers = workers
+        self.max_pending = max_pending or 2 * max(workers, 1)
+        self._executor = None
+        if workers:
+            self._executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        self._slots = asyncio.Semaphore(self.max_pending)
+
+    async def run(self, func, *args):
+        """Returns func(*args), computed in a worker process."""
+        if self._executor is None:
+            return func(*args)
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,180 @@
+"""
+Loader stage: uploads datasets to jsonBlob.
+
+Small datasets go up as a single blob. Larger ones are split into
+size-bounded chunk blobs plus a manifest blob listing them. Every body is
+sent gzip-encoded and retried on its own. Chunk hashes and URLs are kept
+in a state file next to the dataset, so chunks whose content hasn't
+changed since the last upload are skipped. An interrupted upload picks up
+where it stopped, and the manifest (or single blob) is updated in place so
+its URL stays the same, also when the dataset grows past one chunk or
+shrinks back to one.
+
+Set JSONBLOB_API_URL to point the uploads at a local stand-in server.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+
+import aiohttp
+
+from etl import jsonio
+from etl.sinks import iter_json_records
+
+JSONBLOB_API_URL = "https://jsonblob.com/api/jsonBlob"
+CHUNK_BYTES = 4 * 1024 * 1024  # uncompressed JSON per chunk blob
+MAX_RETRIES = 5
+RETRY_DELAY = 2  # seconds, doubled after every failed attempt
+
+
+def api_url():
+    return os.getenv("JSONBLOB_API_URL", JSONBLOB_API_URL)
+
+
+async def upload_json_data(session, data, url=None):
+    """
+    Uploads an in-memory JSON document to jsonBlob, updating the blob at
+    `url` in place when given. Returns the blob URL or None.
+    """
+    body = jsonio.dumps(data)
+    url = await send_blob(session, body, url)
+    if url:
+        print(f"JSON Blob uploaded: {url}")
+    return url
+
+
+def iter_chunks(json_filename, chunk_bytes=CHUNK_BYTES):
+    """Yields (body, records) pairs: compact JSON arrays of at most ~chunk_bytes each."""
+    parts = []
+    size = 0
+    for record in iter_json_records(json_filename):
+        encoded = jsonio.dumps(record)
+        if parts and size + len(encoded) > chunk_bytes:
+            yield b"[" + b",".join(parts) + b"]", len(parts)
+            parts, size = [], 0
+        parts.append(encoded)
+        size += len(encoded) + 1
+    yield b"[" + b",".join(parts) + b"]", len(parts)
+
+
+async def send_blob(session, body, url=None, max_retries=MAX_RETRIES):
+    """
+    Sends one gzip-encoded JSON body: PUT to `url` to update an existing
+    blob, else (or if that blob is gone) POST a new one. Retries with
+    exponential backoff. Returns the blob URL, or None if it could not be
+    stored.
+    """
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    compressed = gzip.compress(body)
+    delay = RETRY_DELAY
+    for attempt in range(max_retries + 1):
+        try:
+            if url:
+                async with session.put(url, data=compressed, headers=headers) as response:
+                    if response.status in [200, 201]:
+                        return url
+                    if response.status == 404:
+                        # The blob expired; create a new one in the same attempt
+                        print(f"JSON Blob {url} no longer exists, creating a new one.")
+                        url = None
+                    else:
+                        print(f"Failed to update JSON Blob {url}: {response.status}")
+            if not url:
+                async with session.post(api_url(), data=compressed, headers=headers) as response:
+                    if response.status in [200, 201]:
+                        return response.headers.get("Location")
+                    print(f"Failed to create JSON Blob: {response.status}")
+        except aiohttp.ClientError as e:
+            print(f"Error uploading data to JSONBlob: {e}")
+        if attempt < max_retries:
+            await asyncio.sleep(delay)
+            delay *= 2
+    return None
+
+
+def _load_state(state_filename):
+    if not os.path.exists(state_filename):
+        return {}
+    with open(state_filename, "r") as state_file:
+        return json.load(state_file)
+
+
+def _save_state(state_filename, state):
+    tmp_filename = state_filename + ".tmp"
+    with open(tmp_filename, "w") as state_file:
+        json.dump(state, state_file, indent=4)
+    os.replace(tmp_filename, state_filename)
+
+
+async def upload_dataset(session, json_filename, chunk_bytes=CHUNK_BYTES, max_retries=MAX_RETRIES):
+    """
+    Uploads the records of a JSON array or NDJSON file. Returns the URL of
+    the blob (single chunk) or of the manifest, or None if a chunk could
+    not be uploaded; rerunning then resumes with the missing chunks.
+    """
+    state_filename = json_filename + ".upload.json"
+    state = _load_state(state_filename)
+    # The published URL: the single blob or the manifest, whichever the last upload wrote
+    published = state.get("url") or state.get("manifest_url")
+    # sha256 -> URL of every chunk uploaded before, whatever its position
+    uploaded = {chunk["sha256"]: chunk["url"] for chunk in state.get("chunks", [])}
+
+    chunks = []
+    single = None
+    for index, (body, records) in enumerate(iter_chunks(json_filename, chunk_bytes)):
+        if index == 0:
+            # Hold the first chunk back until we know whether there is a second
+            single = (body, records)
+            continue
+        if single is not None:
+            chunks.append(await _upload_chunk(session, *single, uploaded, max_retries))
+            single = None
+        chunks.append(await _upload_chunk(session, body, records, uploaded, max_retries))
+        # Record progress after every chunk so an interrupted upload can resume
+        state["chunks"] = [{"url": url, "sha256": digest} for digest, url in uploaded.items()]
+        _save_state(state_filename, state)
+
+    if single is not None:
+        # Everything fits in one blob: store the records themselves
+        body, records = single
+        digest = hashlib.sha256(body).hexdigest()
+        if state.get("url") and state.get("sha256") == digest:
+            print(f"JSON Blob unchanged, skipping upload: {state['url']}")
+            return state["url"]
+        url = await send_blob(session, body, published, max_retries)
+        if url is None:
+            return None
+        _save_state(state_filename, {"url": url, "sha256": digest, "records": records})
+        print(f"JSON Blob uploaded: {url} ({records} records)")
+        return url
+
+    if any(chunk["url"] is None for chunk in chunks):
+        print(f"{sum(chunk['url'] is None for chunk in chunks)} chunks failed to upload; rerun to resume.")
+        return None
+    skipped = sum(chunk.pop("skipped") for chunk in chunks)
+    manifest = {
+        "dataset": os.path.basename(json_filename),
+        "records": sum(chunk["records"] for chunk in chunks),
+        "chunks": chunks,
+    }
+    manifest_body = jsonio.dumps(manifest)
+    manifest_url = await send_blob(session, manifest_body, published, max_retries)
+    if manifest_url is None:
+        return None
+    state = {"manifest_url": manifest_url, "chunks": manifest["chunks"]}
+    _save_state(state_filename, state)
+    print(f"JSON Blob manifest uploaded: {manifest_url} ({len(chunks)} chunks, {skipped} unchanged, "
+          f"{manifest['records']} records)")
+    return manifest_url
+
+
+async def _upload_chunk(session, body, records, uploaded, max_retries):
+    digest = hashlib.sha256(body).hexdigest()
+    if digest in uploaded:
+        return {"url": uploaded[digest], "records": records, "sha256": digest, "skipped": True}
+    url = await send_blob(session, body, max_retries=max_retries)
+    if url:
+        uploaded[digest] = url
+    return {"url": url, "records": records, "sha256": digest, "skipped": False}
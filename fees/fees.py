@@ -1,61 +1,80 @@
-import requests
-import pandas as pd
-import json
-from dotenv import load_dotenv
+import aiohttp
+import asyncio
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl.cache import default_cache
+from etl.client import MessierClient, messier_url, require_api_key
+from etl.fingerprint import StageState, stages_path
+from etl.index import refresh_index
+from etl.sinks import StreamingSink
+from etl.upload import upload_dataset
 
 # API Details
-API_URL = "https://api.messier.app/api/v1/platform/fee"
-API_KEY = os.getenv("API_KEY")
+API_URL = messier_url("platform/fee")
 SERVICES = ["horizon", "adastra", "openhatch", "p2p", "virgo"]
-HEADERS = {"accept": "application/json", "X-API-KEY": API_KEY}
+
+# Outputs live next to this script
+OUTPUT_DIR = os.path.dirname(os.path.abspath(__file__))
+CSV_FILENAME = os.path.join(OUTPUT_DIR, "fees_data.csv")
+JSON_FILENAME = os.path.join(OUTPUT_DIR, "fees_data.json")
+COLUMNS = ["network", "app", "contract_address", "token_symbol", "value"]
 
 # Fetch data from API
-def fetch_data(service):
-    response = requests.get(f"{API_URL}?service={service}", headers=HEADERS)
-    if response.status_code == 200:
-        return response.json().get("data", {}).get("items", [])
-    else:
-        print(f"Error fetching data for {service}: {response.status_code}")
+async def fetch_data(client, service):
+    json_response = await client.get_json(API_URL, params={"service": service})
+    if json_response is None:
+        print(f"Error fetching data for {service}")
         return []
+    return json_response.get("data", {}).get("items", [])
+
+async def run(client):
+    """
+    Fetches the fees of every service, writes the CSV/JSON outputs and
+    uploads the JSON. Both stages are skipped when the fees haven't changed.
+    """
+    metrics = client.metrics
+    with metrics.timer("extract", pipeline="fees"):
+        responses = await asyncio.gather(*(fetch_data(client, service) for service in SERVICES))
+    stages = StageState(stages_path(JSON_FILENAME))
+
+    # Process all services, streaming rows to CSV and JSON
+    with metrics.timer("write", pipeline="fees"):
+        with StreamingSink(CSV_FILENAME, JSON_FILENAME, COLUMNS, stages=stages) as sink:
+            for service, data in zip(SERVICES, responses):
+                for item in data:
+                    sink.write({
+                        "network": item.get("network"),
+                        "app": service,
+                        "contract_address": item.get("contract", "null"),
+                        "token_symbol": item.get("symbol"),
+                        "value": item.get("value")
+                    })
+                metrics.inc("rows", len(data), pipeline="fees", service=service)
+    with metrics.timer("index", pipeline="fees"):
+        refresh_index("fees", CSV_FILENAME)
+
+    # Upload to jsonBlob
+    if stages.pending("upload"):
+        with metrics.timer("upload", pipeline="fees"):
+            uploaded = await upload_dataset(client.session, JSON_FILENAME)
+        if uploaded:
+            stages.done("upload")
+        else:
+            stages.failed("upload")
+
+    # Print number of records
+    print(f"CSV file records: {sink.rows} ({sink.csv_bytes} bytes)")
+    print(f"JSON file records: {sink.rows} ({sink.json_bytes} bytes)")
+    stages.report()
+
+async def main():
+    api_key = require_api_key()
+    async with aiohttp.ClientSession() as session:
+        client = MessierClient(session, api_key, cache=default_cache())
+        await run(client)
+    client.metrics.export()
 
-# Process all services
-data_list = []
-for service in SERVICES:
-    data = fetch_data(service)
-    for item in data:
-        data_list.append({
-            "network": item.get("network"),
-            "app": service,
-            "contract_address": item.get("contract", "null"),
-            "token_symbol": item.get("symbol"),
-            "value": item.get("value")
-        })
-
-# Convert to DataFrame
-df = pd.DataFrame(data_list)
-
-# Save to CSV
-csv_filename = "fees_data.csv"
-df.to_csv(csv_filename, index=False)
-
-# Save to JSON
-json_filename = "fees_data.json"
-df.to_json(json_filename, orient="records", indent=4)
-
-# Upload to jsonBlob
-json_blob_url = "https://jsonblob.com/api/jsonBlob"
-with open(json_filename, "r") as json_file:
-    json_data = json.load(json_file)
-response = requests.post(json_blob_url, json=json_data, headers={"Content-Type": "application/json"})
-
-# Check JSONBlob response
-if response.status_code in [200, 201]:
-    json_blob_link = response.headers.get("Location", "No URL returned")
-    print(f"JSON Blob created successfully: {json_blob_link}")
-else:
-    print(f"Failed to create JSON Blob: {response.status_code}")
-
-# Print number of records
-print(f"CSV file records: {len(df)}")
-print(f"JSON file records: {len(json_data)}")
+if __name__ == "__main__":
+    asyncio.run(main())
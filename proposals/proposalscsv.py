@@ -1,56 +1,120 @@
+import aiohttp
+import argparse
+import asyncio
 import csv
+import math
 import os
-import time
-from dotenv import load_dotenv
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-# Load environment variables from .env file
-load_dotenv()
-
-API_KEY = os.getenv('API_KEY')
-
-if not API_KEY:
-    raise ValueError("API_KEY not found. Please set it in the .env file.")
-
-BASE_URL = 'https://api.messier.app/api/v1/virgo/proposal-list'
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl.cache import default_cache
+from etl.client import MessierClient, messier_url, require_api_key
+from etl.dedupe import DedupeStore
+from etl.fingerprint import DatasetHash, HashingWriter, StageState, stages_path
+from etl.index import refresh_index
+from etl.metrics import sizeof_fmt
+from etl.paginate import prefetch_pages
+from etl.ratelimit import AdaptiveRateLimiter
+
+BASE_URL = messier_url('virgo/proposal-list')
 LIMIT = 100  # Number of proposals per page
+RATE_LIMIT = 1.0  # Initial requests per second
+PREFETCH_WINDOW = 5  # Pages kept in flight ahead of the one being written
 
-# Set up headers with the API key
-headers = {
-    'accept': 'application/json',
-    'X-API-KEY': API_KEY
-}
-
-# Set to store unique proposal identifiers
-unique_proposals = set()
-
+# Outputs live next to this script
+OUTPUT_DIR = os.path.dirname(os.path.abspath(__file__))
 # Define the CSV filename
-csv_filename = "proposals_data.csv"
-
-def fetch_proposals(page):
-    url = f"{BASE_URL}?page={page}&limit={LIMIT}"
-    response = requests.get(url, headers=headers)
-
-    if response.status_code == 429:  # Too many requests
-        retry_after = int(response.headers.get("Retry-After", 30))
-        print(f"Rate limit exceeded. Retrying after {retry_after} seconds.")
-        time.sleep(retry_after)
-        return fetch_proposals(page)
-
-    if response.status_code != 200:
-        print(f'Error fetching data from API. Status code: {response.status_code}')
-        print(f'Response content: {response.text}')
+csv_filename = os.path.join(OUTPUT_DIR, "proposals_data.csv")
+# Stage state is shared with proposalscsvtojson.py and the upload, which work on the JSON
+STAGES_FILENAME = stages_path(os.path.join(OUTPUT_DIR, "proposals_data.json"))
+# Persistent store of unique proposal identifiers; reset each run since the CSV is rewritten
+DEDUPE_FILENAME = os.path.join(OUTPUT_DIR, "proposals_dedupe.sqlite")
+# --normalized outputs: proposals, signer/approver edges keyed by proposal id, and users
+PROPOSALS_TABLE = os.path.join(OUTPUT_DIR, "proposals_table.csv")
+SIGNERS_TABLE = os.path.join(OUTPUT_DIR, "proposal_signers.csv")
+APPROVES_TABLE = os.path.join(OUTPUT_DIR, "proposal_approves.csv")
+USERS_TABLE = os.path.join(OUTPUT_DIR, "proposal_users.csv")
+
+async def fetch_proposals(client, page):
+    return await client.get_json(BASE_URL, params={'page': page, 'limit': LIMIT})
+
+def last_page_of(page, json_response):
+    """
+    Returns the last page number if this response reveals it: from the
+    API's 'total', or from an empty or short page.
+    """
+    if json_response is None:
         return None
-
+    data = json_response.get('data', {})
+    proposals = data.get('proposals', [])
+    if not proposals:
+        return page - 1
+    if len(proposals) < LIMIT:
+        return page
     try:
-        return response.json()
-    except ValueError:
-        print('Failed to parse JSON response')
-        print(f'Response content: {response.text}')
+        return max(page, math.ceil(int(data['total']) / LIMIT))
+    except (KeyError, TypeError, ValueError):
         return None
 
-def write_proposals_to_csv(writer, proposals):
+class NormalizedTables:
+    """
+    Writes proposals as a proposals table plus proposal_signers and
+    proposal_approves edge tables keyed by proposal id, instead of repr'd
+    lists of {'address', 'username'} dicts. Usernames go once into an
+    address -> username users table. Addresses are lowercased, so they join
+    regardless of checksum casing.
+    """
+
+    def __init__(self):
+        self._files = []
+        self.proposals = self._open(PROPOSALS_TABLE, [
+            "proposal_id", "status", "state", "title", "type", "voteType", "creator_address",
+            "currency_symbol", "currency_address", "neededSign", "cycle", "num_signers", "num_approves"
+        ])
+        self.signers = self._open(SIGNERS_TABLE, ["proposal_id", "address"])
+        self.approves = self._open(APPROVES_TABLE, ["proposal_id", "address"])
+        self.usernames = {}
+        self.next_id = 1
+
+    def _open(self, filename, header):
+        file = open(filename, mode="w", newline="", encoding="utf-8")
+        self._files.append(file)
+        writer = csv.writer(file)
+        writer.writerow(header)
+        return writer
+
+    def _user(self, user):
+        address = (user.get("address") or "").lower()
+        if address and address not in self.usernames:
+            self.usernames[address] = user.get("username", "")
+        return address
+
+    def write(self, proposal, status, state, title, proposal_type, vote_type, creator,
+              currency_symbol, currency_address, signers, needed_sign, cycle, approves):
+        # Prefer the API's own id; fall back to the order proposals were written in
+        proposal_id = proposal.get("id", proposal.get("_id"))
+        if proposal_id is None:
+            proposal_id = self.next_id
+            self.next_id += 1
+        self.proposals.writerow([
+            proposal_id, status, state, title, proposal_type, vote_type, self._user(creator),
+            currency_symbol, currency_address, needed_sign, cycle, len(signers), len(approves)
+        ])
+        for signer in signers:
+            self.signers.writerow([proposal_id, self._user(signer)])
+        for approve in approves:
+            self.approves.writerow([proposal_id, self._user(approve)])
+
+    def close(self):
+        for file in self._files:
+            file.close()
+        with open(USERS_TABLE, mode="w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["address", "username"])
+            writer.writerows(sorted(self.usernames.items()))
+
+def write_proposals_to_csv(writer, proposals, unique_proposals, tables=None):
+    """Writes proposals as flat CSV rows, or to the normalized `tables` when given."""
     for proposal in proposals:
         status = proposal.get("status", "")
         state = proposal.get("state", "")
@@ -61,13 +125,10 @@ def write_proposals_to_csv(writer, proposals):
         # Create a unique identifier for the proposal
         unique_id = (status, state, title, num_approves)
 
-        # Skip duplicate proposals
-        if unique_id in unique_proposals:
+        # Skip duplicate proposals, recording new ones in the store
+        if not unique_proposals.add(unique_id):
             continue
 
-        # Add to the set of unique proposals
-        unique_proposals.add(unique_id)
-
         # Extract remaining fields
         proposal_type = proposal.get("type", "")
         vote_type = proposal.get("voteType", "")
@@ -89,6 +150,11 @@ def write_proposals_to_csv(writer, proposals):
 
         needed_sign = proposal.get("neededSign", 0)
 
+        if tables is not None:
+            tables.write(proposal, status, state, title, proposal_type, vote_type, creator,
+                         currency_symbol, currency_address, signers, needed_sign, cycle, approves)
+            continue
+
         # Approves information as string
         approves_str = str(approves)
 
@@ -99,59 +165,109 @@ def write_proposals_to_csv(writer, proposals):
             needed_sign, cycle, approves_str
         ])
 
-def sizeof_fmt(num, suffix='B'):
-    for unit in ['','K','M','G','T','P','E','Z']:
-        if abs(num) < 1024.0:
-            return f"{num:3.1f} {unit}{suffix}"
-        num /= 1024.0
-    return f"{num:.1f} Y{suffix}"
-
-# Open a CSV file to write
-try:
-    with open(csv_filename, mode="w", newline="", encoding="utf-8") as file:
-        writer = csv.writer(file)
-
-        # Write CSV header
-        writer.writerow([
-            "status", "state", "title", "type", "voteType", "creator_address",
-            "creator_username", "currency_symbol", "currency_address", "signers",
-            "neededSign", "cycle", "approves"
-        ])
+async def crawl(client, writer, unique_proposals, tables=None):
+    """Fetches the proposal pages and writes each one in page order as it arrives."""
+    # Fetch pages ahead of the one being written until the last page is known;
+    # they are handed over, and written, in page order
+    total_known = False
+
+    def end_of(page, json_response):
+        nonlocal total_known
+        if json_response is None:
+            if total_known:
+                return None
+            print(f'Error fetching page {page}; stopping here.')
+            return page - 1
+        total_known = total_known or 'total' in json_response.get('data', {})
+        return last_page_of(page, json_response)
+
+    pages = prefetch_pages(lambda page: fetch_proposals(client, page), end_of, PREFETCH_WINDOW)
+    async for page, json_response in pages:
+        if json_response is None:
+            print(f'Error fetching page {page}, skipping it.')
+            continue
+        proposals = json_response.get('data', {}).get('proposals', [])
+        with client.metrics.timer('transform', pipeline='proposals'):
+            write_proposals_to_csv(writer, proposals, unique_proposals, tables)
+        print(f'Page {page}: {len(proposals)} records fetched')
+
+async def run(client, normalized=False):
+    """
+    Fetches the proposal pages with `client` and writes the proposals CSV,
+    or with `normalized` the proposals/signers/approves/users tables.
+    """
+    metrics = client.metrics
+    unique_proposals = DedupeStore(DEDUPE_FILENAME, reset=True)
 
-        # Fetch data from paginated API using threading
-        max_workers = 5  # Number of threads to use
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(fetch_proposals, page): page for page in range(1, 11)}  # Adjust range as needed
-
-            results = []
-            for future in as_completed(futures):
-                page = futures[future]
-                try:
-                    json_response = future.result()
-                    if json_response:
-                        results.append((page, json_response))
-                except Exception as e:
-                    print(f'Error fetching page {page}: {e}')
-
-            # Sort results by page number
-            results.sort(key=lambda x: x[0])
-
-            for page, json_response in results:
-                proposals = json_response.get('data', {}).get('proposals', [])
-                if not proposals:
-                    print(f'No more proposals found on page {page}.')
-                    continue
-
-                write_proposals_to_csv(writer, proposals)
-                print(f'Page {page}: {len(proposals)} records fetched')
-
-    print(f'All unique data saved to {csv_filename}')
-    print('No more proposals found.')
-
-    # Get the size of the CSV file
-    file_size = os.path.getsize(csv_filename)
-    readable_size = sizeof_fmt(file_size)
-    print(f'Size of the CSV file: {readable_size}')
-
-except IOError:
-    print('I/O error while writing to the CSV file')
\ No newline at end of file
+    try:
+        if normalized:
+            tables = NormalizedTables()
+            try:
+                with metrics.timer('crawl', pipeline='proposals'):
+                    await crawl(client, None, unique_proposals, tables)
+            finally:
+                tables.close()
+            for filename in (PROPOSALS_TABLE, SIGNERS_TABLE, APPROVES_TABLE, USERS_TABLE):
+                print(f'Saved {filename} ({sizeof_fmt(os.path.getsize(filename))})')
+            return
+
+        # Write to a temporary CSV that only replaces the current one if the proposals changed
+        stages = StageState(STAGES_FILENAME)
+        content = DatasetHash()
+        tmp_filename = csv_filename + ".tmp"
+        with open(tmp_filename, mode="w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+
+            # Write CSV header
+            writer.writerow([
+                "status", "state", "title", "type", "voteType", "creator_address",
+                "creator_username", "currency_symbol", "currency_address", "signers",
+                "neededSign", "cycle", "approves"
+            ])
+
+            with metrics.timer('crawl', pipeline='proposals'):
+                await crawl(client, HashingWriter(writer, content), unique_proposals)
+
+        stages.set_content(content)
+        if not stages.pending('write', csv_filename):
+            os.remove(tmp_filename)
+            print(f'Proposals unchanged ({content.records} records); kept {csv_filename}')
+            with metrics.timer('index', pipeline='proposals'):
+                refresh_index('proposals', csv_filename)
+            stages.report()
+            return
+        os.replace(tmp_filename, csv_filename)
+        stages.done('write')
+        with metrics.timer('index', pipeline='proposals'):
+            refresh_index('proposals', csv_filename)
+        stages.report()
+
+        print(f'All unique data saved to {csv_filename}')
+        print('No more proposals found.')
+
+        # Get the size of the CSV file
+        file_size = os.path.getsize(csv_filename)
+        readable_size = sizeof_fmt(file_size)
+        print(f'Size of the CSV file: {readable_size}')
+
+    except IOError:
+        print('I/O error while writing to the CSV file')
+    finally:
+        metrics.inc('rows', unique_proposals.misses, pipeline='proposals')
+        metrics.record_dedupe(unique_proposals, pipeline='proposals')
+        unique_proposals.close()
+
+async def main(normalized=False):
+    api_key = require_api_key()
+    async with aiohttp.ClientSession() as session:
+        client = MessierClient(session, api_key, AdaptiveRateLimiter(RATE_LIMIT), cache=default_cache())
+        await run(client, normalized)
+    client.metrics.export()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch virgo proposals into CSV.")
+    parser.add_argument('--normalized', action='store_true',
+                        help="write proposals, signer/approver edge tables and a users table "
+                             "instead of one CSV with embedded lists")
+    args = parser.parse_args()
+    asyncio.run(main(args.normalized))
@@ -1,34 +1,35 @@
-import csv
-import json
+import argparse
 import os
+import sys
 
-# Define the CSV and JSON filenames
-csv_filename = "proposals_data.csv"
-json_filename = "proposals_data.json"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl.csvjson import add_arguments, convert_stage
 
-# Check if the CSV file exists
-if not os.path.exists(csv_filename):
-    print(f"CSV file '{csv_filename}' does not exist.")
-    exit()
+# Define the CSV and JSON filenames, next to this script
+OUTPUT_DIR = os.path.dirname(os.path.abspath(__file__))
+csv_filename = os.path.join(OUTPUT_DIR, "proposals_data.csv")
+json_filename = os.path.join(OUTPUT_DIR, "proposals_data.json")
 
-# Initialize an empty list to store the data
-data = []
+def main():
+    parser = argparse.ArgumentParser(description=f"Convert {os.path.basename(csv_filename)} to "
+                                                 f"{os.path.basename(json_filename)}.")
+    add_arguments(parser)
+    args = parser.parse_args()
 
-# Open the CSV file and read it
-with open(csv_filename, mode="r", encoding="utf-8") as file:
-    csv_reader = csv.DictReader(file)
-    
-    # Convert each row of the CSV into a dictionary and add it to the list
-    for row in csv_reader:
-        data.append(row)
+    # Check if the CSV file exists
+    if not os.path.exists(csv_filename):
+        print(f"CSV file '{csv_filename}' does not exist.")
+        return
 
-# Count the number of proposals
-num_proposals = len(data)
+    # Stream the CSV rows straight into the JSON file, unless the proposals haven't changed
+    num_proposals = convert_stage(csv_filename, json_filename, args)
+    if num_proposals is None:
+        print(f"CSV file '{csv_filename}' unchanged since the last conversion; kept '{json_filename}'.")
+        return
 
-# Write the data to a JSON file
-with open(json_filename, mode="w", encoding="utf-8") as json_file:
-    json.dump(data, json_file, indent=4)
+    # Print the count of proposals and conversion success message
+    print(f"Number of proposals: {num_proposals}")
+    print(f"CSV file '{csv_filename}' has been successfully converted to JSON file '{json_filename}'.")
 
-# Print the count of proposals and conversion success message
-print(f"Number of proposals: {num_proposals}")
-print(f"CSV file '{csv_filename}' has been successfully converted to JSON file '{json_filename}'.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from etl.checkpoint import Checkpoint, open_store
+from etl.sinks import StreamingSink
+
+FIELDNAMES = ["service", "hash", "value"]
+SERVICES = ["horizon", "reward"]
+PAGES = 6
+SETTINGS = {"json_format": "array", "indent": None}
+
+
+def page_rows(service, page):
+    # Neighbouring pages overlap by one row, which dedupe drops
+    return [(service, f"0x{service}{index:04d}", index) for index in range((page - 1) * 5, page * 5 + 1)]
+
+
+class Crash(Exception):
+    pass
+
+
+def crawl(tmp_path, resume=False, crash_after=None):
+    """A crawl in the shape of txs.py's sequential one; raises Crash after `crash_after` pages."""
+    csv_filename, json_filename = str(tmp_path / "out.csv"), str(tmp_path / "out.json")
+    store, state = open_store(str(tmp_path / "dedupe.sqlite"), SETTINGS, resume,
+                              lambda state: StreamingSink.can_resume(csv_filename, json_filename, state["sink"]))
+    sink = StreamingSink(csv_filename, json_filename, FIELDNAMES, resume=state["sink"] if state else None)
+    checkpoint = Checkpoint(store, sink, SETTINGS, state, every_pages=2)
+    pages_written = 0
+    try:
+        for service in SERVICES:
+            if checkpoint.is_done(service):
+                continue
+            for page in range(checkpoint.next_page(service), PAGES + 1):
+                if crash_after is not None and pages_written == crash_after:
+                    raise Crash()
+                for values in page_rows(service, page):
+                    if store.add((values[0], values[1])):
+                        sink.write(dict(zip(FIELDNAMES, values)))
+                checkpoint.page_done(service, page)
+                pages_written += 1
+            checkpoint.service_done(service)
+    except BaseException:
+        sink.suspend()
+        store.close(flush=False)
+        raise
+    checkpoint.finish()
+    sink.close()
+    store.close()
+    return state, pages_written
+
+
+def read_outputs(tmp_path):
+    with open(tmp_path / "out.csv", "rb") as csv_file, open(tmp_path / "out.json", "rb") as json_file:
+        return csv_file.read(), json.load(json_file)
+
+
+@pytest.mark.parametrize("crash_after", [1, 3, 7])
+def test_resumed_crawl_matches_an_uninterrupted_one(tmp_path, crash_after):
+    (tmp_path / "full").mkdir()
+    crawl(tmp_path / "full")
+    expected = read_outputs(tmp_path / "full")
+    assert len(expected[1]) == len(SERVICES) * (PAGES * 5 + 1)
+
+    with pytest.raises(Crash):
+        crawl(tmp_path, crash_after=crash_after)
+    state, pages_written = crawl(tmp_path, resume=True)
+    # Saved every 2 pages, so up to one page is fetched again
+    saved = crash_after - crash_after % 2
+    assert (sum(state["pages"].values()) if state else 0) == saved
+    assert pages_written == len(SERVICES) * PAGES - saved
+    assert read_outputs(tmp_path) == expected
+
+    # The finished crawl dropped its checkpoint: a new --resume starts over
+    state, pages_written = crawl(tmp_path, resume=True)
+    assert state is None and pages_written == len(SERVICES) * PAGES
+
+
+def test_checkpoint_of_other_settings_is_not_used(tmp_path):
+    with pytest.raises(Crash):
+        crawl(tmp_path, crash_after=4)
+    store, state = open_store(str(tmp_path / "dedupe.sqlite"), {**SETTINGS, "indent": 4}, resume=True)
+    assert state is None and len(store) == 0
+    store.close()
@@ -0,0 +1,48 @@
+from etl import dedupe
+from etl.dedupe import DedupeStore, ScalableBloomFilter, key_digest
+
+
+def test_filter_grows_without_false_negatives():
+    bloom = ScalableBloomFilter(1000)
+    digests = [key_digest(index) for index in range(10_000)]
+    maybe_added = sum(bloom.add(digest) for digest in digests[:5000])
+    assert all(digest in bloom for digest in digests[:5000])
+    assert len(bloom.filters) > 1
+    false_positives = sum(digest in bloom for digest in digests[5000:])
+    # Below twice the error rate overall, with room for chance
+    assert maybe_added < 5000 * 4 * dedupe.BLOOM_ERROR
+    assert false_positives < 5000 * 4 * dedupe.BLOOM_ERROR
+
+
+def test_filter_is_saved_and_reused(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedupe, "BLOOM_SAVE_KEYS", 10)
+    path = str(tmp_path / "seen.sqlite")
+    with DedupeStore(path, reset=True, bloom_capacity=100) as store:
+        assert all(store.add(index) for index in range(500))
+        assert not store.add(3)
+
+    store = DedupeStore(path, bloom_capacity=100)
+    assert not store.add(7) and store.add(-1)
+    # The saved filters of 100, 200, ... keys, not one rebuilt for 2 * 500
+    assert [bloom.capacity for bloom in store._bloom.filters][:2] == [100, 200]
+    assert len(store) == 501
+    store.close()
+
+
+def test_filter_is_rebuilt_after_unsaved_keys(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedupe, "BLOOM_SAVE_KEYS", 10)
+    path = str(tmp_path / "seen.sqlite")
+    with DedupeStore(path, reset=True, bloom_capacity=100) as store:
+        for index in range(200):
+            store.add(index)
+    # Keys stored by a run that crashed before saving its filter
+    store = DedupeStore(path, bloom_capacity=100)
+    store.add(-1)
+    store.flush()
+    store._conn.close()
+
+    store = DedupeStore(path, bloom_capacity=100)
+    assert store._bloom is None  # rebuilt on the first lookup only
+    assert not store.add(-1) and not store.add(150) and store.add(-2)
+    assert store._bloom.filters[0].capacity == dedupe.BLOOM_GROWTH * 201
+    store.close()
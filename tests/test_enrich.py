@@ -0,0 +1,78 @@
+import csv
+
+from etl import enrich
+from etl.enrich import AddressIndex, join
+
+ALICE = "0x52908400098527886E0F7030069857D2E4169EE7"
+BOB = "0xde709f2102306220921060314715629080e2fb77"
+USERS = [
+    ["address", "username", "type", "isDarklist", "stakeAmount"],
+    [ALICE, "alice", "validator", "False", "100"],
+    [BOB, "bob", "user", "True", "2.5"],
+    [ALICE.lower(), "alice-again", "user", "True", "1"],  # the first row of an address wins
+]
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as csv_file:
+        csv.writer(csv_file).writerows(rows)
+    return str(path)
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+def test_join_adds_user_attributes_case_insensitively(tmp_path):
+    index = AddressIndex.from_csv(write_csv(tmp_path / "users.csv", USERS))
+    assert len(index) == 2
+    transactions = write_csv(tmp_path / "transactions.csv", [
+        ["hash", "user", "value"],
+        ["0x01", ALICE.lower(), "1"],
+        ["0x02", BOB.upper().replace("0X", "0x"), "2"],
+        ["0x03", "0x" + "0" * 40, "3"],
+        ["0x04", "", "4"],
+    ])
+    output = str(tmp_path / "transactions_enriched.csv")
+    assert join(index, transactions, output, {"user": "user_"}) == 4
+    rows = read_csv(output)
+    assert list(rows[0]) == ["hash", "user", "value", "user_username", "user_type", "user_isDarklist",
+                             "user_stakeAmount"]
+    assert [(row["hash"], row["user_username"], row["user_isDarklist"], row["user_stakeAmount"]) for row in rows] == [
+        ("0x01", "alice", "False", "100"),
+        ("0x02", "bob", "True", "2.5"),
+        ("0x03", "", "", ""),
+        ("0x04", "", "", ""),
+    ]
+
+
+def test_join_summarizes_user_lists_and_keeps_existing_attributes(tmp_path):
+    index = AddressIndex.from_csv(write_csv(tmp_path / "users.csv", USERS))
+    signers = repr([{"address": ALICE, "username": "alice"}, {"address": BOB, "username": "bob"}])
+    proposals = write_csv(tmp_path / "proposals.csv", [
+        ["id", "creator_address", "creator_username", "signers", "approves"],
+        ["1", BOB, "bob", signers, "[]"],
+        ["2", ALICE, "alice", "not a list", repr([{"address": BOB}])],
+    ])
+    output = str(tmp_path / "proposals_enriched.csv")
+    join(index, proposals, output, {"creator_address": "creator_"}, ["signers", "approves"])
+    rows = read_csv(output)
+    assert "creator_username" in rows[0] and list(rows[0]).count("creator_username") == 1
+    assert [(row["creator_type"], row["signers_darklisted"], row["signers_stake"],
+             row["approves_darklisted"], row["approves_stake"]) for row in rows] == [
+        ("user", "1", "102.5", "0", "0"),
+        ("validator", "", "", "1", "2.5"),
+    ]
+
+
+def test_enrich_skips_up_to_date_outputs(tmp_path, monkeypatch):
+    users = write_csv(tmp_path / "users.csv", USERS)
+    (tmp_path / "txs").mkdir()
+    write_csv(tmp_path / "txs" / "transactions_data.csv", [["hash", "user"], ["0x01", BOB]])
+    monkeypatch.setattr(enrich, "REPO_DIR", str(tmp_path))
+    written = enrich.enrich(["transactions"], users_csv=users)
+    assert written == [str(tmp_path / "txs" / "transactions_data_enriched.csv")]
+    assert read_csv(written[0])[0]["user_username"] == "bob"
+    assert enrich.enrich(["transactions"], users_csv=users) == []
+    assert enrich.enrich(["transactions"], force=True, users_csv=users) == written
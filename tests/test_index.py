@@ -0,0 +1,70 @@
+import csv
+
+import pytest
+
+from etl.index import open_index, parse_time
+
+COLUMNS = ["transaction_type", "timestamp", "blockchain", "service", "hash", "user",
+           "token_symbol", "token_address", "value"]
+USERS = ["0x52908400098527886E0F7030069857D2E4169EE7", "0xde709f2102306220921060314715629080e2fb77"]
+START = parse_time("2023-11-01")
+HOUR = 3_600_000
+
+
+def make_rows(start, count):
+    return [{"transaction_type": "swap", "timestamp": str(START + index * HOUR),
+             "blockchain": "ethereum" if index % 2 else "polygon", "service": "horizon" if index % 3 else "reward",
+             "hash": f"0x{index:064x}", "user": USERS[index % 2], "token_symbol": "A\nB" if index == 5 else "USDC",
+             "token_address": "", "value": str(index)}
+            for index in range(start, start + count)]
+
+
+def write_csv(path, rows, append=False):
+    with open(path, "a" if append else "w", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, COLUMNS)
+        if not append:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "transactions_data.csv")
+    write_csv(path, make_rows(0, 100))
+    index = open_index("transactions", path)
+    assert index.refresh()
+    return index
+
+
+def test_query_by_address_is_case_insensitive(index):
+    rows = make_rows(0, 100)
+    expected = [row for row in rows if row["user"] == USERS[0]]
+    assert list(index.query(address=USERS[0].lower())) == expected
+    assert list(index.query(address=USERS[0].upper().replace("0X", "0x"))) == expected
+    assert list(index.query(address="0x" + "0" * 40)) == []
+
+
+def test_query_by_hash_reads_multiline_records(index):
+    rows = make_rows(0, 100)
+    assert list(index.query(hash=f"0x{5:064x}")) == [rows[5]]
+    assert list(index.query(hash=f"0x{6:064X}")) == [rows[6]]
+
+
+def test_query_by_time_range_and_service(index):
+    rows = make_rows(0, 100)
+    since, until = parse_time("2023-11-02"), parse_time("2023-11-02T11:00:00")
+    assert list(index.query(since=since, until=until)) == \
+        [row for row in rows if since <= int(row["timestamp"]) <= until]
+    assert list(index.query(service="reward", since=since, limit=3)) == \
+        [row for row in rows if row["service"] == "reward" and int(row["timestamp"]) >= since][:3]
+    with pytest.raises(ValueError):
+        list(index.query(name="alice"))
+
+
+def test_appended_rows_are_indexed(index):
+    write_csv(index.csv_filename, make_rows(100, 20), append=True)
+    assert not index.is_fresh()
+    assert index.refresh(append=True)
+    assert index.is_fresh()
+    assert list(index.query(hash=f"0x{110:064x}")) == make_rows(110, 1)
+    assert len(list(index.query(address=USERS[1]))) == 60
@@ -0,0 +1,89 @@
+import asyncio
+
+from etl.paginate import prefetch_pages
+
+PAGE_SIZE = 10
+
+
+def make_fetch(total_items, delays, log):
+    """fetch(page) over `total_items` items, taking delays[page] seconds (later pages can finish first)."""
+    async def fetch(page):
+        log.append(("start", page))
+        try:
+            await asyncio.sleep(delays.get(page, 0.001))
+        except asyncio.CancelledError:
+            log.append(("cancelled", page))
+            raise
+        log.append(("done", page))
+        first = (page - 1) * PAGE_SIZE
+        return list(range(first, min(first + PAGE_SIZE, total_items)))
+    return fetch
+
+
+def short_page(page, items):
+    return page if len(items) < PAGE_SIZE else None
+
+
+def collect(fetch, end_of, window, start=1):
+    async def run():
+        return [item async for item in prefetch_pages(fetch, end_of, window, start)]
+    return asyncio.run(run())
+
+
+def test_pages_are_yielded_in_order_whatever_order_they_finish_in():
+    log = []
+    # Page 1 is the slowest, so pages 2-4 finish first and wait in the window
+    fetch = make_fetch(95, {1: 0.05, 2: 0.02, 3: 0.001, 4: 0.01}, log)
+    pages = collect(fetch, short_page, window=4)
+    assert [page for page, _ in pages] == list(range(1, 11))
+    assert [item for _, items in pages for item in items] == list(range(95))
+    assert log.index(("done", 3)) < log.index(("done", 1))
+    # Never more than `window` pages in flight
+    in_flight = peak = 0
+    for event, _ in log:
+        in_flight += 1 if event == "start" else -1
+        peak = max(peak, in_flight)
+    assert peak <= 4
+
+
+def test_pages_past_the_end_are_cancelled_and_not_yielded():
+    log = []
+    # 25 items: page 3 is short; pages 4-7 were launched speculatively
+    fetch = make_fetch(25, {4: 1.0, 5: 1.0, 6: 1.0, 7: 1.0}, log)
+    pages = collect(fetch, short_page, window=5)
+    assert [page for page, _ in pages] == [1, 2, 3]
+    # Pages whose task never got to run are cancelled before they start
+    started = {page for event, page in log if event == "start"}
+    assert {page for event, page in log if event == "cancelled"} == started - {1, 2, 3}
+    assert {4, 5} <= started
+    assert not any(event == "done" and page > 3 for event, page in log)
+
+
+def test_end_known_from_a_total_stops_launching_pages():
+    log = []
+
+    def from_total(page, items):
+        return 3  # e.g. a 'total' in the first response
+
+    pages = collect(make_fetch(1000, {}, log), from_total, window=2, start=1)
+    assert [page for page, _ in pages] == [1, 2, 3]
+    assert max(page for event, page in log if event == "start") == 3
+
+
+def test_closing_the_generator_early_cancels_the_window():
+    log = []
+    fetch = make_fetch(1000, {page: 1.0 for page in range(2, 10)}, log)
+
+    async def run():
+        pages = prefetch_pages(fetch, short_page, window=4)
+        first = await pages.__anext__()
+        await pages.aclose()
+        await asyncio.sleep(0)
+        # No page task is left running
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+        return first
+
+    page, _ = asyncio.run(run())
+    assert page == 1
+    started = {page for event, page in log if event == "start"}
+    assert {page for event, page in log if event == "cancelled"} == started - {1} == {2, 3, 4}
@@ -0,0 +1,90 @@
+import csv
+import json
+import os
+
+import pytest
+
+from etl import partitions
+from etl.partitions import PartitionedSink
+from etl.sinks import encode_rows
+
+FIELDNAMES = ["service", "timestamp", "hash", "value"]
+NOVEMBER = 1_699_000_000_000  # 2023-11-03
+DECEMBER = 1_701_500_000_000  # 2023-12-02
+
+
+def make_rows(start, count):
+    return [("horizon" if index % 3 else "reward", (NOVEMBER if index % 2 else DECEMBER) + index,
+             f"0x{index:064x}", index * 0.5)
+            for index in range(start, start + count)]
+
+
+def write(directory, rows, json_format, append=False):
+    with PartitionedSink(directory, FIELDNAMES, json_format=json_format, append=append,
+                         shard_bytes=400, workers=2) as sink:
+        for position in range(0, len(rows), 7):
+            sink.write_encoded(encode_rows(FIELDNAMES, rows[position:position + 7], json_format))
+    return sink
+
+
+def read_json(path, json_format):
+    with open(path, "rb") as json_file:
+        if json_format == "array":
+            return json.load(json_file)
+        return [json.loads(line) for line in json_file]
+
+
+def check_partitions(directory, json_format, rows):
+    """Checks every shard against the manifest and the rows each partition should hold, in order."""
+    manifest = partitions.load_manifest(directory)
+    expected = {}
+    for values in rows:
+        month = "2023-11" if values[1] < DECEMBER else "2023-12"
+        expected.setdefault(f"service={values[0]}/month={month}", []).append(dict(zip(FIELDNAMES, values)))
+    assert sorted(entry["path"] for entry in manifest["partitions"]) == sorted(expected)
+    assert manifest["rows"] == len(rows)
+    for entry in manifest["partitions"]:
+        directory_path = os.path.join(directory, *entry["path"].split("/"))
+        records = []
+        for shard in entry["shards"]:
+            csv_path = os.path.join(directory_path, shard["csv"])
+            json_path = os.path.join(directory_path, shard["json"])
+            assert os.path.getsize(csv_path) == shard["csv_bytes"]
+            assert os.path.getsize(json_path) == shard["json_bytes"]
+            with open(csv_path, newline="") as csv_file:
+                csv_rows = list(csv.DictReader(csv_file))
+            shard_records = read_json(json_path, json_format)
+            assert len(csv_rows) == len(shard_records) == shard["rows"]
+            assert [row["hash"] for row in csv_rows] == [record["hash"] for record in shard_records]
+            records += shard_records
+        assert len(entry["shards"]) > 1
+        assert records == expected[entry["path"]]
+        assert entry["rows"] == len(records)
+
+
+@pytest.mark.parametrize("json_format", ["array", "ndjson"])
+def test_append_in_place(tmp_path, json_format):
+    directory = str(tmp_path / "partitions")
+    first, second = make_rows(0, 60), make_rows(60, 25)
+    write(directory, first, json_format)
+    check_partitions(directory, json_format, first)
+
+    assert partitions.can_append(directory, FIELDNAMES, json_format)
+    sink = write(directory, second, json_format, append=True)
+    assert sink.written == 4
+    check_partitions(directory, json_format, first + second)
+
+
+def test_rewrite_keeps_unchanged_partitions(tmp_path):
+    directory = str(tmp_path / "partitions")
+    rows = make_rows(0, 60)
+    write(directory, rows, "array")
+    # Only the reward partitions get different rows
+    changed = [values if values[0] == "horizon" else values[:3] + (-1.0,) for values in rows]
+    sink = write(directory, changed, "array")
+    assert (sink.written, sink.unchanged, sink.removed) == (2, 2, 0)
+    check_partitions(directory, "array", changed)
+
+    sink = write(directory, [values for values in changed if values[0] == "horizon"], "array")
+    assert (sink.written, sink.unchanged, sink.removed) == (0, 2, 2)
+    assert not os.path.exists(os.path.join(directory, "service=reward"))
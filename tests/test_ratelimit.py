@@ -0,0 +1,81 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp.test_utils import TestServer
+
+from etl import mockapi
+from etl.client import MessierClient
+from etl.ratelimit import AdaptiveRateLimiter
+
+
+def test_throttle_halves_the_rate_once_per_burst():
+    limiter = AdaptiveRateLimiter(4.0, min_rate=0.5)
+    limiter.on_throttle()
+    assert limiter.rate == 2.0 and limiter.ceiling == 4.0
+    # Requests that were in flight at the same time don't cut it again
+    limiter.on_throttle()
+    assert limiter.rate == 2.0 and limiter.throttled == 2
+    limiter._last_decrease -= 10
+    limiter.on_throttle()
+    limiter._last_decrease -= 10
+    limiter.on_throttle()
+    limiter._last_decrease -= 10
+    limiter.on_throttle()
+    assert limiter.rate == 0.5
+
+
+def test_success_recovers_additively_and_slows_near_the_ceiling():
+    limiter = AdaptiveRateLimiter(1.0, increase=0.5, max_rate=4.0)
+    limiter.on_success()
+    assert limiter.rate == pytest.approx(1.5)
+    limiter.on_success()
+    assert limiter.rate == pytest.approx(1.5 + 0.5 / 1.5)
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.rate == 4.0
+
+    limiter.ceiling = 4.0
+    limiter.rate = 3.8
+    limiter.on_success()
+    assert limiter.rate == pytest.approx(3.8 + 0.05 / 3.8)
+
+
+def test_initial_rate_above_max_rate_is_kept():
+    limiter = AdaptiveRateLimiter(1000.0, 100)
+    limiter.on_success()
+    assert limiter.rate == 1000.0
+
+
+def test_reservations_after_retry_after_are_spaced():
+    limiter = AdaptiveRateLimiter(2.0)
+    limiter.on_throttle(10)
+    assert limiter.rate == 1.0
+    delays = [limiter.reserve() for _ in range(10)]
+    assert delays == pytest.approx([10.0 + position / limiter.rate for position in range(10)], abs=0.01)
+
+
+def test_shorter_retry_after_does_not_shorten_the_block():
+    limiter = AdaptiveRateLimiter(1.0)
+    limiter.on_throttle(10)
+    limiter.on_throttle(2)
+    assert limiter.reserve() == pytest.approx(10.0, abs=0.01)
+
+
+def test_client_backs_off_from_a_throttling_server():
+    server = mockapi.MockServer(mockapi.MockData(200), throttle_every=3, retry_after=0.2,
+                                throttle_style="header")
+    limiter = AdaptiveRateLimiter(20.0, 5)
+
+    async def run():
+        async with TestServer(server.application()) as test_server:
+            url = str(test_server.make_url("/api/v1/platform/transaction"))
+            async with aiohttp.ClientSession() as session:
+                client = MessierClient(session, "test", limiter)
+                return [await client.get_json(url, {"service": "horizon", "page": page, "limit": 20})
+                        for page in range(1, 6)]
+
+    pages = asyncio.run(run())
+    assert [len(page["data"]["items"]) for page in pages] == [20] * 5
+    assert limiter.throttled == server.throttled["platform/transaction"] >= 2
+    assert limiter.rate < 20.0
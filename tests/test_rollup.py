@@ -0,0 +1,80 @@
+import csv
+import json
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import pytest
+
+from etl.rollup import Rollup
+
+FIELDNAMES = ["timestamp", "service", "blockchain", "value"]
+START = 1_698_796_800_000  # 2023-11-01T00:00:00Z
+HOUR = 3_600_000
+
+
+def make_rows(start, count):
+    rows = [(START + index * 7 * HOUR, "horizon" if index % 3 else "reward", None if index % 5 == 0 else "polygon",
+             str(index * 0.25) if index % 2 else index * 0.25)
+            for index in range(start, start + count)]
+    return rows + [(None, "horizon", "polygon", "1.5"), (START, "horizon", "polygon", "not a number")]
+
+
+def expected_totals(rows):
+    """Count and value sum per (day, service, blockchain), computed straight from the rows."""
+    totals = defaultdict(lambda: [0, 0.0])
+    for timestamp, service, blockchain, value in rows:
+        day = "" if timestamp is None else \
+            datetime.fromtimestamp(timestamp / 1000, timezone.utc).date().isoformat()
+        group = totals[(day, service, blockchain or "")]
+        group[0] += 1
+        try:
+            group[1] += float(value)
+        except ValueError:
+            pass
+    return dict(totals)
+
+
+def assert_totals(rollup, rows):
+    expected = expected_totals(rows)
+    assert rollup.groups.keys() == expected.keys()
+    for key, (count, value) in expected.items():
+        assert rollup.groups[key][0] == count
+        assert rollup.groups[key][1] == pytest.approx(value)
+
+
+def test_totals_match_the_source_rows():
+    rows = make_rows(0, 200)
+    rollup = Rollup(FIELDNAMES, ["service", "blockchain"])
+    rollup.add_many(rows[:50])
+    rollup.add_many(rows[50:])
+    assert_totals(rollup, rows)
+    assert sum(count for count, _ in rollup.groups.values()) == len(rows)
+
+
+def test_saved_rollup_loads_and_keeps_adding(tmp_path):
+    first, second = make_rows(0, 100), make_rows(100, 60)
+    csv_filename, json_filename = str(tmp_path / "rollup.csv"), str(tmp_path / "rollup.json")
+    rollup = Rollup(FIELDNAMES, ["service", "blockchain"])
+    rollup.add_many(first)
+    rollup.save(csv_filename, json_filename)
+
+    loaded = Rollup(FIELDNAMES, ["service", "blockchain"])
+    assert loaded.load(csv_filename)
+    loaded.add_many(second)
+    assert_totals(loaded, first + second)
+    with open(json_filename, "rb") as json_file:
+        assert json.load(json_file) == list(rollup.records())
+    # A rollup saved with other dimensions isn't loaded
+    assert not Rollup(FIELDNAMES, ["service"]).load(csv_filename)
+
+
+def test_rollup_of_a_csv(tmp_path):
+    rows = make_rows(0, 80)
+    csv_filename = str(tmp_path / "rows.csv")
+    with open(csv_filename, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["value", "blockchain", "service", "timestamp"])
+        writer.writerows((value, blockchain, service, timestamp) for timestamp, service, blockchain, value in rows)
+    rollup = Rollup(FIELDNAMES, ["service", "blockchain"])
+    rollup.add_csv(csv_filename)
+    assert_totals(rollup, rows)
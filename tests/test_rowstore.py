@@ -0,0 +1,48 @@
+from etl.rowstore import CategoryColumn, HexColumn, NumberColumn, RowBlock
+
+SCHEMA = {"service": "category", "amount": "float", "block": "int",
+          "hash": "hex32", "from": "hex20"}
+ADDRESS = "0x52908400098527886E0F7030069857D2E4169EE7"
+HASH = "0x" + "ab" * 32
+
+
+def test_category_column_side_values():
+    column = CategoryColumn()
+    for value in ("a", 5, None, "a", b"raw"):
+        column.append(value)
+    assert column.take([0, 1, 2, 3, 4]) == ["a", 5, None, "a", b"raw"]
+    assert column.take([4, 1]) == [b"raw", 5]
+    assert [column.get(index) for index in range(5)] == ["a", 5, None, "a", b"raw"]
+
+
+def test_category_column_past_distinct_limit():
+    column = CategoryColumn()
+    values = [f"v{number}" for number in range(CategoryColumn.OTHER + 10)]
+    for value in values:
+        column.append(value)
+    assert column.take(range(len(values))) == values
+    assert column.get(len(values) - 1) == values[-1]
+
+
+def test_number_and_hex_columns_side_values():
+    numbers = NumberColumn("q")
+    for value in (1, "2", None, 1 << 70):
+        numbers.append(value)
+    assert numbers.take([0, 1, 2, 3]) == [1, "2", None, 1 << 70]
+    hexes = HexColumn(20)
+    for value in (ADDRESS, ADDRESS.lower(), "0xnothex", None):
+        hexes.append(value)
+    assert hexes.take([0, 1, 2, 3]) == [ADDRESS, ADDRESS.lower(), "0xnothex", None]
+
+
+def test_row_block_round_trip():
+    rows = [
+        ("horizon", 1.5, 10, HASH, ADDRESS),
+        (7, "1.5", None, "0x12", ADDRESS.lower()),
+        (None, 2.0, 1 << 70, HASH.upper().replace("0X", "0x"), None),
+    ]
+    block = RowBlock.from_rows(SCHEMA, rows, key_fields=("hash", "service"))
+    assert block.rows() == rows
+    assert block.rows([2, 0]) == [rows[2], rows[0]]
+    assert [block.row(index) for index in range(len(rows))] == rows
+    assert len(block.key(0)) == len(block.key(1))
@@ -0,0 +1,33 @@
+import asyncio
+
+from txs import txs
+
+OLD_MARK = {"timestamp": 100, "hashes": {"h1"}}
+PAGE_1 = [{"hash": "h3", "timestamp": 300}, {"hash": "h2", "timestamp": 200}]
+
+
+def crawl(monkeypatch, pages, watermarks):
+    async def fetch_page(client, service, page):
+        return pages.get(page) or [], 2 * len(pages)
+
+    async def process_items(service, items):
+        return len(items)
+
+    monkeypatch.setattr(txs, "SERVICES", ["horizon"])
+    monkeypatch.setattr(txs, "PAGE_LIMIT", 2)
+    monkeypatch.setattr(txs, "fetch_page", fetch_page)
+    monkeypatch.setattr(txs, "process_items", process_items)
+    monkeypatch.setattr(txs, "item_timestamp", lambda item: item["timestamp"])
+    asyncio.run(txs.crawl_incremental(None, watermarks))
+    return watermarks
+
+
+def test_failed_page_keeps_watermark(monkeypatch):
+    watermarks = crawl(monkeypatch, {1: PAGE_1, 2: None}, {"horizon": dict(OLD_MARK)})
+    assert watermarks["horizon"] == OLD_MARK
+
+
+def test_reaching_synced_items_advances_watermark(monkeypatch):
+    pages = {1: PAGE_1, 2: [{"hash": "h1", "timestamp": 100}]}
+    watermarks = crawl(monkeypatch, pages, {"horizon": dict(OLD_MARK)})
+    assert watermarks["horizon"] == {"timestamp": 300, "hashes": {"h3"}}
@@ -0,0 +1,113 @@
+import asyncio
+import json
+
+import aiohttp
+from aiohttp.test_utils import TestServer
+
+from etl import mockapi, upload
+
+RECORDS = [{"id": index, "name": f"record {index}", "value": index * 1.5} for index in range(200)]
+CHUNK_BYTES = 2000  # about 40 records per chunk
+
+
+def write_dataset(path, records):
+    path.write_text(json.dumps(records))
+    return str(path)
+
+
+def run_uploads(monkeypatch, steps):
+    """
+    Runs `steps(session, server)` against a mock jsonBlob server and returns
+    what it returns. Uploads are sent to the mock without retry delays.
+    """
+    server = mockapi.MockServer(mockapi.MockData(0))
+
+    async def run():
+        async with TestServer(server.application()) as test_server:
+            monkeypatch.setenv("JSONBLOB_API_URL", str(test_server.make_url("/api/jsonBlob")))
+            async with aiohttp.ClientSession() as session:
+                return await steps(session, server)
+
+    monkeypatch.setattr(upload, "RETRY_DELAY", 0)
+    return asyncio.run(run())
+
+
+def blob(server, url):
+    return json.loads(server.blobs[url.rsplit("/", 1)[1]])
+
+
+def chunked_records(server, url):
+    manifest = blob(server, url)
+    return [record for chunk in manifest["chunks"] for record in blob(server, chunk["url"])]
+
+
+def test_chunked_upload_is_gzipped_and_skips_unchanged_chunks(tmp_path, monkeypatch):
+    filename = write_dataset(tmp_path / "data.json", RECORDS)
+
+    async def steps(session, server):
+        url = await upload.upload_dataset(session, filename, CHUNK_BYTES)
+        assert chunked_records(server, url) == RECORDS
+        uploads = dict(server.blob_uploads)
+        assert uploads["gzip"] == uploads["POST"] > 2
+
+        # Only the last chunk and the manifest change
+        write_dataset(tmp_path / "data.json", RECORDS[:-1])
+        server.blob_uploads.clear()
+        assert await upload.upload_dataset(session, filename, CHUNK_BYTES) == url
+        assert chunked_records(server, url) == RECORDS[:-1]
+        assert server.blob_uploads == {"POST": 1, "PUT": 1, "gzip": 2}
+
+    run_uploads(monkeypatch, steps)
+
+
+def test_interrupted_upload_resumes(tmp_path, monkeypatch):
+    filename = write_dataset(tmp_path / "data.json", RECORDS)
+    real_send_blob = upload.send_blob
+    sent = []
+
+    async def failing_send_blob(session, body, url=None, max_retries=upload.MAX_RETRIES):
+        sent.append(body)
+        if len(sent) == 3:
+            return None
+        return await real_send_blob(session, body, url, max_retries)
+
+    async def steps(session, server):
+        monkeypatch.setattr(upload, "send_blob", failing_send_blob)
+        assert await upload.upload_dataset(session, filename, CHUNK_BYTES, max_retries=0) is None
+        monkeypatch.setattr(upload, "send_blob", real_send_blob)
+        created = server.blob_uploads["POST"]
+        server.blob_uploads.clear()
+        url = await upload.upload_dataset(session, filename, CHUNK_BYTES)
+        assert chunked_records(server, url) == RECORDS
+        # The chunks stored before the failure were not sent again
+        chunks = len(blob(server, url)["chunks"])
+        assert server.blob_uploads["POST"] == chunks + 1 - created
+
+    run_uploads(monkeypatch, steps)
+
+
+def test_url_is_kept_across_layouts(tmp_path, monkeypatch):
+    filename = write_dataset(tmp_path / "data.json", RECORDS[:5])
+
+    async def steps(session, server):
+        url = await upload.upload_dataset(session, filename, CHUNK_BYTES)
+        assert blob(server, url) == RECORDS[:5]
+        write_dataset(tmp_path / "data.json", RECORDS)
+        assert await upload.upload_dataset(session, filename, CHUNK_BYTES) == url
+        assert chunked_records(server, url) == RECORDS
+        write_dataset(tmp_path / "data.json", RECORDS[:3])
+        assert await upload.upload_dataset(session, filename, CHUNK_BYTES) == url
+        assert blob(server, url) == RECORDS[:3]
+
+    run_uploads(monkeypatch, steps)
+
+
+def test_expired_blob_is_recreated_in_the_same_attempt(monkeypatch):
+    async def steps(session, server):
+        url = await upload.send_blob(session, b"[1]", max_retries=0)
+        del server.blobs[url.rsplit("/", 1)[1]]
+        new_url = await upload.send_blob(session, b"[2]", url, max_retries=0)
+        assert new_url not in (None, url)
+        assert blob(server, new_url) == [2]
+
+    run_uploads(monkeypatch, steps)
@@ -1,153 +1,578 @@
 import aiohttp
+import argparse
 import asyncio
-import pandas as pd
 import os
+import sys
 import json
 import math
-from dotenv import load_dotenv
+import time
 
-# Load environment variables from .env file
-load_dotenv()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl.cache import default_cache
+from etl.checkpoint import Checkpoint, open_store
+from etl.client import MessierClient, messier_url, require_api_key
+from etl.dedupe import DedupeStore
+from etl.ratelimit import AdaptiveRateLimiter
+from etl.rollup import Rollup
+from etl.fingerprint import StageState, stages_path
+from etl.index import refresh_index
+from etl.rowstore import RowBlock
+from etl.sinks import StreamingSink, encode_rows
+from etl.transform import TransformPool, default_workers
+from etl.upload import upload_dataset
 
-API_KEY = os.getenv('API_KEY')
-if not API_KEY:
-    raise ValueError("API_KEY not found. Please set it in the .env file.")
-
-BASE_URL = 'https://api.messier.app/api/v1/platform/transaction'
+BASE_URL = messier_url('platform/transaction')
 SERVICES = ["horizon", "adastra", "openhatch", "p2p", "virgo"]
 PAGE_LIMIT = 100
-REQUEST_DELAY = 5
-MAX_RETRIES = 5
 
-all_data = []
-seen_records = set()  # used for deduping token rows (hash, user, symbol)
+# Initial request rate; the adaptive limiter tunes it from 429 responses
+RATE_LIMIT = 2.0  # requests per second
+RATE_BURST = 5  # token bucket capacity
+# Requests allowed in flight at once in --concurrent mode, across all services
+MAX_IN_FLIGHT = 10
+
+# Outputs and sync state live next to this script
+OUTPUT_DIR = os.path.dirname(os.path.abspath(__file__))
+CSV_FILENAME = os.path.join(OUTPUT_DIR, "transactions_data.csv")
+JSON_FILENAME = os.path.join(OUTPUT_DIR, "transactions_data.json")
+NDJSON_FILENAME = os.path.join(OUTPUT_DIR, "transactions_data.ndjson")
+# Directory of Parquet part files written with --parquet
+PARQUET_DIR = os.path.join(OUTPUT_DIR, "transactions_parquet")
+# Partitions by service and month (or day) written with --partitioned
+PARTITIONS_DIR = os.path.join(OUTPUT_DIR, "transactions_partitions")
+# Per-service watermark used by --incremental
+STATE_FILENAME = os.path.join(OUTPUT_DIR, "transactions_sync_state.json")
+# Persistent dedupe index of token rows already written to the outputs
+DEDUPE_FILENAME = os.path.join(OUTPUT_DIR, "transactions_dedupe.sqlite")
+CSV_COLUMNS = ['transaction_type', 'timestamp', 'blockchain', 'service', 'hash', 'user',
+               'token_symbol', 'token_address', 'value']
+# Daily rollup of count and value, kept up to date from the rows each run writes
+ROLLUP_CSV_FILENAME = os.path.join(OUTPUT_DIR, "transactions_rollup_daily.csv")
+ROLLUP_JSON_FILENAME = os.path.join(OUTPUT_DIR, "transactions_rollup_daily.json")
+ROLLUP_DIMENSIONS = ['service', 'blockchain', 'token_symbol', 'transaction_type']
+# How transformed pages hold their rows until they are written (see etl.rowstore); token
+# contracts repeat across rows, so they are interned rather than stored as bytes
+ROW_SCHEMA = {'transaction_type': 'category', 'timestamp': 'int', 'blockchain': 'category',
+              'service': 'category', 'hash': 'hex32', 'user': 'hex20', 'token_symbol': 'category',
+              'token_address': 'category', 'value': 'float'}
+DEDUPE_FIELDS = ['hash', 'user', 'token_address', 'token_symbol']
+
+# Opened by main(): dedupe index of token rows (hash, user, contract, symbol), the output
+# sink and, with --parquet, the columnar sink; metrics is the client's. Full crawls
+# save a checkpoint of their progress that --resume continues from. Pages are
+# transformed by the transformer, in worker processes unless it has none. New rows
+# are folded into the daily rollup and, with --partitioned, written to their partitions.
+seen_records = None
+sink = None
+columnar = None
+partitions = None
+metrics = None
+checkpoint = None
+transformer = None
+rollup = None
 
-async def fetch_page(session, service, page):
+async def fetch_page(client, service, page):
     """
     Fetch a page of data from the API for a given service.
-    Retries up to MAX_RETRIES upon 429/400 or non-200 statuses.
+    Retries and rate limiting are handled by the shared client.
     Returns (items, total).
     """
-    retries = 0
-    while retries <= MAX_RETRIES:
-        url = f"{BASE_URL}?service={service}&page={page}&limit={PAGE_LIMIT}"
-        headers = {
-            'accept': 'application/json',
-            'X-API-KEY': API_KEY
-        }
-        async with session.get(url, headers=headers) as response:
-            if response.status in [429, 400]:
-                await asyncio.sleep(REQUEST_DELAY)
-                retries += 1
-                continue
-            elif response.status != 200:
-                retries += 1
-                await asyncio.sleep(5)
-                continue
-            try:
-                json_response = await response.json()
-                data = json_response.get('data', {})
-                items = data.get('items', [])
-                raw_total = data.get('total', 0)
-
-                # Convert total to int, handle ValueError if it isn't numeric
-                try:
-                    total = int(raw_total)
-                except ValueError:
-                    total = 0
-
-                return items, total
-            except ValueError:
-                retries += 1
-                await asyncio.sleep(5)
-                continue
+    json_response = await client.get_json(
+        BASE_URL, params={'service': service, 'page': page, 'limit': PAGE_LIMIT}
+    )
+    if json_response is None:
+        return [], 0
 
-    return [], 0
+    data = json_response.get('data', {})
+    items = data.get('items', [])
+    raw_total = data.get('total', 0)
 
-async def main():
-    async with aiohttp.ClientSession() as session:
-        for service in SERVICES:
-            page = 1
+    # Convert total to int, handle ValueError if it isn't numeric
+    try:
+        total = int(raw_total)
+    except (TypeError, ValueError):
+        total = 0
 
-            # Fetch the first page to get 'total' and 'items'
-            items, total = await fetch_page(session, service, page)
-            if not items:
-                print(f"No data for service {service} on page 1. Skipping.")
-                continue
+    return items, total
+
+def flatten_items(service, items):
+    """
+    Flatten each item by iterating over 'trxData': one tuple of
+    CSV_COLUMNS values per token.
+    """
+    rows = []
+    for item in items:
+        for token_info in item.get("trxData") or ():
+            rows.append((
+                item.get('type'),
+                item.get('timestamp'),
+                item.get('network'),
+                service,
+                item.get('hash'),
+                item.get('address'),
+                token_info.get('symbol'),
+                token_info.get('contract'),
+                token_info.get('value'),
+            ))
+    return rows
+
+def transform_page(service, items):
+    """
+    Transform stage, run by the transformer's workers: flattens a page into
+    a compact RowBlock, with its rows' digests and dedupe keys. Returns
+    (block, seconds spent).
+    """
+    started = time.perf_counter()
+    block = RowBlock.from_rows(ROW_SCHEMA, flatten_items(service, items), DEDUPE_FIELDS)
+    return block, time.perf_counter() - started
+
+async def transform_items(service, items):
+    block, seconds = await transformer.run(transform_page, service, items)
+    metrics.inc("stage_seconds", seconds, stage="transform", pipeline="txs", service=service)
+    return block
+
+def write_rows(service, block):
+    """
+    Writes the unseen token rows of a transformed page to the sink, deduped
+    on (hash, user, contract, symbol). Returns the number of new rows.
+    """
+    with metrics.timer("write", pipeline="txs", service=service):
+        new = [index for index in range(len(block)) if seen_records.add_digest(block.key(index))]
+        new_rows = block.rows(new)
+        digests = [block.digest(index) for index in new]
+        if partitions is not None:
+            # Encode the rows once; the partition writers only copy the same bytes
+            encoded = encode_rows(CSV_COLUMNS, new_rows, sink.json_format, sink.indent, digests=digests)
+            sink.write_encoded(encoded)
+            partitions.write_encoded(encoded)
+        else:
+            sink.write_values(new_rows, digests)
+        rollup.add_many(new_rows)
+        if columnar is not None:
+            for values in new_rows:
+                columnar.write(dict(zip(CSV_COLUMNS, values)))
+    metrics.inc("rows", len(new_rows), pipeline="txs", service=service)
+    return len(new_rows)
+
+async def process_items(service, items):
+    """Transforms a page of items and writes its new rows. Returns the number of new rows."""
+    return write_rows(service, await transform_items(service, items))
 
-            # Convert total to an integer if it’s not already
-            max_pages = math.ceil(total / PAGE_LIMIT) if total else 1
-
-            while True:
-                new_count = 0
-
-                   # Flatten each item by iterating over 'trxData'
-                for item in items:
-                    trx_list = item.get("trxData", [])
-                    if not trx_list:
-                        continue
-
-                    for token_info in trx_list:
-                        dedupe_key = (
-                            item.get("hash"),
-                            item.get("address"),
-                            token_info.get("contract"),
-                            token_info.get("symbol"),
-                        )
-
-                        if dedupe_key in seen_records:
-                            continue
-                        seen_records.add(dedupe_key)
-                        row = {
-                            'transaction_type': item.get('type'),
-                            'timestamp': item.get('timestamp'),
-                            'blockchain': item.get('network'),
-                            'service': service,
-                            'hash': item.get('hash'),
-                            'user': item.get('address'),
-                            'token_symbol': token_info.get('symbol'),
-                            'token_address': token_info.get('contract'),
-                            'value': token_info.get('value')
-                        }
-                        all_data.append(row)
-                        new_count += 1
+def first_page(service):
+    """Page to start `service` at: 1, or the page after the checkpoint."""
+    return checkpoint.next_page(service) if checkpoint is not None else 1
 
+def page_done(service, page):
+    if checkpoint is not None:
+        checkpoint.page_done(service, page)
+
+def service_done(service):
+    if checkpoint is not None:
+        checkpoint.service_done(service)
+
+def pending_services():
+    """The services the checkpoint (if any) hasn't finished yet."""
+    return [service for service in SERVICES if checkpoint is None or not checkpoint.is_done(service)]
+
+async def crawl_sequential(client):
+    """Walks the services one after another, one page at a time."""
+    for service in pending_services():
+        page = first_page(service)
+
+        # Fetch the first page to get 'total' and 'items'
+        items, total = await fetch_page(client, service, page)
+        if not items:
+            print(f"No data for service {service} on page {page}. Skipping.")
+            service_done(service)
+            continue
+
+        # Convert total to an integer if it’s not already
+        max_pages = math.ceil(total / PAGE_LIMIT) if total else 1
+
+        while True:
+            new_count = await process_items(service, items)
+            print(f"For service {service}, page {page} processed. Found {new_count} new records.")
+            page_done(service, page)
+
+            # If we've reached the last page or found no new records, stop.
+            if page >= max_pages or new_count == 0:
+                break
+
+            page += 1
+            items, _ = await fetch_page(client, service, page)
+        service_done(service)
+
+def load_watermarks():
+    """
+    Reads the per-service watermarks: the newest synced 'timestamp' and the
+    hashes seen at exactly that timestamp. Returns None if there is no state.
+    """
+    if not os.path.exists(STATE_FILENAME):
+        return None
+    with open(STATE_FILENAME, "r") as state_file:
+        state = json.load(state_file)
+    return {
+        service: {'timestamp': mark['timestamp'], 'hashes': set(mark['hashes'])}
+        for service, mark in state.items()
+    }
+
+def save_watermarks(watermarks):
+    state = {
+        service: {'timestamp': mark['timestamp'], 'hashes': sorted(mark['hashes'])}
+        for service, mark in watermarks.items()
+    }
+    tmp_filename = STATE_FILENAME + ".tmp"
+    with open(tmp_filename, "w") as state_file:
+        json.dump(state, state_file, indent=4)
+    os.replace(tmp_filename, STATE_FILENAME)
+
+def item_timestamp(item):
+    try:
+        return int(item.get('timestamp'))
+    except (TypeError, ValueError):
+        return 0
+
+def is_synced(item, watermark):
+    """True if the item is at or behind the watermark, i.e. a previous run already saved it."""
+    if not watermark:
+        return False
+    timestamp = item_timestamp(item)
+    if timestamp != watermark['timestamp']:
+        return timestamp < watermark['timestamp']
+    return item.get('hash') in watermark['hashes']
+
+def advance_watermark(watermark, items):
+    """Returns the watermark moved forward past `items`."""
+    mark = {'timestamp': watermark['timestamp'], 'hashes': set(watermark['hashes'])} if watermark \
+        else {'timestamp': 0, 'hashes': set()}
+    for item in items:
+        timestamp = item_timestamp(item)
+        if timestamp > mark['timestamp']:
+            mark = {'timestamp': timestamp, 'hashes': set()}
+        if timestamp == mark['timestamp']:
+            mark['hashes'].add(item.get('hash'))
+    return mark
+
+async def crawl_incremental(client, watermarks):
+    """
+    Pages through each service newest-first, keeping only items past the
+    service's watermark, and stops at the first page without any such item.
+    Items that show up later with a timestamp older than the watermark are
+    not picked up; run a full crawl to backfill those.
+    Updates `watermarks` in place, but only for the services whose crawl
+    reached synced items or the last page: if a page fails before that,
+    the service keeps its old watermark so the next run fetches the pages
+    it missed (the rows already written are deduped then).
+    """
+    for service in SERVICES:
+        watermark = watermarks.get(service)
+        new_mark = watermark
+        page = 1
+        complete = True
+
+        items, total = await fetch_page(client, service, page)
+        max_pages = math.ceil(total / PAGE_LIMIT) if total else 1
+
+        while items:
+            fresh = [item for item in items if not is_synced(item, watermark)]
+            new_count = await process_items(service, fresh)
+            if fresh:
+                new_mark = advance_watermark(new_mark, fresh)
+            print(f"For service {service}, page {page} processed. Found {new_count} new records.")
+
+            # Everything past this page was synced by an earlier run
+            if len(fresh) < len(items) or page >= max_pages:
+                break
+
+            page += 1
+            items, _ = await fetch_page(client, service, page)
+            # fetch_page() returns no items once its retries run out
+            complete = bool(items)
+
+        if not complete:
+            print(f"For service {service}, page {page} could not be fetched; keeping its watermark "
+                  f"so the next run fetches the missed records.")
+        elif new_mark is not None:
+            watermarks[service] = new_mark
+
+async def crawl_concurrent(client, max_in_flight):
+    """
+    Fetches page 1 of every service, then fans out all remaining pages of all
+    services at once, bounded by `max_in_flight` concurrent requests and the
+    client's rate limiter. Each page is transformed as soon as it arrives, but
+    pages are still written in (service, page) order, so dedupe and output
+    order match crawl_sequential.
+    Unlike the sequential crawl there is no early stop on a page without new
+    records: every page up to 'total' is fetched.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def fetch(service, page):
+        async with semaphore:
+            items, total = await fetch_page(client, service, page)
+        return await transform_items(service, items), total, bool(items)
+
+    services = pending_services()
+    starts = {service: first_page(service) for service in services}
+    first_pages = await asyncio.gather(*(fetch(service, starts[service]) for service in services))
+
+    pending = {}
+    for service, (_, total, has_items) in zip(services, first_pages):
+        max_pages = math.ceil(total / PAGE_LIMIT) if total else 1
+        pending[service] = [
+            asyncio.create_task(fetch(service, page)) for page in range(starts[service] + 1, max_pages + 1)
+        ] if has_items else []
+
+    try:
+        for service, (block, _, has_items) in zip(services, first_pages):
+            start = starts[service]
+            if not has_items:
+                print(f"No data for service {service} on page {start}. Skipping.")
+                service_done(service)
+                continue
+
+            new_count = write_rows(service, block)
+            print(f"For service {service}, page {start} processed. Found {new_count} new records.")
+            page_done(service, start)
+            for page, task in enumerate(pending[service], start=start + 1):
+                block, _, _ = await task
+                new_count = write_rows(service, block)
                 print(f"For service {service}, page {page} processed. Found {new_count} new records.")
+                page_done(service, page)
+            service_done(service)
+    finally:
+        # Don't leave fetches running if the crawl is interrupted
+        for tasks in pending.values():
+            for task in tasks:
+                task.cancel()
+
+def open_rollup(sink, append, resumed):
+    """
+    The rollup the crawl's new rows are folded into: the saved one when
+    appending to the outputs, rebuilt from the CSV if that one is missing or
+    out of step with it, or from the partial CSV of a resumed crawl.
+    """
+    rollup = Rollup(CSV_COLUMNS, ROLLUP_DIMENSIONS)
+    if append:
+        if rollup.load(ROLLUP_CSV_FILENAME) and \
+                sum(count for count, _ in rollup.groups.values()) == sink.content.records:
+            return rollup
+        rollup = Rollup(CSV_COLUMNS, ROLLUP_DIMENSIONS)
+        rollup.add_csv(CSV_FILENAME)
+    elif resumed:
+        rollup.add_csv(sink.csv_path)
+    return rollup
+
+def open_partitions(sink, append, resumed, json_format, indent, partition_by):
+    """
+    The partitioned sink the crawl's new rows are written to: appending to
+    the partitions when they hold the same rows as the outputs, otherwise
+    replacing them. None when they can't follow the crawl (a resumed crawl,
+    or partitions out of step with the outputs) and have to be rebuilt from
+    the finished JSON by save_partitions().
+    """
+    from etl.partitions import PartitionedSink, can_append
+
+    if resumed:
+        return None
+    if append:
+        if not can_append(PARTITIONS_DIR, CSV_COLUMNS, json_format, indent, grain=partition_by,
+                          content=sink.content.hexdigest()):
+            return None
+        return PartitionedSink(PARTITIONS_DIR, CSV_COLUMNS, json_format, indent, append=True, grain=partition_by)
+    return PartitionedSink(PARTITIONS_DIR, CSV_COLUMNS, json_format, indent, grain=partition_by)
 
-                # If we've reached the last page or found no new records, stop.
-                if page >= max_pages or new_count == 0:
-                    break
-
-                page += 1
-                items, _ = await fetch_page(session, service, page)
-                await asyncio.sleep(REQUEST_DELAY)
-
-    # After all services and pages are done, save results
-    if all_data:
-        df = pd.DataFrame(all_data)
-        csv_filename = "transactions_data.csv"
-        json_filename = "transactions_data.json"
-
-        df.to_csv(csv_filename, index=False)
-        df.to_json(json_filename, orient="records", indent=4)
-
-        # Upload JSON to jsonBlob
-        json_blob_url = "https://jsonblob.com/api/jsonBlob"
-        async with aiohttp.ClientSession() as session2:
-            with open(json_filename, "r") as json_file:
-                json_data = json.load(json_file)
-            response = await session2.post(json_blob_url, json=json_data, headers={"Content-Type": "application/json"})
-
-            if response.status in [200, 201]:
-                json_blob_link = response.headers.get("Location", "No URL returned")
-                print(f"JSON Blob created successfully: {json_blob_link}")
+def save_partitions(json_filename, json_format, indent, partition_by):
+    """Closes the partitioned sink, first rebuilding the partitions from the JSON output if there is none."""
+    global partitions
+    from etl.partitions import PartitionedSink
+
+    with metrics.timer("partition", pipeline="txs"):
+        if partitions is None:
+            partitions = PartitionedSink(PARTITIONS_DIR, CSV_COLUMNS, json_format, indent, grain=partition_by)
+            partitions.write_json(json_filename)
+        partitions.close()
+    print(f"Partitions saved: {PARTITIONS_DIR} ({partitions.written} written, "
+          f"{partitions.unchanged} unchanged, {partitions.removed} removed)")
+
+async def run(client, concurrent=False, max_in_flight=MAX_IN_FLIGHT, incremental=False,
+              json_format="array", parquet=False, resume=False, indent=None, transform_workers=None,
+              partitioned=False, partition_by="month"):
+    """
+    Crawls the transactions with `client`, writes the outputs and uploads
+    the JSON. With `resume`, a full crawl continues from its last checkpoint.
+    The JSON is compact unless an `indent` is given. Pages are transformed
+    in `transform_workers` processes (0: inline), by default one per core in
+    concurrent mode and inline otherwise. With `partitioned`, the rows are
+    also written to partitions by service and `partition_by` (month or day).
+    """
+    global seen_records, sink, columnar, metrics, checkpoint, transformer, rollup, partitions
+    if resume and (incremental or parquet):
+        raise ValueError("resume only applies to full crawls without Parquet output")
+    metrics = client.metrics
+    json_filename = JSON_FILENAME if json_format == "array" else NDJSON_FILENAME
+    watermarks = load_watermarks() if incremental else None
+    # Only append when the outputs match a previous run's watermarks
+    append = watermarks is not None and os.path.exists(CSV_FILENAME) and os.path.exists(json_filename)
+    if incremental and not append:
+        print("No sync state found, starting a full incremental sync.")
+        watermarks = {}
+    stages = StageState(stages_path(json_filename))
+    checkpoint = None
+    state = None
+    if incremental:
+        # Rows already in the outputs stay deduped when appending; a full rewrite starts clean
+        seen_records = DedupeStore(DEDUPE_FILENAME, reset=not append)
+        sink = StreamingSink(CSV_FILENAME, json_filename, CSV_COLUMNS, json_format=json_format,
+                             indent=indent, append=append, stages=stages)
+    else:
+        settings = {"json_format": json_format, "indent": indent}
+        seen_records, state = open_store(
+            DEDUPE_FILENAME, settings, resume,
+            lambda state: StreamingSink.can_resume(CSV_FILENAME, json_filename, state["sink"]))
+        sink = StreamingSink(CSV_FILENAME, json_filename, CSV_COLUMNS, json_format=json_format,
+                             indent=indent, stages=stages, resume=state["sink"] if state else None)
+        checkpoint = Checkpoint(seen_records, sink, settings, state)
+    rollup = open_rollup(sink, append, state is not None)
+    partitions = None
+    if partitioned:
+        partitions = open_partitions(sink, append, state is not None, json_format, indent, partition_by)
+    columnar = None
+    if parquet:
+        from etl.columnar import ParquetSink
+        columnar = ParquetSink(PARQUET_DIR, append=append and os.path.isdir(PARQUET_DIR))
+
+    if transform_workers is None:
+        transform_workers = default_workers() if concurrent else 0
+    transformer = TransformPool(transform_workers, max_pending=max_in_flight)
+    try:
+        with metrics.timer("crawl", pipeline="txs"):
+            if incremental:
+                await crawl_incremental(client, watermarks)
+            elif concurrent:
+                await crawl_concurrent(client, max_in_flight)
+            else:
+                await crawl_sequential(client)
+    except BaseException:
+        if columnar is not None:
+            columnar.discard()
+        if partitions is not None:
+            partitions.discard()
+        if checkpoint is not None:
+            # Keep the partial outputs and dedupe keys up to the last checkpoint
+            sink.suspend()
+            seen_records.close(flush=False)
+            print("Crawl interrupted; rerun with --resume to continue from the last checkpoint.")
+        else:
+            sink.discard()
+            seen_records.close()
+        raise
+    finally:
+        transformer.close()
+    metrics.record_dedupe(seen_records, pipeline="txs")
+    if checkpoint is not None:
+        checkpoint.finish()
+
+    # After all services and pages are done, finish the outputs
+    if not sink.rows:
+        sink.discard()
+        if columnar is not None:
+            columnar.discard()
+        if partitions is not None:
+            partitions.discard()
+        elif partitioned and append:
+            save_partitions(json_filename, json_format, indent, partition_by)
+        seen_records.close()
+        print("Already up to date." if incremental else "No data fetched.")
+        return
+
+    with metrics.timer("write", pipeline="txs"):
+        sink.close()
+        if columnar is not None:
+            if sink.skipped and os.path.isdir(PARQUET_DIR):
+                # Same records as the last run: the existing Parquet parts still hold them
+                columnar.discard()
             else:
-                print(f"Failed to create JSON Blob: {response.status}")
+                columnar.close()
+                print(f"Parquet file saved: {columnar.filename} (Records: {columnar.rows})")
+        if not sink.skipped or not os.path.exists(ROLLUP_JSON_FILENAME):
+            rollup.save(ROLLUP_CSV_FILENAME, ROLLUP_JSON_FILENAME)
+            print(f"Rollup saved: {ROLLUP_CSV_FILENAME} ({len(rollup.groups)} groups)")
+    if partitioned:
+        save_partitions(json_filename, json_format, indent, partition_by)
+    with metrics.timer("index", pipeline="txs"):
+        refresh_index("transactions", CSV_FILENAME, append=append)
+    seen_records.close()
+    if incremental:
+        save_watermarks(watermarks)
 
-        print(f"CSV file saved: {csv_filename} (Records: {len(df)})")
-        print(f"JSON file saved: {json_filename} (Records: {len(df)})")
+    if sink.skipped:
+        print(f"Transactions unchanged ({sink.rows} records); kept {CSV_FILENAME} and {json_filename}")
     else:
-        print("No data fetched.")
+        action = "appended to" if append else "saved"
+        print(f"CSV file {action}: {CSV_FILENAME} (Records: {sink.rows}, Size: {sink.csv_bytes} bytes)")
+        print(f"JSON file {action}: {json_filename} (Records: {sink.rows}, Size: {sink.json_bytes} bytes)")
+
+    # Upload JSON to jsonBlob
+    if stages.pending("upload"):
+        with metrics.timer("upload", pipeline="txs"):
+            uploaded = await upload_dataset(client.session, json_filename)
+        if uploaded:
+            stages.done("upload")
+        else:
+            stages.failed("upload")
+    with metrics.timer("upload", pipeline="txs"):
+        await upload_dataset(client.session, ROLLUP_JSON_FILENAME)
+    stages.report()
+
+async def main(concurrent=False, max_in_flight=MAX_IN_FLIGHT, rate=RATE_LIMIT, burst=RATE_BURST,
+               incremental=False, json_format="array", parquet=False, resume=False, indent=None,
+               transform_workers=None, partitioned=False, partition_by="month"):
+    api_key = require_api_key()
+    limiter = AdaptiveRateLimiter(rate, burst)
+    connector = aiohttp.TCPConnector(limit=max_in_flight)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        client = MessierClient(session, api_key, limiter, cache=default_cache())
+        await run(client, concurrent, max_in_flight, incremental, json_format, parquet, resume, indent,
+                  transform_workers, partitioned, partition_by)
+    client.metrics.export()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch platform transactions into CSV/JSON.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--concurrent', action='store_true',
+                      help="fetch all remaining pages of all services concurrently after page 1")
+    mode.add_argument('--incremental', action='store_true',
+                      help="only fetch transactions newer than the last synced watermark and append them")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue an interrupted full crawl from its last checkpoint")
+    parser.add_argument('--json-format', choices=["array", "ndjson"], default="array",
+                        help="write the JSON output as an array or as NDJSON")
+    parser.add_argument('--pretty', action='store_true',
+                        help="indent the JSON array (default: compact, one record per line)")
+    parser.add_argument('--parquet', action='store_true',
+                        help=f"also write a typed Parquet dataset to {os.path.basename(PARQUET_DIR)}/ (needs pyarrow)")
+    parser.add_argument('--partitioned', action='store_true',
+                        help=f"also write the rows to {os.path.basename(PARTITIONS_DIR)}/, partitioned by "
+                             "service and month, rewriting only the partitions that changed")
+    parser.add_argument('--partition-by', choices=["month", "day"], default="month",
+                        help="time grain of the --partitioned layout (default month)")
+    parser.add_argument('--transform-workers', type=int, metavar='N',
+                        help="transform pages in N worker processes, 0 for inline "
+                             "(default: one per core with --concurrent, inline otherwise)")
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT,
+                        help=f"max concurrent requests in --concurrent mode (default {MAX_IN_FLIGHT})")
+    parser.add_argument('--rate', type=float, default=RATE_LIMIT,
+                        help=f"initial requests per second, adapted from 429s (default {RATE_LIMIT})")
+    parser.add_argument('--burst', type=int, default=RATE_BURST,
+                        help=f"rate limiter burst size (default {RATE_BURST})")
+    args = parser.parse_args()
+    if args.resume and (args.incremental or args.parquet):
+        parser.error("--resume can't be combined with --incremental or --parquet")
+    return args
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    args = parse_args()
+    asyncio.run(main(args.concurrent, args.max_in_flight, args.rate, args.burst, args.incremental,
+                     args.json_format, args.parquet, args.resume, 4 if args.pretty else None,
+                     args.transform_workers, args.partitioned, args.partition_by))
@@ -1,17 +1,36 @@
-import requests
-import json
+import aiohttp
+import argparse
+import asyncio
+
+from etl.fingerprint import StageState, stages_path
+from etl.upload import CHUNK_BYTES, upload_dataset
 
 proposals_file_path = "proposals/proposals_data.json"
 virgo_file_path = "virgo/virgo_users_data.json"
-# Read JSON data
-with open(virgo_file_path, 'r') as file:
-    json_data = json.load(file)
 
-# Upload to JSONBlob (LazyAPI)
-response = requests.post("https://jsonblob.com/api/jsonBlob", json=json_data)
+async def main(paths, chunk_bytes):
+    async with aiohttp.ClientSession() as session:
+        for path in paths:
+            # Skip datasets whose content hasn't changed since their last upload
+            stages = StageState(stages_path(path))
+            if not stages.pending("upload", path):
+                stages.report()
+                continue
+            # Upload to JSONBlob (LazyAPI), in gzip chunks for large files
+            new_api_url = await upload_dataset(session, path, chunk_bytes)
+            if new_api_url:
+                stages.done("upload")
+                print(f"JSON successfully uploaded. Access it using the new API URL: {new_api_url}")
+            else:
+                stages.failed("upload")
+                print(f"Failed to upload {path}.")
+            stages.report()
 
-if response.status_code == 201:
-    new_api_url = response.headers['Location']
-    print(f"JSON successfully uploaded. Access it using the new API URL: {new_api_url}")
-else:
-    print(f"Failed to upload JSON. Status Code: {response.status_code}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload JSON datasets to jsonBlob.")
+    parser.add_argument("paths", nargs="*", default=[virgo_file_path],
+                        help=f"JSON or NDJSON files to upload (default {virgo_file_path})")
+    parser.add_argument("--chunk-bytes", type=int, default=CHUNK_BYTES,
+                        help=f"split datasets into blobs of about this many bytes (default {CHUNK_BYTES})")
+    args = parser.parse_args()
+    asyncio.run(main(args.paths, args.chunk_bytes))
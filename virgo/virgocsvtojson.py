@@ -1,18 +1,27 @@
-import csv
-import json
+import argparse
+import os
+import sys
 
-csv_file = "virgo_users_data.csv"
-json_file = "virgo_users_data.json"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl.csvjson import add_arguments, convert_stage
 
-# Read CSV and convert to JSON
-csv_data = []
-with open(csv_file, mode='r') as file:
-    reader = csv.DictReader(file)
-    for row in reader:
-        csv_data.append(row)
+OUTPUT_DIR = os.path.dirname(os.path.abspath(__file__))
+csv_file = os.path.join(OUTPUT_DIR, "virgo_users_data.csv")
+json_file = os.path.join(OUTPUT_DIR, "virgo_users_data.json")
 
-# Write to JSON file
-with open(json_file, mode='w') as file:
-    json.dump(csv_data, file, indent=4)
+def main():
+    parser = argparse.ArgumentParser(description=f"Convert {os.path.basename(csv_file)} to "
+                                                 f"{os.path.basename(json_file)}.")
+    add_arguments(parser)
+    args = parser.parse_args()
 
-print(f"Data converted to JSON and saved to {json_file}")
+    # Stream the CSV rows straight into the JSON file, unless the users haven't changed
+    rows = convert_stage(csv_file, json_file, args)
+
+    if rows is None:
+        print(f"{csv_file} unchanged since the last conversion; kept {json_file}")
+    else:
+        print(f"Data converted to JSON and saved to {json_file} ({rows} records)")
+
+if __name__ == "__main__":
+    main()
@@ -1,120 +1,134 @@
 import aiohttp
+import argparse
 import asyncio
-import csv
 import os
-from dotenv import load_dotenv
+import sys
 
-# Load environment variables from .env file
-load_dotenv()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl.cache import default_cache
+from etl.client import MessierClient, messier_url, require_api_key
+from etl.checkpoint import Checkpoint, open_store
+from etl.fingerprint import StageState, stages_path
+from etl.index import refresh_index
+from etl.metrics import sizeof_fmt
+from etl.paginate import prefetch_pages
+from etl.ratelimit import AdaptiveRateLimiter
+from etl.sinks import StreamingSink
 
-# Get the API key from the environment variable
-API_KEY = os.getenv('API_KEY')
+BASE_URL = messier_url('virgo/permissions')
 
-# Check if the API_KEY was loaded
-if not API_KEY:
-    raise ValueError("API_KEY not found. Please set it in the .env file.")
-
-BASE_URL = 'https://api.messier.app/api/v1/virgo/permissions'
-
-# Initialize variables
-page = 1
 limit = 100  # Adjust if the API allows higher limits
-all_data = []
-seen_addresses = set()
+# Outputs live next to this script
+OUTPUT_DIR = os.path.dirname(os.path.abspath(__file__))
+CSV_FILENAME = os.path.join(OUTPUT_DIR, 'virgo_users_data.csv')
+# Stage state is shared with virgocsvtojson.py and the upload, which work on the JSON
+STAGES_FILENAME = stages_path(os.path.join(OUTPUT_DIR, 'virgo_users_data.json'))
+CSV_COLUMNS = ['username', 'isactive', 'address', 'type', 'istypeActive', 'isDarklist', 'isActiveDarklist', 'stakeAmount']
+# Persistent dedupe index of addresses; reset each run since the CSV is rewritten. It
+# also holds the crawl's checkpoint: the last page written and the CSV offset.
+DEDUPE_FILENAME = os.path.join(OUTPUT_DIR, 'virgo_users_dedupe.sqlite')
+CHECKPOINT_KEY = 'permissions'
+SETTINGS = {'limit': limit}
 
-# Define maximum number of retries
-MAX_RETRIES = 5
-# Define delay between requests (in seconds)
-REQUEST_DELAY = 5
+# Initial request rate (requests per second); adapted from 429 responses
+RATE_LIMIT = 1.0
+# Pages kept in flight ahead of the one being processed
+PREFETCH_WINDOW = 5
 
-async def fetch_page(session, page):
-    retries = 0
-    while retries <= MAX_RETRIES:
-        url = f'{BASE_URL}?page={page}&limit={limit}'
-        print(f'Fetching page {page}...')
-        headers = {
-            'accept': 'application/json',
-            'X-API-KEY': API_KEY
-        }
-        async with session.get(url, headers=headers) as response:
-            if response.status == 429 or response.status == 400:
-                retry_after_message = (await response.json()).get('message', '')
-                retry_seconds = 60
-                if 'Retry after:' in retry_after_message:
-                    retry_seconds = int(retry_after_message.split('Retry after:')[1].split('seconds')[0].strip())
-                print(f'Rate limit exceeded. Retrying after {retry_seconds} seconds...')
-                await asyncio.sleep(retry_seconds)
-                retries += 1
-                continue
-            elif response.status != 200:
-                print(f'Error fetching data from API. Status code: {response.status}')
-                print(f'Response content: {await response.text()}')
-                retries += 1
-                await asyncio.sleep(5)
-                continue
-            try:
-                json_response = await response.json()
-                return json_response.get('data', {}).get('users', [])
-            except ValueError:
-                print('Failed to parse JSON response')
-                print(f'Response content: {await response.text()}')
-                retries += 1
-                await asyncio.sleep(5)
-                continue
-    print(f'Failed to fetch data for page {page} after {retries} retries.')
-    return []
+async def fetch_page(client, page):
+    print(f'Fetching page {page}...')
+    json_response = await client.get_json(BASE_URL, params={'page': page, 'limit': limit})
+    if json_response is None:
+        print(f'Failed to fetch data for page {page}.')
+        return []
+    return json_response.get('data', {}).get('users', [])
 
-async def main():
-    async with aiohttp.ClientSession() as session:
-        page = 1
-        while True:
-            users = await fetch_page(session, page)
-            if not users:
-                break
-            print(f'Number of records fetched on page {page}: {len(users)}')
-            for user_entry in users:
-                user_info = user_entry.get('user', {})
-                address = user_info.get('address')
-                if address in seen_addresses:
-                    continue
-                seen_addresses.add(address)
-                all_data.append({
-                    'username': user_info.get('username'),
-                    'isactive': user_info.get('active'),
-                    'address': address,
-                    'type': user_entry.get('type'),
-                    'istypeActive': user_entry.get('active'),
-                    'isDarklist': user_entry.get('darkList'),
-                    'isActiveDarklist': user_entry.get('activeDarkList'),
-                    'stakeAmount': user_entry.get('stakeAmount')
-                })
-            page += 1
-            await asyncio.sleep(REQUEST_DELAY)  # Add delay between requests
+def last_page_of(page, users):
+    """An empty page ends the crawl before it, a short page ends it there."""
+    if not users:
+        return page - 1
+    if len(users) < limit:
+        return page
+    return None
 
-    if all_data:
-        csv_file = 'virgo_users_data.csv'
-        csv_columns = ['username', 'isactive', 'address', 'type', 'istypeActive', 'isDarklist', 'isActiveDarklist', 'stakeAmount']
+async def run(client, window=PREFETCH_WINDOW, resume=False):
+    """
+    Crawls the virgo permissions pages with `client`, keeping `window` pages
+    in flight, and streams the users CSV. Pages are processed in page order,
+    so the first occurrence of an address always wins. Progress is
+    checkpointed; with `resume` an interrupted crawl carries on from there.
+    """
+    metrics = client.metrics
+    seen_addresses, state = open_store(DEDUPE_FILENAME, SETTINGS, resume,
+                                       lambda state: StreamingSink.can_resume(CSV_FILENAME, None, state['sink']))
+    stages = StageState(STAGES_FILENAME)
+    sink = StreamingSink(CSV_FILENAME, None, CSV_COLUMNS, stages=stages,
+                         resume=state['sink'] if state else None)
+    checkpoint = Checkpoint(seen_addresses, sink, SETTINGS, state)
+    start = checkpoint.next_page(CHECKPOINT_KEY)
+    pages = prefetch_pages(lambda page: fetch_page(client, page), last_page_of, window, start)
+    try:
+        with metrics.timer('crawl', pipeline='virgo'):
+            async for page, users in pages:
+                print(f'Number of records fetched on page {page}: {len(users)}')
+                with metrics.timer('transform', pipeline='virgo'):
+                    for user_entry in users:
+                        user_info = user_entry.get('user', {})
+                        address = user_info.get('address')
+                        if not seen_addresses.add(address):
+                            continue
+                        sink.write({
+                            'username': user_info.get('username'),
+                            'isactive': user_info.get('active'),
+                            'address': address,
+                            'type': user_entry.get('type'),
+                            'istypeActive': user_entry.get('active'),
+                            'isDarklist': user_entry.get('darkList'),
+                            'isActiveDarklist': user_entry.get('activeDarkList'),
+                            'stakeAmount': user_entry.get('stakeAmount')
+                        })
+                checkpoint.page_done(CHECKPOINT_KEY, page)
+    except BaseException:
+        # Keep the partial CSV and dedupe keys up to the last checkpoint
+        sink.suspend()
+        seen_addresses.close(flush=False)
+        print('Crawl interrupted; rerun with --resume to continue from the last checkpoint.')
+        raise
+    checkpoint.finish()
+    metrics.inc('rows', sink.rows, pipeline='virgo')
+    metrics.record_dedupe(seen_addresses, pipeline='virgo')
+    seen_addresses.close()
+
+    if not sink.rows:
+        sink.discard()
+        print('No data to save.')
+    else:
         try:
-            with open(csv_file, 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=csv_columns)
-                writer.writeheader()
-                for data in all_data:
-                    writer.writerow(data)
-            print(f'Data successfully saved to {csv_file}')
-            file_size = os.path.getsize(csv_file)
-            def sizeof_fmt(num, suffix='B'):
-                for unit in ['','K','M','G','T','P','E','Z']:
-                    if abs(num) < 1024.0:
-                        return f"{num:3.1f} {unit}{suffix}"
-                    num /= 1024.0
-                return f"{num:.1f} Y{suffix}"
-            readable_size = sizeof_fmt(file_size)
-            print(f'Size of the CSV file: {readable_size}')
-            print(f'Number of records saved: {len(all_data)}')
+            with metrics.timer('write', pipeline='virgo'):
+                sink.close()
+            with metrics.timer('index', pipeline='virgo'):
+                refresh_index('users', CSV_FILENAME)
+            if sink.skipped:
+                print(f'Users unchanged ({sink.rows} records); kept {CSV_FILENAME}')
+            else:
+                print(f'Data successfully saved to {CSV_FILENAME}')
+                print(f'Size of the CSV file: {sizeof_fmt(sink.csv_bytes)}')
+                print(f'Number of records saved: {sink.rows}')
         except IOError:
             print('I/O error while writing to CSV file')
-    else:
-        print('No data to save.')
+            stages.failed('write')
+    stages.report()
+
+async def main(resume=False):
+    api_key = require_api_key()
+    async with aiohttp.ClientSession() as session:
+        client = MessierClient(session, api_key, AdaptiveRateLimiter(RATE_LIMIT), cache=default_cache())
+        await run(client, resume=resume)
+    client.metrics.export()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Fetch the virgo permission users into CSV.")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue an interrupted crawl from its last checkpoint")
+    args = parser.parse_args()
+    asyncio.run(main(args.resume))